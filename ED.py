@@ -1,15 +1,24 @@
 # =========================
 # THƯ VIỆN BẮT BUỘC VÀ BỔ SUNG
 # =========================
+import time
+_IMPORT_T0 = time.perf_counter()
 from datetime import datetime
 import os
 import numpy as np
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import plotly.graph_objects as go
+from sklearn.model_selection import train_test_split, cross_val_predict, StratifiedKFold
+from sklearn.isotonic import IsotonicRegression
+from sklearn.neighbors import KDTree
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.preprocessing import StandardScaler
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline
+from sklearn.base import BaseEstimator, TransformerMixin
+from scipy.special import ndtr, ndtri
 from sklearn.metrics import (
     confusion_matrix,
     f1_score,
@@ -17,54 +26,387 @@ from sklearn.metrics import (
     recall_score,
     precision_score,
     roc_auc_score,
-    ConfusionMatrixDisplay,
 )
-import time
+import json
+import re
+import html
+import sqlite3
+import hashlib
+import hmac
+import calendar
+import unicodedata
+import threading
+import urllib.error
+import urllib.request
+import random
+import warnings
+import shutil
+import pickle
+import subprocess
+import sys
+import traceback
+import zipfile
+from io import BytesIO
+from contextlib import closing, contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from ed_headless import ED_MODULE_NAME  # Tên module của ED.py trong worker (lớp trong mô hình pickle)
 
-# Thư viện RSS Feed
 try:
-    import feedparser
-    _FEEDPARSER_OK = True
-except Exception:
-    feedparser = None
-    _FEEDPARSER_OK = False
+    import fcntl  # Khóa liên tiến trình (Linux/macOS)
+except ImportError:
+    fcntl = None
+
+# =========================
+# THƯ VIỆN NẶNG: NẠP KHI DÙNG LẦN ĐẦU
+# =========================
+# matplotlib (biểu đồ), google-genai/openai (AI), python-docx (Word) và feedparser (RSS) chỉ cần
+# cho một trang hoặc một nút: cờ *_OK kiểm tra bằng find_spec (không import), module thật chỉ được
+# nạp ở lần truy cập thuộc tính đầu tiên. Worker mới khởi động chỉ tốn Streamlit + NumPy/pandas/sklearn.
+# Cờ *_OK chỉ cho biết thư viện đã cài: bản cài hỏng vẫn là True và báo lỗi ở lần dùng đầu tiên.
+# Bảng thời gian nạp và các module lười nằm trong ed_imports (một lần mỗi tiến trình, không theo rerun).
+from ed_imports import IMPORT_TIMINGS, STARTUP_KEY, has_module, lazy_module, record_startup
+
+
+def import_report() -> pd.DataFrame:
+    """Bảng thời gian nạp thư viện: phần nạp sẵn khi khởi động và từng thư viện nạp khi dùng."""
+    rows = [{"Thư viện": name, "Thời gian (giây)": secs, "Nạp khi": "dùng lần đầu"}
+            for name, secs in IMPORT_TIMINGS.items() if name != STARTUP_KEY]
+    rows.insert(0, {"Thư viện": "Streamlit, NumPy, pandas, scikit-learn, Plotly",
+                    "Thời gian (giây)": IMPORT_TIMINGS.get(STARTUP_KEY, np.nan), "Nạp khi": "khởi động"})
+    return pd.DataFrame(rows)
+
+
+# Thư viện biểu đồ tĩnh (trang Xây dựng mô hình, biểu đồ chỉ số, báo cáo Word): chỉ dùng Figure hướng
+# đối tượng, không dùng pyplot (trạng thái figure toàn cục dùng chung giữa các luồng phiên)
+mpl = lazy_module("matplotlib")
+mpl_figure = lazy_module("matplotlib.figure")
+
+# Thư viện RSS Feed
+_FEEDPARSER_OK = has_module("feedparser")
+feedparser = lazy_module("feedparser") if _FEEDPARSER_OK else None
 
 # Thư viện GOOGLE GEMINI VÀ OPENAI (Giữ nguyên logic kiểm tra thư viện)
-try:
-    from google import genai
-    from google.genai.errors import APIError
-    _GEMINI_OK = True
-except Exception:
-    genai = None
-    APIError = Exception
-    _GEMINI_OK = False
+_GEMINI_OK = has_module("google.genai")
+genai = lazy_module("google.genai") if _GEMINI_OK else None
 
-try:
-    from openai import OpenAI
-    _OPENAI_OK = True
-except Exception:
-    OpenAI = None
-    _OPENAI_OK = False
+_OPENAI_OK = has_module("openai")
+openai = lazy_module("openai") if _OPENAI_OK else None
 
-# Thư viện Word Export
-try:
-    from docx import Document
-    from docx.shared import Inches, Pt, RGBColor
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from docx.oxml.ns import qn
-    from docx.oxml import OxmlElement
-    from io import BytesIO
-    _WORD_OK = True
-except Exception:
-    _WORD_OK = False
+# Thư viện Word Export (các lớp python-docx được import trong generate_word_report)
+_WORD_OK = has_module("docx")
+
+record_startup(time.perf_counter() - _IMPORT_T0)
 
 MODEL_NAME = "gemini-2.5-flash"
+OPENAI_MODEL_NAME = "gpt-4o-mini"
+
+# Điều phối AI: thứ tự ưu tiên, deadline mỗi lượt gọi, ngưỡng hedge và circuit breaker
+AI_PROVIDER_ORDER = ("gemini", "openai")
+AI_CALL_DEADLINE_S = 60.0      # Tổng thời gian tối đa cho một yêu cầu AI
+AI_HEDGE_PERCENTILE = 95       # Gửi yêu cầu dự phòng khi nhà cung cấp chính vượt p95 độ trễ
+AI_HEDGE_DEFAULT_S = 12.0      # Ngưỡng hedge khi chưa đủ mẫu độ trễ
+AI_HEDGE_MIN_SAMPLES = 5
+AI_LATENCY_WINDOW = 200        # Số mẫu độ trễ giữ lại cho mỗi nhà cung cấp
+AI_BREAKER_FAILURES = 3        # Số lỗi liên tiếp để ngắt nhà cung cấp
+AI_BREAKER_COOLDOWN_S = 60.0   # Thời gian bỏ qua nhà cung cấp khi đã ngắt
+
+# Kho dữ liệu cục bộ bền vững (dùng chung giữa các worker, giữ qua các lần khởi động lại)
+DATA_STORE_DIR = os.environ.get("ED_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ed_store"))
+GSO_STORE_PATH = os.path.join(DATA_STORE_DIR, "gso_macro.sqlite")
+GSO_FIRST_QUARTER = (2021, 1)  # Quý đầu tiên của chuỗi dữ liệu vĩ mô
+GSO_REFRESH_RETRY_S = 6 * 3600  # Sau mỗi lần hỏi AI (thành công hay lỗi), không hỏi lại trong 6 giờ
+
+# Bộ nhớ đệm nạp dữ liệu: mỗi file tải lên được đọc một lần, lưu thành cột NumPy memory-map theo SHA-256
+INGEST_CACHE_DIR = os.path.join(DATA_STORE_DIR, "ingest")
+INGEST_CACHE_MAX_ENTRIES = 32
+WORKBOOK_CACHE_ENTRIES = 64    # Số hồ sơ Excel (theo SHA-256) giữ kết quả tính chỉ số, bỏ bớt theo LRU
+# X_1..X_14 giữ float64 như khi đọc thẳng CSV để hệ số và PD của mô hình không đổi; default -> int8
+INGEST_DTYPES = {**{f"X_{i}": np.float64 for i in range(1, 15)}, "default": np.int8}
+
+# Tin tức RSS
+RSS_TTL_S = 7200               # Tin được coi là mới trong 120 phút
+RSS_FETCH_TIMEOUT_S = 8.0      # Deadline cho mỗi nguồn tin
+RSS_ERROR_TTL_S = 120          # Nguồn lỗi/quá hạn: không thử lại trong 2 phút, các lượt rerun dùng lỗi đã lưu
+RSS_MAX_ARTICLES = 5           # Số bài hiển thị mỗi nguồn
+RSS_USER_AGENT = "Mozilla/5.0 (compatible; CreditRiskNewsBot/2.0)"
+NEWS_ARCHIVE_PATH = os.path.join(DATA_STORE_DIR, "news_archive.sqlite")
+NEWS_TZ = "Asia/Ho_Chi_Minh"   # Múi giờ hiển thị và lọc theo ngày của kho tin (giờ lưu là Unix timestamp)
+RSS_SOURCES = {
+    "📊 CafeF": "https://cafef.vn/thi-truong-chung-khoan.rss",
+    "💼 Vietstock": "https://vietstock.vn/rss/tai-chinh.rss",
+    "💰 Báo Đầu tư": "https://baodautu.vn/rss/kinh-doanh.rss",
+    "🏢 VNExpress Kinh doanh": "https://vnexpress.net/rss/kinh-doanh.rss"
+}
+# Khóa watchlist phải đủ đặc trưng để tránh khớp nhầm: từ 2 từ trở lên, hoặc một từ dài từ 6 ký tự
+BORROWER_MIN_KEY_TOKENS = 2
+BORROWER_MIN_KEY_LEN = 6
+
+# Tiền xử lý X_1..X_14: cắt đuôi theo phân vị (winsorize) trước khi điền thiếu và chuẩn hóa
+WINSOR_QUANTILES = (0.01, 0.99)
+LOGREG_MAX_ITER = 200
+
+# Hiệu chỉnh PD (fit trên điểm out-of-fold) và thang xếp hạng (master scale)
+PD_CALIBRATION_FOLDS = 5
+PD_ISOTONIC_MIN_DEFAULTS = 100   # Đủ số quan sát vỡ nợ thì dùng isotonic, ít hơn dùng Platt
+PD_FLOOR = 0.0003                # PD tối thiểu 3 điểm cơ bản
+PD_MASTER_SCALE = (              # (hạng, cận trên PD - tính cả cận, mô tả)
+    ("AAA", 0.0005, "Rủi ro rất thấp"),
+    ("AA", 0.0015, "Rủi ro thấp"),
+    ("A", 0.004, "Rủi ro khá thấp"),
+    ("BBB", 0.01, "Rủi ro trung bình thấp"),
+    ("BB", 0.03, "Rủi ro trung bình"),
+    ("B", 0.08, "Rủi ro trung bình cao"),
+    ("CCC", 0.20, "Rủi ro cao"),
+    ("CC", 0.40, "Rủi ro rất cao"),
+    ("C", 1.0, "Sát vỡ nợ"),
+)
+
+# Huấn luyện dạng luồng cho lịch sử vỡ nợ lớn (đọc CSV theo khối, bộ nhớ không phụ thuộc kích thước file)
+TRAIN_CSV_PATH = os.environ.get("ED_TRAIN_CSV", "DATASET.csv")
+STREAM_TRAIN_AUTO_BYTES = 200 * 1024 * 1024  # Tự bật chế độ luồng khi file huấn luyện từ 200 MB
+STREAM_CHUNK_ROWS = 100_000
+STREAM_TEST_FRACTION = 0.2
+STREAM_EPOCHS = 3
+STREAM_SAMPLE_ROWS = 5000      # Mẫu ngẫu nhiên giữ lại để hiển thị thống kê/biểu đồ
+STREAM_AUC_BINS = 2000         # Số bin histogram xác suất để tính AUC dạng luồng
+
+# Tra cứu doanh nghiệp tương tự (k láng giềng gần nhất trên X đã chuẩn hóa)
+SIMILAR_K = 5
+SIMILAR_OUTCOME_COLS = ("default", "LGD", "EAD")
+
+# Dashboard GSO: chuỗi dài hơn ngưỡng này được rút gọn (LTTB) trước khi gửi xuống trình duyệt
+CHART_MAX_POINTS = 200
+
+# Biểu đồ tĩnh: render PNG một lần theo dữ liệu, dùng lại cho mọi rerun và báo cáo Word
+CHART_DPI = 150
+CHART_CACHE_ENTRIES = 256
+
+# Làm ấm cache nền: làm mới RSS/dữ liệu vĩ mô trước khi hết hạn để người dùng không phải chờ
+CACHE_WARMER_ENABLED = os.environ.get("ED_CACHE_WARMER", "1") != "0"
+CACHE_WARM_INTERVAL_S = float(os.environ.get("ED_CACHE_WARM_INTERVAL_S", "600"))
+CACHE_WARM_JITTER = 0.2        # Chu kỳ dao động ±20% để các worker không làm mới cùng lúc
+RSS_REFRESH_AHEAD_S = 1200     # Làm mới RSS khi còn dưới 20 phút là hết hạn
+
+# Đo hiệu năng: thời gian từng phần của lượt rerun và tỷ lệ trúng cache (trang quản trị ?admin=<ADMIN_TOKEN>)
+PERF_WINDOW = 500              # Số mẫu thời gian giữ lại cho mỗi phần (tính percentile)
+PERF_LOG_PATH = os.path.join(DATA_STORE_DIR, "perf_metrics.jsonl")
+PERF_LOG_INTERVAL_S = float(os.environ.get("ED_PERF_LOG_INTERVAL_S", "60"))  # 0 = không ghi log
+
+# Công việc nền: tác vụ CPU nặng chạy ở tiến trình worker (ed_jobs.py), phiên chỉ gửi job và theo dõi tiến độ
+JOBS_DB_PATH = os.path.join(DATA_STORE_DIR, "jobs.sqlite3")
+JOBS_DIR = os.path.join(DATA_STORE_DIR, "jobs")   # <job_id>/input (file gửi kèm), <job_id>/output (kết quả)
+JOB_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ed_jobs.py")
+JOB_WORKERS = int(os.environ.get("ED_JOB_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))  # Số tiến trình con chạy job
+JOB_AUTOSTART = os.environ.get("ED_JOB_AUTOSTART", "1") != "0"  # Phiên tự chạy ed_jobs.py khi chưa có worker
+JOB_WORKER_IDLE_EXIT_S = 600   # Worker tự khởi động thoát sau 10 phút không có job
+JOB_WORKER_START_GRACE_S = 30  # Không khởi động thêm worker trong lúc worker vừa khởi động còn đang nạp ED.py
+JOB_LEASE_S = 60.0             # Job đang chạy không được gia hạn quá thời gian này (worker chết) thì xếp lại hàng đợi
+JOB_MAX_ATTEMPTS = 2
+JOB_PROGRESS_INTERVAL_S = 0.5  # Ghi tiến độ tối đa 2 lần/giây cho mỗi job
+JOB_POLL_S = 2.0               # Chu kỳ làm mới danh sách job trên giao diện khi còn job chưa xong
+JOB_RETENTION_DAYS = 7         # Job đã kết thúc (kèm file kết quả) được xóa sau 7 ngày
+JOB_LIST_LIMIT = 20
+JOB_SCORE_CHUNK_ROWS = 20_000  # Chấm điểm danh mục theo lô để báo tiến độ và dừng được giữa chừng
+
+# Mô phỏng Monte Carlo tổn thất danh mục (mô hình Vasicek một nhân tố)
+MC_DEFAULT_SCENARIOS = 20_000
+MC_MAX_SCENARIOS = 500_000
+MC_DEFAULT_RHO = 0.12          # Tương quan tài sản (cận dưới của công thức Basel IRB cho doanh nghiệp)
+MC_DEFAULT_LGD = 0.45          # LGD mặc định khi danh mục không có cột LGD (Basel IRB cơ bản, nợ không bảo đảm)
+MC_BATCH_CELLS = 2_000_000     # Số ô (kịch bản x khoản vay) mỗi lô mô phỏng, giới hạn bộ nhớ
+
+# =========================
+# ĐO HIỆU NĂNG: SPAN THỜI GIAN VÀ BỘ ĐẾM CACHE
+# =========================
+
+class PerfRegistry:
+    """
+    Thống kê thời gian theo phần (span) và số lần trúng/trượt của từng cache.
+
+    Một bản dùng chung cho cả tiến trình (get_perf_registry) và một bản cho mỗi phiên
+    (session_state); mỗi phần giữ PERF_WINDOW mẫu gần nhất để tính p50/p95/p99.
+    """
+
+    def __init__(self, window: int = PERF_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._spans = {}   # tên phần -> deque số giây
+        self._counts = {}  # tên phần -> tổng số lần đo (kể cả mẫu đã rơi khỏi cửa sổ)
+        self._caches = {}  # tên cache -> [trúng, trượt]
+        self._last_flush = time.time()
+
+    def record(self, name: str, secs: float):
+        with self._lock:
+            self._spans.setdefault(name, deque(maxlen=self._window)).append(secs)
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def count_cache(self, name: str, hit: bool):
+        with self._lock:
+            self._caches.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def as_dict(self) -> dict:
+        """Dạng máy đọc được: spans (ms) và caches (hits/misses/hit_rate)."""
+        with self._lock:
+            spans = {name: np.array(samples) * 1000.0 for name, samples in self._spans.items()}
+            counts = dict(self._counts)
+            caches = {name: tuple(hm) for name, hm in self._caches.items()}
+        return {
+            "spans": {
+                name: {
+                    "count": counts[name],
+                    "p50_ms": float(np.percentile(ms, 50)),
+                    "p95_ms": float(np.percentile(ms, 95)),
+                    "p99_ms": float(np.percentile(ms, 99)),
+                    "max_ms": float(ms.max()),
+                }
+                for name, ms in sorted(spans.items())
+            },
+            "caches": {
+                name: {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+                for name, (hits, misses) in sorted(caches.items())
+            },
+        }
+
+    def span_table(self) -> pd.DataFrame:
+        spans = self.as_dict()["spans"]
+        table = pd.DataFrame.from_dict(spans, orient="index", columns=["count", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+        table.columns = ["Số lần", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Tối đa (ms)"]
+        table.index.name = "Phần"
+        return table
+
+    def cache_table(self) -> pd.DataFrame:
+        caches = self.as_dict()["caches"]
+        table = pd.DataFrame.from_dict(caches, orient="index", columns=["hits", "misses", "hit_rate"])
+        table.columns = ["Trúng", "Trượt", "Tỷ lệ trúng"]
+        table.index.name = "Cache"
+        return table
+
+    def maybe_flush(self, path: str = PERF_LOG_PATH, interval_s: float = PERF_LOG_INTERVAL_S) -> bool:
+        """Ghi một dòng JSON (ts, pid, spans, caches) vào log khi đã qua interval_s kể từ lần ghi trước."""
+        if interval_s <= 0:
+            return False
+        with self._lock:
+            now = time.time()
+            if now - self._last_flush < interval_s:
+                return False
+            self._last_flush = now
+        line = json.dumps({"ts": datetime.now().isoformat(timespec="seconds"), "pid": os.getpid(), **self.as_dict()},
+                          ensure_ascii=False)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            return False
+        return True
+
+
+@st.cache_resource
+def get_perf_registry() -> PerfRegistry:
+    """Thống kê hiệu năng dùng chung cho mọi phiên trong tiến trình."""
+    return PerfRegistry()
+
+
+def _session_perf():
+    """Thống kê của phiên hiện tại; None khi chạy ngoài lượt script (thread nền, chạy headless)."""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return st.session_state.setdefault("_perf_session", PerfRegistry())
+
+
+def perf_record(name: str, secs: float):
+    get_perf_registry().record(name, secs)
+    session = _session_perf()
+    if session is not None:
+        session.record(name, secs)
+
+
+def perf_cache(name: str, hit: bool):
+    get_perf_registry().count_cache(name, hit)
+    session = _session_perf()
+    if session is not None:
+        session.count_cache(name, hit)
+
+
+@contextmanager
+def perf_span(name: str):
+    """Đo thời gian một phần (dùng với `with` hoặc làm decorator)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        perf_record(name, time.perf_counter() - t0)
+
+
+_CACHE_MISSES = threading.local()
+
+
+def note_cache_miss():
+    """Gọi trong thân hàm được cache: thân hàm chỉ chạy khi trượt cache."""
+    _CACHE_MISSES.count = getattr(_CACHE_MISSES, "count", 0) + 1
+
+
+@contextmanager
+def perf_cache_lookup(name: str):
+    """Đếm trúng/trượt cho một lần gọi hàm st.cache_* (thân hàm gọi note_cache_miss)."""
+    before = getattr(_CACHE_MISSES, "count", 0)
+    yield
+    perf_cache(name, hit=getattr(_CACHE_MISSES, "count", 0) == before)
+
+
+def _secret(name: str):
+    """Secret Streamlit hoặc biến môi trường ED_<name>; None khi không có file secrets."""
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        value = None
+    return value or os.environ.get(f"ED_{name}")
+
+
+def is_admin_request() -> bool:
+    """Trang quản trị chỉ mở khi URL có ?admin=<ADMIN_TOKEN> khớp secret ADMIN_TOKEN."""
+    token = _secret("ADMIN_TOKEN")
+    supplied = st.query_params.get("admin")
+    return bool(token and supplied) and hmac.compare_digest(str(supplied), str(token))
+
+
+def render_perf_panel():
+    """Bảng hiệu năng (quản trị): percentile theo phần, tỷ lệ trúng cache, xuất JSON."""
+    registry = get_perf_registry()
+    session = _session_perf()
+    with st.sidebar.expander("🩺 Hiệu năng (quản trị)", expanded=False):
+        st.caption(f"Tiến trình {os.getpid()} · log JSON: `{PERF_LOG_PATH}`")
+        st.markdown("**Thời gian theo phần (tiến trình)**")
+        st.dataframe(registry.span_table().style.format("{:.1f}", subset=["p50 (ms)", "p95 (ms)", "p99 (ms)", "Tối đa (ms)"]),
+                     use_container_width=True)
+        st.markdown("**Cache (tiến trình)**")
+        st.dataframe(registry.cache_table().style.format({"Tỷ lệ trúng": "{:.0%}"}), use_container_width=True)
+        if session is not None:
+            st.markdown("**Thời gian theo phần (phiên này)**")
+            st.dataframe(session.span_table().style.format("{:.1f}", subset=["p50 (ms)", "p95 (ms)", "p99 (ms)", "Tối đa (ms)"]),
+                         use_container_width=True)
+        payload = {"pid": os.getpid(), "process": registry.as_dict(),
+                   "session": session.as_dict() if session is not None else None}
+        st.download_button("⬇️ Tải số liệu (JSON)", json.dumps(payload, ensure_ascii=False, indent=2),
+                           file_name="perf_metrics.json", mime="application/json", key="download_perf")
 
 # =========================
 # HÀM TẠO WORD REPORT
 # =========================
 
-def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_bar, fig_radar, company_name="KHÁCH HÀNG DOANH NGHIỆP"):
+def _png_stream(fig) -> BytesIO:
+    """Ảnh PNG đã render (bytes) hoặc Figure matplotlib -> luồng ảnh cho doc.add_picture."""
+    if isinstance(fig, (bytes, bytearray)):
+        return BytesIO(fig)
+    return BytesIO(figure_png(fig))
+
+
+@perf_span("docx")
+def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_bar, fig_radar, company_name="KHÁCH HÀNG DOANH NGHIỆP",
+                         pd_calibrated=np.nan, rating_grade=None, peer_percentiles=None):
     """
     Tạo báo cáo Word chuyên nghiệp từ kết quả phân tích tín dụng.
 
@@ -73,9 +415,12 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
     - pd_value: Xác suất vỡ nợ (PD) dưới dạng số float (0-1) hoặc NaN
     - pd_label: Nhãn dự đoán ("Default" hoặc "Non-Default")
     - ai_analysis: Text phân tích từ AI
-    - fig_bar: Matplotlib figure của bar chart
-    - fig_radar: Matplotlib figure của radar chart
+    - fig_bar: PNG (bytes, từ chart_image) hoặc Matplotlib figure của bar chart
+    - fig_radar: PNG (bytes, từ chart_image) hoặc Matplotlib figure của radar chart
     - company_name: Tên công ty (mặc định)
+    - pd_calibrated: PD đã hiệu chỉnh (0-1) hoặc NaN
+    - rating_grade: Hạng master scale (vd. "BBB") hoặc None
+    - peer_percentiles: Series phân vị (0-100) so với tổng thể huấn luyện, cùng index với ratios_display
 
     Returns:
     - BytesIO object chứa Word document
@@ -84,6 +429,15 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
     if not _WORD_OK:
         raise Exception("Thiếu thư viện python-docx. Vui lòng cài đặt: pip install python-docx Pillow")
 
+    # python-docx chỉ được nạp khi xuất báo cáo lần đầu
+    t0 = time.perf_counter()
+    from docx import Document
+    from docx.shared import Inches, Pt, RGBColor
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml.ns import qn
+    from docx.oxml import OxmlElement
+    IMPORT_TIMINGS.setdefault("docx", time.perf_counter() - t0)
+
     # Tạo document mới
     doc = Document()
 
@@ -147,6 +501,12 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
         pd_para.add_run(f"{pd_value:.2%}\n")
         pd_para.add_run("Phân loại: ").bold = True
         pd_para.add_run(f"{pd_label}\n")
+        if pd.notna(pd_calibrated):
+            pd_para.add_run("PD hiệu chỉnh: ").bold = True
+            pd_para.add_run(f"{pd_calibrated:.2%}\n")
+        if rating_grade and rating_grade in _PD_GRADE_DESC:
+            pd_para.add_run("Hạng tín nhiệm (master scale): ").bold = True
+            pd_para.add_run(f"{rating_grade} - {_PD_GRADE_DESC[rating_grade]}\n")
 
         if "Default" in pd_label and "Non-Default" not in pd_label:
             risk_run = pd_para.add_run("⚠️ RỦI RO CAO - CẦN XEM XÉT KỸ LƯỠNG")
@@ -168,13 +528,16 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
     heading2_run.font.color.rgb = RGBColor(255, 107, 157)  # #ff6b9d
 
     # Tạo bảng
-    table = doc.add_table(rows=1, cols=2)
+    has_peer = peer_percentiles is not None
+    table = doc.add_table(rows=1, cols=3 if has_peer else 2)
     table.style = 'Light Grid Accent 1'
 
     # Header row
     hdr_cells = table.rows[0].cells
     hdr_cells[0].text = 'Chỉ số Tài chính'
     hdr_cells[1].text = 'Giá trị'
+    if has_peer:
+        hdr_cells[2].text = 'Phân vị so với tổng thể'
 
     # Style header
     for cell in hdr_cells:
@@ -196,6 +559,10 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
         value = row['Giá trị']
         row_cells[1].text = f"{value:.4f}" if pd.notna(value) else "N/A"
         row_cells[1].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        if has_peer:
+            pct = peer_percentiles.get(idx, np.nan)
+            row_cells[2].text = f"P{pct:.0f}" if pd.notna(pct) else "N/A"
+            row_cells[2].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
 
     doc.add_paragraph()  # Spacer
 
@@ -208,10 +575,7 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
     # Bar chart
     try:
         doc.add_heading('3.1. Biểu đồ Cột - Giá trị các Chỉ số', level=2)
-        bar_buffer = BytesIO()
-        fig_bar.savefig(bar_buffer, format='png', dpi=150, bbox_inches='tight')
-        bar_buffer.seek(0)
-        doc.add_picture(bar_buffer, width=Inches(6))
+        doc.add_picture(_png_stream(fig_bar), width=Inches(6))
         last_paragraph = doc.paragraphs[-1]
         last_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
         doc.add_paragraph()  # Spacer
@@ -221,10 +585,7 @@ def generate_word_report(ratios_display, pd_value, pd_label, ai_analysis, fig_ba
     # Radar chart
     try:
         doc.add_heading('3.2. Biểu đồ Radar - Phân tích Đa chiều', level=2)
-        radar_buffer = BytesIO()
-        fig_radar.savefig(radar_buffer, format='png', dpi=150, bbox_inches='tight')
-        radar_buffer.seek(0)
-        doc.add_picture(radar_buffer, width=Inches(5))
+        doc.add_picture(_png_stream(fig_radar), width=Inches(5))
         last_paragraph = doc.paragraphs[-1]
         last_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
     except Exception as e:
@@ -284,10 +645,14 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Mốc bắt đầu lượt rerun (thời gian toàn trang được ghi ở cuối script)
+rerun_t0 = time.perf_counter()
+
 # ========================================
 # CSS NÂNG CẤP - PHONG CÁCH NGÂN HÀNG HIỆN ĐẠI
 # ========================================
-st.markdown("""
+with perf_span("css"):
+    st.markdown("""
 <style>
 /* ========== IMPORT GOOGLE FONTS ========== */
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;600;700;900&family=Playfair+Display:wght@700;900&display=swap');
@@ -668,17 +1033,227 @@ div[data-testid="stSpinner"] > div {
 
 
 # =========================
-# HÀM GỌI GEMINI API (GIỮ NGUYÊN LOGIC)
+# ĐIỀU PHỐI NHÀ CUNG CẤP AI (GEMINI / OPENAI): DEADLINE, HEDGE, CIRCUIT BREAKER
 # =========================
 
-def get_ai_analysis(data_payload: dict, api_key: str) -> str:
+class AIProviderError(Exception):
+    """Không nhà cung cấp AI nào trả lời được trong deadline."""
+
+
+def _call_gemini(sys_prompt: str, user_text: str, api_key: str, timeout_s: float) -> str:
+    """Gọi Gemini với timeout phía client (đơn vị ms theo google-genai)."""
+    client = genai.Client(api_key=api_key, http_options={"timeout": int(timeout_s * 1000)})
+    response = client.models.generate_content(
+        model=MODEL_NAME,
+        contents=[
+            {"role": "user", "parts": [{"text": user_text}]}
+        ],
+        config={"system_instruction": sys_prompt}
+    )
+    return response.text
+
+
+def _call_openai(sys_prompt: str, user_text: str, api_key: str, timeout_s: float) -> str:
     """
-    Sử dụng Gemini API để phân tích chỉ số tài chính.
+    Gọi OpenAI Chat Completions với timeout, không tự retry (router lo việc dự phòng).
+    Secret OPENAI_BASE_URL (tùy chọn) trỏ sang máy chủ tương thích OpenAI khác, vd. LLM giả lập khi kiểm thử tải.
     """
-    if not _GEMINI_OK:
-        return "Lỗi: Thiếu thư viện google-genai (cần cài đặt: pip install google-genai)."
+    client = openai.OpenAI(api_key=api_key, base_url=_secret("OPENAI_BASE_URL"), timeout=timeout_s, max_retries=0)
+    response = client.chat.completions.create(
+        model=OPENAI_MODEL_NAME,
+        messages=[
+            {"role": "system", "content": sys_prompt},
+            {"role": "user", "content": user_text},
+        ],
+    )
+    return response.choices[0].message.content
+
+
+_AI_PROVIDER_CALLS = {"gemini": _call_gemini, "openai": _call_openai}
+_AI_PROVIDER_OK = {"gemini": _GEMINI_OK, "openai": _OPENAI_OK}
+_AI_PROVIDER_LABELS = {"gemini": "Gemini", "openai": "OpenAI"}
+
+
+class AIProviderRouter:
+    """
+    Điều phối lời gọi LLM giữa Gemini (chính) và OpenAI (phụ).
+
+    - Mỗi yêu cầu có deadline tổng AI_CALL_DEADLINE_S.
+    - Nếu nhà cung cấp chính chưa trả lời sau ngưỡng p{AI_HEDGE_PERCENTILE} độ trễ của nó,
+      gửi thêm một yêu cầu song song (hedge) sang nhà cung cấp phụ và lấy kết quả về trước.
+      Nếu nhà cung cấp chính lỗi, chuyển ngay sang nhà cung cấp phụ (failover).
+    - Circuit breaker: sau AI_BREAKER_FAILURES lỗi liên tiếp, bỏ qua nhà cung cấp trong
+      AI_BREAKER_COOLDOWN_S giây, sau đó cho thử lại đúng một lượt (half-open).
+    - Độ trễ từng nhà cung cấp được ghi nhận để tính ngưỡng hedge và hiển thị.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-router")
+        self._stats = {
+            name: {
+                "latencies": deque(maxlen=AI_LATENCY_WINDOW),
+                "calls": 0,
+                "failures": 0,
+                "hedges": 0,
+                "consecutive_failures": 0,
+                "opened_at": None,
+                "half_open": False,
+            }
+            for name in AI_PROVIDER_ORDER
+        }
+
+    def _is_available(self, name: str, now: float) -> bool:
+        """Kiểm tra breaker (gọi khi đang giữ lock)."""
+        stats = self._stats[name]
+        if stats["opened_at"] is None:
+            return True
+        if not stats["half_open"] and now - stats["opened_at"] >= AI_BREAKER_COOLDOWN_S:
+            stats["half_open"] = True  # Cho phép một lượt thử lại
+            return True
+        return False
+
+    def _record(self, name: str, latency_s: float, ok: bool):
+        with self._lock:
+            stats = self._stats[name]
+            stats["calls"] += 1
+            if ok:
+                stats["latencies"].append(latency_s)
+                stats["consecutive_failures"] = 0
+                stats["opened_at"] = None
+                stats["half_open"] = False
+            else:
+                stats["failures"] += 1
+                stats["consecutive_failures"] += 1
+                if stats["half_open"] or stats["consecutive_failures"] >= AI_BREAKER_FAILURES:
+                    stats["opened_at"] = time.monotonic()
+                    stats["half_open"] = False
+
+    def hedge_delay(self, name: str) -> float:
+        """Ngưỡng chờ trước khi hedge = percentile độ trễ gần đây của nhà cung cấp."""
+        with self._lock:
+            latencies = list(self._stats[name]["latencies"])
+        if len(latencies) < AI_HEDGE_MIN_SAMPLES:
+            return AI_HEDGE_DEFAULT_S
+        return float(np.percentile(latencies, AI_HEDGE_PERCENTILE))
+
+    def _submit(self, name: str, sys_prompt: str, user_text: str, api_key: str, timeout_s: float):
+        call = _AI_PROVIDER_CALLS[name]
+
+        def run():
+            t0 = time.perf_counter()
+            try:
+                text = call(sys_prompt, user_text, api_key, timeout_s)
+                if not text:
+                    raise AIProviderError("phản hồi rỗng")
+            except Exception:
+                self._record(name, time.perf_counter() - t0, ok=False)
+                raise
+            self._record(name, time.perf_counter() - t0, ok=True)
+            return text
+
+        return self._executor.submit(run)
+
+    @perf_span("ai_call")
+    def generate(self, sys_prompt: str, user_text: str, api_keys: dict, deadline_s: float = AI_CALL_DEADLINE_S):
+        """
+        Sinh câu trả lời với deadline, hedge và failover.
+
+        Returns:
+            (text, provider_name)
+
+        Raises:
+            AIProviderError nếu mọi nhà cung cấp đều lỗi hoặc quá deadline.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            now = time.monotonic()
+            order = [
+                name for name in AI_PROVIDER_ORDER
+                if _AI_PROVIDER_OK[name] and api_keys.get(name) and self._is_available(name, now)
+            ]
+        if not order:
+            raise AIProviderError(
+                "Không có nhà cung cấp AI khả dụng (thiếu thư viện/API key hoặc đang tạm ngắt do lỗi liên tiếp)."
+            )
+
+        primary, backups = order[0], order[1:]
+        hedge_at = min(self.hedge_delay(primary), deadline_s)
+        pending = {self._submit(primary, sys_prompt, user_text, api_keys[primary], deadline_s): primary}
+        errors = []
+
+        while pending:
+            elapsed = time.perf_counter() - start
+            remaining = deadline_s - elapsed
+            if remaining <= 0:
+                break
+            timeout = max(0.0, min(remaining, hedge_at - elapsed)) if backups else remaining
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    return future.result(), name
+                except Exception as e:
+                    errors.append(f"{_AI_PROVIDER_LABELS[name]}: {e}")
+            # Failover (primary lỗi) hoặc hedge (primary chậm hơn ngưỡng percentile)
+            if backups and (not pending or time.perf_counter() - start >= hedge_at):
+                backup = backups.pop(0)
+                if pending:
+                    with self._lock:
+                        self._stats[primary]["hedges"] += 1
+                remaining = deadline_s - (time.perf_counter() - start)
+                pending[self._submit(backup, sys_prompt, user_text, api_keys[backup], remaining)] = backup
+
+        if not errors:
+            errors.append(f"quá thời hạn {deadline_s:g} giây")
+        raise AIProviderError("; ".join(errors))
+
+    def snapshot(self) -> pd.DataFrame:
+        """Thống kê độ trễ và trạng thái breaker của từng nhà cung cấp."""
+        rows = []
+        with self._lock:
+            now = time.monotonic()
+            for name in AI_PROVIDER_ORDER:
+                stats = self._stats[name]
+                latencies = np.array(stats["latencies"], dtype=float)
+                if stats["opened_at"] is None:
+                    state = "Đóng (hoạt động)"
+                elif now - stats["opened_at"] < AI_BREAKER_COOLDOWN_S:
+                    state = "Mở (tạm bỏ qua)"
+                else:
+                    state = "Nửa mở (chờ thử lại)"
+                rows.append({
+                    "Nhà cung cấp": _AI_PROVIDER_LABELS[name],
+                    "Số lượt gọi": stats["calls"],
+                    "Số lỗi": stats["failures"],
+                    "Số lần hedge": stats["hedges"],
+                    "p50 (giây)": float(np.percentile(latencies, 50)) if latencies.size else np.nan,
+                    "p95 (giây)": float(np.percentile(latencies, 95)) if latencies.size else np.nan,
+                    "Circuit breaker": state,
+                })
+        return pd.DataFrame(rows).set_index("Nhà cung cấp")
+
+
+@st.cache_resource
+def get_ai_router() -> AIProviderRouter:
+    """Router dùng chung cho mọi phiên trong tiến trình (giữ thống kê độ trễ và breaker)."""
+    return AIProviderRouter()
+
+
+def _ai_api_keys(gemini_api_key: str = None, openai_api_key: str = None) -> dict:
+    return {"gemini": gemini_api_key, "openai": openai_api_key}
+
+
+# =========================
+# HÀM GỌI AI (GEMINI CHÍNH, OPENAI DỰ PHÒNG)
+# =========================
 
-    client = genai.Client(api_key=api_key)
+def get_ai_analysis(data_payload: dict, api_key: str, openai_api_key: str = None) -> str:
+    """
+    Sử dụng LLM (Gemini, dự phòng OpenAI) để phân tích chỉ số tài chính.
+    """
+    if not (_GEMINI_OK or _OPENAI_OK):
+        return "Lỗi: Thiếu thư viện google-genai/openai (cần cài đặt: pip install google-genai openai)."
 
     sys_prompt = (
         "Bạn là chuyên gia phân tích tín dụng doanh nghiệp tại ngân hàng Việt Nam. "
@@ -692,36 +1267,31 @@ def get_ai_analysis(data_payload: dict, api_key: str) -> str:
     user_prompt = "Bộ chỉ số tài chính và PD cần phân tích:\n" + str(data_payload) + "\n\nHãy phân tích và đưa ra khuyến nghị."
 
     try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[
-                {"role": "user", "parts": [{"text": sys_prompt + "\n\n" + user_prompt}]}
-            ],
-            config={"system_instruction": sys_prompt}
+        text, _provider = get_ai_router().generate(
+            sys_prompt, sys_prompt + "\n\n" + user_prompt, _ai_api_keys(api_key, openai_api_key)
         )
-        return response.text
-    except APIError as e:
-        return f"Lỗi gọi API Gemini: {e}"
+        return text
+    except AIProviderError as e:
+        return f"Lỗi gọi API AI: {e}"
     except Exception as e:
         return f"Lỗi không xác định: {e}"
 
 
-def chat_with_gemini(user_message: str, api_key: str, context_data: dict = None) -> str:
+def chat_with_gemini(user_message: str, api_key: str, context_data: dict = None, openai_api_key: str = None) -> str:
     """
-    Chatbot với Gemini AI để trả lời câu hỏi của người dùng về phân tích tín dụng.
+    Chatbot AI (Gemini, dự phòng OpenAI) trả lời câu hỏi của người dùng về phân tích tín dụng.
 
     Args:
         user_message: Câu hỏi từ người dùng
         api_key: API key của Gemini
         context_data: Dữ liệu ngữ cảnh (chỉ số tài chính, PD, phân tích trước đó)
+        openai_api_key: API key của OpenAI (nhà cung cấp dự phòng, tùy chọn)
 
     Returns:
-        Câu trả lời từ Gemini AI
+        Câu trả lời từ AI
     """
-    if not _GEMINI_OK:
-        return "Lỗi: Thiếu thư viện google-genai (cần cài đặt: pip install google-genai)."
-
-    client = genai.Client(api_key=api_key)
+    if not (_GEMINI_OK or _OPENAI_OK):
+        return "Lỗi: Thiếu thư viện google-genai/openai (cần cài đặt: pip install google-genai openai)."
 
     # System prompt cho chatbot
     sys_prompt = (
@@ -740,113 +1310,495 @@ def chat_with_gemini(user_message: str, api_key: str, context_data: dict = None)
     full_prompt = user_message + context_prompt
 
     try:
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[
-                {"role": "user", "parts": [{"text": full_prompt}]}
-            ],
-            config={"system_instruction": sys_prompt}
-        )
-        return response.text
-    except APIError as e:
-        return f"Lỗi gọi API Gemini: {e}"
+        text, _provider = get_ai_router().generate(sys_prompt, full_prompt, _ai_api_keys(api_key, openai_api_key))
+        return text
+    except AIProviderError as e:
+        return f"Lỗi gọi API AI: {e}"
     except Exception as e:
         return f"Lỗi không xác định: {e}"
 
 
 # =========================
-# HÀM LẤY DỮ LIỆU TÀI CHÍNH TỰ ĐỘNG TỪ GEMINI API
+# KHO DỮ LIỆU CỤC BỘ (SQLITE) DÙNG CHUNG GIỮA CÁC WORKER
 # =========================
 
-@st.cache_data(ttl=2592000)  # Cache 30 ngày (tự động cập nhật mỗi tháng)
-def get_financial_data_from_ai(api_key: str) -> pd.DataFrame:
+def _store_connect(db_path: str) -> sqlite3.Connection:
+    """Mở kết nối SQLite trong DATA_STORE_DIR (WAL để nhiều tiến trình đọc/ghi đồng thời)."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class SingleFlight:
+    """
+    Khóa single-flight theo tên: tối đa một luồng trong tiến trình (threading.Lock) và
+    một tiến trình trên máy (flock trên DATA_STORE_DIR/locks/<tên>.lock) cùng chạy một
+    tác vụ làm mới. Dùng chung giữa phiên người dùng và bộ làm ấm cache chạy nền.
     """
-    Tự động lấy dữ liệu tài chính doanh nghiệp Việt Nam từ Gemini API.
-    Dữ liệu bao gồm: Doanh thu, Tổng tài sản, Lợi nhuận, Nợ phải trả, VCSH theo quý.
 
-    Returns:
-        pd.DataFrame: DataFrame chứa dữ liệu tài chính theo quý
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    @contextmanager
+    def hold(self, name: str, blocking: bool = True):
+        """Yield True nếu giành được khóa; blocking=False trả về False ngay khi đang có người giữ."""
+        with self._guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        if not lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            lock_dir = os.path.join(DATA_STORE_DIR, "locks")
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(os.path.join(lock_dir, f"{name}.lock"), "a+") as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                    except BlockingIOError:
+                        yield False
+                        return
+                try:
+                    yield True
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock.release()
+
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    return SingleFlight()
+
+
+# =========================
+# BỘ NHỚ ĐỆM NẠP DỮ LIỆU (SHA-256 NỘI DUNG -> CỘT NUMPY MEMORY-MAP)
+# =========================
+
+def _compact_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ép kiểu: X_1..X_14 -> float64, default -> int8. Cột số/ngày giữ nguyên; cột chữ thành object
+    giữ NaN ở ô trống (như khi đọc lại từ cache). Cột kiểu khác giữ nguyên và bảng đó không được cache.
     """
-    if not _GEMINI_OK:
+    out = {}
+    for col in frame.columns:
+        series = frame[col]
+        target = INGEST_DTYPES.get(col)
+        if target is not None:
+            try:
+                numeric = pd.to_numeric(series, errors="raise")
+                if np.issubdtype(target, np.integer) and numeric.isna().any():
+                    raise ValueError("cột nguyên có giá trị thiếu")
+                out[col] = numeric.to_numpy(dtype=target)
+                continue
+            except (ValueError, TypeError):
+                pass  # Giữ kiểu gốc, bước kiểm tra cột phía sau sẽ báo lỗi nếu cần
+        if (pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)
+                or pd.api.types.is_datetime64_dtype(series)):
+            out[col] = series.to_numpy()
+        elif _is_text_column(series):
+            values = series.to_numpy(dtype=object)
+            values[series.isna().to_numpy()] = np.nan
+            out[col] = values
+        else:
+            out[col] = series
+    return pd.DataFrame(out, columns=frame.columns)
+
+
+def _is_text_column(values) -> bool:
+    """Mọi ô khác rỗng đều là chuỗi (lưu được dạng unicode cố định + mặt nạ ô trống)."""
+    return pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty")
+
+
+def _save_ingested(entry_dir: str, frame: pd.DataFrame):
+    """Ghi mỗi cột thành một file .npy kèm manifest.json; đổi tên thư mục nguyên tử khi xong."""
+    for col in frame.columns:
+        if frame[col].dtype == object and not _is_text_column(frame[col]):
+            raise ValueError(f"Cột {col!r} không lưu được vào bộ nhớ đệm")
+    os.makedirs(INGEST_CACHE_DIR, exist_ok=True)
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    columns = []
+    for i, col in enumerate(frame.columns):
+        values = frame[col].to_numpy()
+        column = {"name": str(col), "file": f"c{i}.npy"}
+        if values.dtype == object:
+            # Cột chữ: lưu dạng unicode cố định để mở được bằng memory-map, ô trống ghi vào mặt nạ riêng
+            missing = pd.isna(values)
+            if missing.any():
+                np.save(os.path.join(tmp_dir, f"c{i}.mask.npy"), missing, allow_pickle=False)
+                column["mask"] = f"c{i}.mask.npy"
+            values = np.where(missing, "", values).astype(str)
+        np.save(os.path.join(tmp_dir, column["file"]), values, allow_pickle=False)
+        column["dtype"] = str(values.dtype)
+        columns.append(column)
+    with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"rows": len(frame), "columns": columns, "created_at": time.time()}, f, ensure_ascii=False)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Worker khác đã ghi cùng nội dung trước
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _load_ingested(entry_dir: str):
+    """Mở các cột bằng memory-map (chỉ đọc, không sao chép). None nếu chưa có hoặc hỏng."""
+    try:
+        with open(os.path.join(entry_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        data = {}
+        for c in manifest["columns"]:
+            values = np.load(os.path.join(entry_dir, c["file"]), mmap_mode="r", allow_pickle=False)
+            if "mask" in c:
+                # Cột chữ có ô trống: dựng lại NaN (bản sao object, không còn memory-map)
+                values = values.astype(object)
+                values[np.load(os.path.join(entry_dir, c["mask"]), allow_pickle=False)] = np.nan
+            data[c["name"]] = values
+    except (OSError, ValueError, KeyError):
         return None
+    os.utime(entry_dir)  # Đánh dấu vừa dùng để dọn theo LRU
+    return pd.DataFrame(data, copy=False)
 
+
+def _prune_ingest_cache():
+    """Giữ tối đa INGEST_CACHE_MAX_ENTRIES bản nạp gần nhất."""
     try:
-        client = genai.Client(api_key=api_key)
-
-        # Lấy quý hiện tại
-        current_date = datetime.now()
-        current_year = current_date.year
-        current_month = current_date.month
-        current_quarter = (current_month - 1) // 3 + 1
-
-        # Prompt yêu cầu Gemini cung cấp dữ liệu tài chính
-        sys_prompt = """Bạn là chuyên gia kinh tế và dữ liệu thống kê về doanh nghiệp Việt Nam.
-        Hãy cung cấp dữ liệu tài chính tổng hợp của khu vực doanh nghiệp Việt Nam theo quý,
-        dựa trên các nguồn thống kê đáng tin cậy như GSO (Tổng cục Thống kê Việt Nam),
-        Bộ Kế hoạch và Đầu tư, hoặc các báo cáo kinh tế vĩ mô.
-
-        Trả về dữ liệu dưới dạng JSON với cấu trúc sau:
-        {
-            "quarters": ["Q1-2021", "Q2-2021", ...],
-            "revenue": [số liệu doanh thu tỷ VNĐ, ...],
-            "assets": [số liệu tổng tài sản tỷ VNĐ, ...],
-            "profit": [số liệu lợi nhuận tỷ VNĐ, ...],
-            "debt": [số liệu nợ phải trả tỷ VNĐ, ...],
-            "equity": [số liệu VCSH tỷ VNĐ, ...]
-        }
+        entries = [e for e in os.scandir(INGEST_CACHE_DIR) if e.is_dir() and ".tmp-" not in e.name]
+    except OSError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for stale in entries[INGEST_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(stale.path, ignore_errors=True)
+
+
+def ingest_table(data: bytes, reader, kind: str = "csv") -> pd.DataFrame:
+    """
+    Đọc bảng từ nội dung file (bytes) qua bộ nhớ đệm theo SHA-256.
+
+    Lần đầu: reader(BytesIO(data)) -> ép kiểu -> lưu cột .npy. Các lần rerun và các phiên/worker
+    khác với cùng nội dung chỉ mở memory-map, không phân tích lại file.
+
+    Parameters:
+    - data: nội dung file
+    - reader: hàm đọc file-like -> DataFrame (vd. lambda f: pd.read_csv(f, encoding='latin-1'))
+    - kind: nhãn phân biệt cách đọc (cùng bytes nhưng đọc khác nhau thì khóa khác nhau)
+    """
+    key = hashlib.sha256(kind.encode("utf-8") + b"\0" + data).hexdigest()
+    entry_dir = os.path.join(INGEST_CACHE_DIR, key)
+    frame = _load_ingested(entry_dir)
+    perf_cache("ingest", hit=frame is not None)
+    if frame is not None:
+        return frame
+    frame = _compact_frame(reader(BytesIO(data)))
+    try:
+        _save_ingested(entry_dir, frame)
+        _prune_ingest_cache()
+    except (OSError, ValueError):
+        return frame  # Không ghi được đĩa: vẫn dùng bản vừa đọc
+    loaded = _load_ingested(entry_dir)
+    return loaded if loaded is not None else frame
+
+
+@perf_span("csv_load")
+def read_training_csv(source) -> pd.DataFrame:
+    """CSV huấn luyện (đường dẫn hoặc file tải lên) qua bộ nhớ đệm nạp dữ liệu."""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            data = f.read()
+    else:
+        data = source.getvalue()
+    return ingest_table(data, lambda f: pd.read_csv(f, encoding='latin-1'), kind="train_csv_latin1_f64")
+
+
+def read_gso_upload(uploaded) -> pd.DataFrame:
+    """File GSO tải lên (CSV hoặc Excel) qua bộ nhớ đệm nạp dữ liệu."""
+    if uploaded.name.endswith('.csv'):
+        return ingest_table(uploaded.getvalue(), pd.read_csv, kind="gso_csv")
+    return ingest_table(uploaded.getvalue(), pd.read_excel, kind="gso_xlsx")
+
+
+# =========================
+# HÀM LẤY DỮ LIỆU TÀI CHÍNH TỰ ĐỘNG TỪ GEMINI API (LƯU BỀN VỮNG THEO QUÝ)
+# =========================
+
+# Khóa JSON trả về từ AI -> tên cột hiển thị trên Dashboard
+GSO_SERIES_COLS = {
+    "revenue": "Doanh thu (tỷ VNĐ)",
+    "assets": "Tổng tài sản (tỷ VNĐ)",
+    "profit": "Lợi nhuận (tỷ VNĐ)",
+    "debt": "Nợ phải trả (tỷ VNĐ)",
+    "equity": "VCSH (tỷ VNĐ)",
+}
+_QUARTER_RE = re.compile(r"^Q([1-4])-(\d{4})$")
+
 
-        Chỉ trả về JSON, không giải thích thêm."""
+def _parse_quarter(label) -> tuple:
+    """'Q3-2024' -> (2024, 3). Ném ValueError nếu sai định dạng."""
+    match = _QUARTER_RE.match(str(label).strip())
+    if not match:
+        raise ValueError(f"Nhãn quý không hợp lệ: {label!r}")
+    return int(match.group(2)), int(match.group(1))
 
-        user_prompt = f"""Hãy cung cấp dữ liệu tài chính tổng hợp của khu vực doanh nghiệp Việt Nam
-        từ quý Q1-2021 đến quý Q{current_quarter}-{current_year}.
 
-        Bao gồm các chỉ số:
-        - Doanh thu (Revenue) - tổng doanh thu khu vực doanh nghiệp, đơn vị tỷ VNĐ
-        - Tổng tài sản (Total Assets) - tổng tài sản khu vực doanh nghiệp, đơn vị tỷ VNĐ
-        - Lợi nhuận (Profit) - lợi nhuận sau thuế, đơn vị tỷ VNĐ
-        - Nợ phải trả (Debt) - tổng nợ phải trả, đơn vị tỷ VNĐ
-        - Vốn chủ sở hữu (Equity/VCSH) - tổng VCSH, đơn vị tỷ VNĐ
+def _next_quarter(year: int, quarter: int) -> tuple:
+    return (year, quarter + 1) if quarter < 4 else (year + 1, 1)
 
-        Dữ liệu phải phản ánh xu hướng tăng trưởng thực tế của nền kinh tế Việt Nam.
-        Chỉ trả về JSON thuần, không markdown, không giải thích."""
 
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[
-                {"role": "user", "parts": [{"text": sys_prompt + "\n\n" + user_prompt}]}
-            ],
-            config={"system_instruction": sys_prompt}
+def validate_macro_payload(data) -> pd.DataFrame:
+    """
+    Kiểm tra JSON dữ liệu vĩ mô theo schema trước khi lưu.
+
+    Schema: {"quarters": ["Q1-2021", ...], "revenue": [...], "assets": [...],
+             "profit": [...], "debt": [...], "equity": [...]} - các mảng cùng độ dài,
+    nhãn quý đúng định dạng và không trùng, giá trị là số hữu hạn,
+    doanh thu và tổng tài sản không âm.
+
+    Returns:
+        DataFrame cột year, quarter, revenue, assets, profit, debt, equity
+
+    Raises:
+        ValueError nếu dữ liệu không khớp schema.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("JSON gốc phải là object")
+    quarters = data.get("quarters")
+    if not isinstance(quarters, list) or not quarters:
+        raise ValueError("Thiếu mảng 'quarters'")
+    parsed = [_parse_quarter(q) for q in quarters]
+    if len(set(parsed)) != len(parsed):
+        raise ValueError("Trùng nhãn quý trong 'quarters'")
+
+    columns = {"year": [y for y, _ in parsed], "quarter": [q for _, q in parsed]}
+    for key in GSO_SERIES_COLS:
+        values = data.get(key)
+        if not isinstance(values, list) or len(values) != len(quarters):
+            raise ValueError(f"Mảng '{key}' thiếu hoặc không cùng độ dài với 'quarters'")
+        if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in values):
+            raise ValueError(f"Mảng '{key}' chứa giá trị không phải số")
+        arr = np.asarray(values, dtype=float)
+        if not np.isfinite(arr).all():
+            raise ValueError(f"Mảng '{key}' chứa giá trị không hữu hạn")
+        if key in ("revenue", "assets") and (arr < 0).any():
+            raise ValueError(f"Mảng '{key}' chứa giá trị âm")
+        columns[key] = arr
+    return pd.DataFrame(columns)
+
+
+def _ensure_macro_schema(conn: sqlite3.Connection):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS gso_quarterly (
+               year INTEGER NOT NULL,
+               quarter INTEGER NOT NULL,
+               revenue REAL, assets REAL, profit REAL, debt REAL, equity REAL,
+               fetched_at TEXT NOT NULL,
+               PRIMARY KEY (year, quarter)
+           )"""
+    )
+    # Nhật ký các lần hỏi AI: giới hạn tần suất làm mới giữa các lượt rerun, phiên và worker
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS refresh_log (
+               ts REAL NOT NULL,
+               ok INTEGER NOT NULL,
+               n_rows INTEGER NOT NULL DEFAULT 0,
+               error TEXT
+           )"""
+    )
+
+
+def load_macro_store() -> pd.DataFrame:
+    """Đọc toàn bộ chuỗi quý đã lưu, định dạng cột giống Dashboard (rỗng nếu chưa có)."""
+    with closing(_store_connect(GSO_STORE_PATH)) as conn:
+        _ensure_macro_schema(conn)
+        stored = pd.read_sql_query(
+            "SELECT year, quarter, revenue, assets, profit, debt, equity "
+            "FROM gso_quarterly ORDER BY year, quarter",
+            conn,
         )
+    df = pd.DataFrame({"Quý": [f"Q{q}-{y}" for y, q in zip(stored["year"], stored["quarter"])]})
+    for key, col in GSO_SERIES_COLS.items():
+        df[col] = stored[key].to_numpy()
+    return df
+
+
+def _save_macro_rows(rows: pd.DataFrame):
+    """Ghi (upsert) các quý đã kiểm tra schema vào kho trong một giao dịch."""
+    fetched_at = datetime.now().isoformat(timespec="seconds")
+    records = [
+        (int(r.year), int(r.quarter), r.revenue, r.assets, r.profit, r.debt, r.equity, fetched_at)
+        for r in rows.itertuples(index=False)
+    ]
+    with closing(_store_connect(GSO_STORE_PATH)) as conn, conn:
+        _ensure_macro_schema(conn)
+        conn.executemany(
+            "INSERT OR REPLACE INTO gso_quarterly "
+            "(year, quarter, revenue, assets, profit, debt, equity, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            records,
+        )
+
 
-        # Parse JSON response
-        import json
-        import re
+def _last_completed_quarter() -> tuple:
+    """Quý gần nhất đã kết thúc (quý đang diễn ra thường chưa có số liệu công bố)."""
+    current_date = datetime.now()
+    quarter = (current_date.month - 1) // 3 + 1
+    return (current_date.year, quarter - 1) if quarter > 1 else (current_date.year - 1, 4)
+
+
+def _missing_quarters() -> list:
+    """Các quý từ GSO_FIRST_QUARTER đến quý đã kết thúc gần nhất chưa có trong kho (kể cả lỗ hổng giữa chuỗi)."""
+    with closing(_store_connect(GSO_STORE_PATH)) as conn:
+        _ensure_macro_schema(conn)
+        stored = set(conn.execute("SELECT year, quarter FROM gso_quarterly").fetchall())
+    missing, key, end = [], GSO_FIRST_QUARTER, _last_completed_quarter()
+    while key <= end:
+        if key not in stored:
+            missing.append(key)
+        key = _next_quarter(*key)
+    return missing
+
+
+def _last_refresh_attempt():
+    """(thời điểm, thành công) của lần hỏi AI gần nhất, None nếu chưa hỏi lần nào."""
+    with closing(_store_connect(GSO_STORE_PATH)) as conn:
+        _ensure_macro_schema(conn)
+        row = conn.execute("SELECT ts, ok FROM refresh_log ORDER BY ts DESC LIMIT 1").fetchone()
+    return (row[0], bool(row[1])) if row else None
+
+
+def _log_refresh_attempt(ok: bool, n_rows: int = 0, error: str = None):
+    with closing(_store_connect(GSO_STORE_PATH)) as conn, conn:
+        _ensure_macro_schema(conn)
+        conn.execute("INSERT INTO refresh_log (ts, ok, n_rows, error) VALUES (?, ?, ?, ?)",
+                     (time.time(), int(ok), n_rows, error))
+
+
+def _request_macro_quarters(start: tuple, end: tuple, api_key: str, openai_api_key: str = None) -> pd.DataFrame:
+    """Hỏi AI chuỗi quý từ start đến end (bao gồm), trả về dữ liệu đã kiểm tra schema."""
+    start_label = f"Q{start[1]}-{start[0]}"
+    end_label = f"Q{end[1]}-{end[0]}"
+
+    # Prompt yêu cầu Gemini cung cấp dữ liệu tài chính
+    sys_prompt = """Bạn là chuyên gia kinh tế và dữ liệu thống kê về doanh nghiệp Việt Nam.
+    Hãy cung cấp dữ liệu tài chính tổng hợp của khu vực doanh nghiệp Việt Nam theo quý,
+    dựa trên các nguồn thống kê đáng tin cậy như GSO (Tổng cục Thống kê Việt Nam),
+    Bộ Kế hoạch và Đầu tư, hoặc các báo cáo kinh tế vĩ mô.
+
+    Trả về dữ liệu dưới dạng JSON với cấu trúc sau:
+    {
+        "quarters": ["Q1-2021", "Q2-2021", ...],
+        "revenue": [số liệu doanh thu tỷ VNĐ, ...],
+        "assets": [số liệu tổng tài sản tỷ VNĐ, ...],
+        "profit": [số liệu lợi nhuận tỷ VNĐ, ...],
+        "debt": [số liệu nợ phải trả tỷ VNĐ, ...],
+        "equity": [số liệu VCSH tỷ VNĐ, ...]
+    }
 
-        response_text = response.text.strip()
+    Chỉ trả về JSON, không giải thích thêm."""
 
-        # Loại bỏ markdown code block nếu có
-        if "```json" in response_text:
-            response_text = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL).group(1)
-        elif "```" in response_text:
-            response_text = re.search(r'```\s*(\{.*?\})\s*```', response_text, re.DOTALL).group(1)
+    user_prompt = f"""Hãy cung cấp dữ liệu tài chính tổng hợp của khu vực doanh nghiệp Việt Nam
+    từ quý {start_label} đến quý {end_label}.
 
-        data = json.loads(response_text)
+    Bao gồm các chỉ số:
+    - Doanh thu (Revenue) - tổng doanh thu khu vực doanh nghiệp, đơn vị tỷ VNĐ
+    - Tổng tài sản (Total Assets) - tổng tài sản khu vực doanh nghiệp, đơn vị tỷ VNĐ
+    - Lợi nhuận (Profit) - lợi nhuận sau thuế, đơn vị tỷ VNĐ
+    - Nợ phải trả (Debt) - tổng nợ phải trả, đơn vị tỷ VNĐ
+    - Vốn chủ sở hữu (Equity/VCSH) - tổng VCSH, đơn vị tỷ VNĐ
 
-        # Tạo DataFrame
-        df = pd.DataFrame({
-            'Quý': data.get('quarters', []),
-            'Doanh thu (tỷ VNĐ)': data.get('revenue', []),
-            'Tổng tài sản (tỷ VNĐ)': data.get('assets', []),
-            'Lợi nhuận (tỷ VNĐ)': data.get('profit', []),
-            'Nợ phải trả (tỷ VNĐ)': data.get('debt', []),
-            'VCSH (tỷ VNĐ)': data.get('equity', [])
-        })
+    Dữ liệu phải phản ánh xu hướng tăng trưởng thực tế của nền kinh tế Việt Nam.
+    Chỉ trả về JSON thuần, không markdown, không giải thích."""
+
+    response_text, _provider = get_ai_router().generate(
+        sys_prompt, sys_prompt + "\n\n" + user_prompt, _ai_api_keys(api_key, openai_api_key)
+    )
+    response_text = response_text.strip()
 
-        return df
+    # Loại bỏ markdown code block nếu có
+    if "```json" in response_text:
+        response_text = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL).group(1)
+    elif "```" in response_text:
+        response_text = re.search(r'```\s*(\{.*?\})\s*```', response_text, re.DOTALL).group(1)
 
+    rows = validate_macro_payload(json.loads(response_text))
+
+    # Chỉ giữ các quý đã yêu cầu để không ghi đè dữ liệu cũ đã lưu
+    key = rows["year"] * 4 + rows["quarter"]
+    in_range = (key >= start[0] * 4 + start[1]) & (key <= end[0] * 4 + end[1])
+    return rows[in_range]
+
+
+def macro_store_is_current() -> bool:
+    """Kho đã có đủ mọi quý đến quý đã kết thúc gần nhất chưa."""
+    return not _missing_quarters()
+
+
+def macro_refresh_due() -> bool:
+    """Còn quý thiếu và lần hỏi AI gần nhất đã quá GSO_REFRESH_RETRY_S."""
+    if macro_store_is_current():
+        return False
+    last = _last_refresh_attempt()
+    return last is None or time.time() - last[0] >= GSO_REFRESH_RETRY_S
+
+
+def refresh_macro_store(api_key: str, openai_api_key: str = None, flights: SingleFlight = None, blocking: bool = True) -> int:
+    """
+    Làm mới tăng dần: chỉ hỏi AI các quý còn thiếu trong kho (quý mới và lỗ hổng giữa chuỗi),
+    tối đa một lần mỗi GSO_REFRESH_RETRY_S dù lần trước thành công hay lỗi (AI thường chưa có
+    số liệu quý mới nhất): các lượt rerun trong khoảng đó chỉ đọc kho.
+
+    Chạy dưới khóa single-flight "gso_macro": nếu phiên/worker khác đang làm mới,
+    lượt gọi này chờ xong rồi kiểm tra lại kho (blocking=True) hoặc bỏ qua (blocking=False),
+    nên AI không bị hỏi trùng.
+
+    Returns:
+        Số quý mới được ghi vào kho (0 nếu không thiếu quý nào hoặc chưa đến lượt hỏi lại).
+    """
+    flights = flights or get_single_flight()
+    with flights.hold("gso_macro", blocking=blocking) as acquired:
+        if not acquired or not macro_refresh_due():
+            return 0
+        missing = _missing_quarters()
+        try:
+            rows = _request_macro_quarters(missing[0], missing[-1], api_key, openai_api_key)
+        except Exception as e:
+            _log_refresh_attempt(False, error=str(e))
+            raise
+        # Chỉ ghi các quý còn thiếu, không ghi đè quý đã lưu
+        wanted = set(missing)
+        rows = rows[np.array([(int(y), int(q)) in wanted for y, q in zip(rows["year"], rows["quarter"])], dtype=bool)]
+        if not rows.empty:
+            _save_macro_rows(rows)
+        _log_refresh_attempt(True, n_rows=len(rows))
+        return len(rows)
+
+
+def get_financial_data_from_ai(api_key: str, openai_api_key: str = None) -> pd.DataFrame:
+    """
+    Tự động lấy dữ liệu tài chính doanh nghiệp Việt Nam từ Gemini API (dự phòng OpenAI).
+    Dữ liệu bao gồm: Doanh thu, Tổng tài sản, Lợi nhuận, Nợ phải trả, VCSH theo quý.
+
+    Chuỗi quý được lưu bền vững trong kho SQLite (GSO_STORE_PATH) dùng chung giữa các
+    worker và qua các lần khởi động lại; AI chỉ được hỏi các quý chưa có trong kho,
+    tối đa một lần mỗi GSO_REFRESH_RETRY_S.
+
+    Returns:
+        pd.DataFrame: DataFrame chứa dữ liệu tài chính theo quý
+    """
+    if not (_GEMINI_OK or _OPENAI_OK):
+        return None
+
+    try:
+        refresh_macro_store(api_key, openai_api_key)
     except Exception as e:
         st.error(f"Lỗi khi lấy dữ liệu từ AI: {e}")
+
+    try:
+        df = load_macro_store()
+    except Exception as e:
+        st.error(f"Lỗi khi đọc kho dữ liệu vĩ mô: {e}")
         return None
+    return df if not df.empty else None
 
 
 # =========================
@@ -885,8 +1837,11 @@ ALIAS_CF = {
     "khau_hao": ["Khấu hao TSCĐ", "Khấu hao", "Chi phí khấu hao"],
 }
 
-def _pick_year_cols(df: pd.DataFrame):
-    """Chọn 2 cột năm gần nhất từ sheet (ưu tiên cột có nhãn là năm)."""
+def _year_cols(df: pd.DataFrame) -> list:
+    """
+    Các cột kỳ của sheet theo thứ tự thời gian: [(khóa kỳ, tên cột), ...].
+    Ưu tiên cột có nhãn là năm (khóa = năm int); nếu không có, dùng mọi cột sau cột nhãn theo vị trí.
+    """
     numeric_years = []
     for c in df.columns[1:]:
         try:
@@ -897,153 +1852,2367 @@ def _pick_year_cols(df: pd.DataFrame):
             continue
     if numeric_years:
         numeric_years.sort(key=lambda x: x[0])
-        return numeric_years[-2][1], numeric_years[-1][1]
+        return numeric_years
+    return [(str(c), c) for c in df.columns[1:]]
+
+def _pick_year_cols(df: pd.DataFrame):
+    """Chọn 2 cột năm gần nhất từ sheet (ưu tiên cột có nhãn là năm)."""
+    cols = _year_cols(df)
+    if len(cols) >= 2:
+        return cols[-2][1], cols[-1][1]
     # fallback: 2 cột cuối
     cols = df.columns[-2:]
     return cols[0], cols[1]
 
-def _get_row_vals(df: pd.DataFrame, aliases: list[str]):
-    """Tìm dòng theo alias. Trả về (prev, cur) theo 2 cột năm gần nhất."""
-    label_col = df.columns[0]
-    prev_col, cur_col = _pick_year_cols(df)
-    mask = False
-    for alias in aliases:
-        mask = mask | df[label_col].astype(str).str.contains(alias, case=False, na=False)
-    rows = df[mask]
-    if rows.empty:
-        return np.nan, np.nan
-    row = rows.iloc[0]
+def _to_num(x):
+    try:
+        # Xóa dấu phẩy, khoảng trắng
+        return float(str(x).replace(",", "").replace(" ", ""))
+    except Exception:
+        return np.nan
+
+def _norm_label(series: pd.Series) -> pd.Series:
+    return series.astype(str).str.strip().str.lower().str.replace(r"\s+", " ", regex=True)
+
+def _label_contains(labels: pd.Series, alias: str) -> pd.Series:
+    """
+    Bộ so khớp nhãn dùng chung cho workbook và báo cáo dạng dài: nhãn (đã _norm_label) chứa alias
+    là chuỗi con, không phân biệt hoa thường. So khớp nguyên văn - alias có ngoặc như
+    "Chi phí tài chính (trong đó: chi phí lãi vay)" không bị hiểu thành biểu thức chính quy.
+    """
+    return labels.str.contains(_norm_label(pd.Series([alias])).iat[0], regex=False)
+
+def _get_row_series(df: pd.DataFrame, aliases: list[str]) -> pd.Series:
+    """Tìm dòng theo alias. Trả về giá trị của dòng đó ở mọi cột kỳ (index = khóa kỳ)."""
+    labels = _norm_label(df[df.columns[0]].fillna(""))
+    periods = _year_cols(df)
+    keys = [k for k, _ in periods]
+    mask = False
+    for alias in aliases:
+        mask = mask | _label_contains(labels, alias)
+    rows = df[mask]
+    if rows.empty:
+        return pd.Series(np.nan, index=keys, dtype=np.float64)
+    row = rows.iloc[0]
+    return pd.Series([_to_num(row[c]) for _, c in periods], index=keys, dtype=np.float64)
+
+def _get_row_vals(df: pd.DataFrame, aliases: list[str]):
+    """Tìm dòng theo alias. Trả về (prev, cur) theo 2 cột năm gần nhất."""
+    series = _get_row_series(df, aliases)
+    if len(series) < 2:
+        return np.nan, (series.iloc[-1] if len(series) else np.nan)
+    return series.iloc[-2], series.iloc[-1]
+
+# Khoản mục dùng để tính X1..X14: tên biến -> (sheet, khóa alias)
+RATIO_ITEMS = {
+    "DTT": ("BCTN", "doanh_thu_thuan"), "GVHB": ("BCTN", "gia_von"), "LNG": ("BCTN", "loi_nhuan_gop"),
+    "LNTT": ("BCTN", "loi_nhuan_truoc_thue"), "LV": ("BCTN", "chi_phi_lai_vay"),
+    "TTS": ("CDKT", "tong_tai_san"), "VCSH": ("CDKT", "von_chu_so_huu"), "NPT": ("CDKT", "no_phai_tra"),
+    "TSNH": ("CDKT", "tai_san_ngan_han"), "NNH": ("CDKT", "no_ngan_han"), "HTK": ("CDKT", "hang_ton_kho"),
+    "Tien": ("CDKT", "tien_tdt"), "KPT": ("CDKT", "phai_thu_kh"), "NDH": ("CDKT", "no_dai_han_den_han"),
+    "KH": ("LCTT", "khau_hao"),
+}
+_SHEET_ALIASES = {"BCTN": ALIAS_IS, "CDKT": ALIAS_BS, "LCTT": ALIAS_CF}
+
+def _ratios_from_arrays(prev: dict, cur: dict) -> dict:
+    """
+    Tính X1..X14 vector hóa: mỗi khoản mục là mảng (nhiều kỳ hoặc nhiều doanh nghiệp),
+    prev/cur là giá trị kỳ trước/kỳ này. Cùng công thức với bản tính một kỳ trước đây.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        def div(a, b):
+            a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+            return np.where(np.isnan(b) | (b == 0), np.nan, a / np.where(b == 0, 1.0, b))
+
+        def avg(a, b):
+            return np.where(np.isnan(a), b, np.where(np.isnan(b), a, (a + b) / 2.0))
+
+        GVHB_cur, LV_cur, KH_cur = np.abs(cur["GVHB"]), np.abs(cur["LV"]), np.abs(cur["KH"])
+        TTS_avg = avg(cur["TTS"], prev["TTS"])
+        VCSH_avg = avg(cur["VCSH"], prev["VCSH"])
+        HTK_avg = avg(cur["HTK"], prev["HTK"])
+        KPT_avg = avg(cur["KPT"], prev["KPT"])
+        EBIT_cur = cur["LNTT"] + LV_cur
+        NDH_cur = np.nan_to_num(cur["NDH"], nan=0.0)
+        turnover = div(cur["DTT"], KPT_avg)
+
+        # ==== TÍNH X1..X14 ==== (GIỮ NGUYÊN CÔNG THỨC)
+        return {
+            "X_1": div(cur["LNG"], cur["DTT"]),
+            "X_2": div(cur["LNTT"], cur["DTT"]),
+            "X_3": div(cur["LNTT"], TTS_avg),
+            "X_4": div(cur["LNTT"], VCSH_avg),
+            "X_5": div(cur["NPT"], cur["TTS"]),
+            "X_6": div(cur["NPT"], cur["VCSH"]),
+            "X_7": div(cur["TSNH"], cur["NNH"]),
+            "X_8": div(cur["TSNH"] - cur["HTK"], cur["NNH"]),
+            "X_9": div(EBIT_cur, LV_cur),
+            "X_10": div(EBIT_cur + np.nan_to_num(KH_cur, nan=0.0), LV_cur + NDH_cur),
+            "X_11": div(cur["Tien"], cur["VCSH"]),
+            "X_12": div(GVHB_cur, HTK_avg),
+            "X_13": div(365.0, turnover),
+            "X_14": div(cur["DTT"], TTS_avg),
+        }
+
+def _ratio_frame(ratios: dict, index=None) -> pd.DataFrame:
+    """Khung kết quả: cột tiếng Việt (hiển thị) + cột X_1..X_14 (dự báo)."""
+    model_cols = [f"X_{i}" for i in range(1, 15)]
+    values = np.column_stack([np.atleast_1d(ratios[c]) for c in model_cols])
+    frame = pd.DataFrame(values, columns=COMPUTED_COLS, index=index)
+    frame[model_cols] = values
+    return frame
+
+def compute_ratio_series_from_three_sheets(xlsx_file) -> pd.DataFrame:
+    """
+    Đọc 3 sheet CDKT/BCTN/LCTT một lần và tính X1..X14 cho mọi cặp kỳ liên tiếp (index = kỳ hiện tại).
+    File chỉ có một kỳ: trả về một dòng, các bình quân dùng số cuối kỳ.
+    """
+    sheets = {
+        "CDKT": pd.read_excel(xlsx_file, sheet_name="CDKT", engine="openpyxl"),
+        "BCTN": pd.read_excel(xlsx_file, sheet_name="BCTN", engine="openpyxl"),
+        "LCTT": pd.read_excel(xlsx_file, sheet_name="LCTT", engine="openpyxl"),
+    }
+    items = {name: _get_row_series(sheets[sheet], _SHEET_ALIASES[sheet][alias])
+             for name, (sheet, alias) in RATIO_ITEMS.items()}
+
+    # Trục kỳ chung của 3 sheet (năm tăng dần; nhãn không phải năm giữ thứ tự xuất hiện)
+    keys = []
+    for series in items.values():
+        keys.extend(k for k in series.index if k not in keys)
+    if all(isinstance(k, int) for k in keys):
+        keys.sort()
+    matrix = {name: series.reindex(keys).to_numpy(dtype=np.float64) for name, series in items.items()}
+
+    if len(keys) >= 2:
+        prev = {name: values[:-1] for name, values in matrix.items()}
+        cur = {name: values[1:] for name, values in matrix.items()}
+        periods = keys[1:]
+    else:
+        cur = matrix
+        prev = {name: np.full_like(values, np.nan) for name, values in matrix.items()}
+        periods = keys
+    return _ratio_frame(_ratios_from_arrays(prev, cur), index=pd.Index(periods, name="Kỳ"))
+
+def compute_ratios_from_three_sheets(xlsx_file) -> pd.DataFrame:
+    """Đọc 3 sheet CDKT/BCTN/LCTT và tính X1..X14 của kỳ gần nhất (dòng cuối của chuỗi theo kỳ)."""
+    return compute_ratio_series_from_three_sheets(xlsx_file).iloc[[-1]].reset_index(drop=True)
+
+@st.cache_data(max_entries=WORKBOOK_CACHE_ENTRIES, show_spinner=False)
+def _ratio_series_by_sha(sha: str, _data: bytes) -> pd.DataFrame:
+    """Kết quả tính theo SHA-256 nội dung file; `_data` không tham gia khóa cache."""
+    note_cache_miss()
+    return compute_ratio_series_from_three_sheets(BytesIO(_data))
+
+def ratio_series_for_upload(uploaded) -> pd.DataFrame:
+    """
+    Chuỗi X1..X14 theo kỳ cho hồ sơ tải lên, ghi nhớ theo SHA-256 nội dung: các lần rerun
+    (nút AI, chat, xuất Word...) dùng lại kết quả, chỉ file mới phải đọc lại workbook.
+    """
+    data = uploaded.getvalue()
+    with perf_span("workbook_parse"), perf_cache_lookup("workbook"):
+        return _ratio_series_by_sha(hashlib.sha256(data).hexdigest(), data)
+
+# =========================
+# BÁO CÁO TÀI CHÍNH DẠNG DÀI (firm_id, year, sheet, line_item, value) CHO HÀNG NGHÌN DOANH NGHIỆP
+# =========================
+
+LONG_REQUIRED_COLS = ["firm_id", "year", "sheet", "line_item", "value"]
+_SHEET_CODES = {
+    "cdkt": "CDKT", "bs": "CDKT", "balance_sheet": "CDKT",
+    "bctn": "BCTN", "kqkd": "BCTN", "is": "BCTN", "income_statement": "BCTN",
+    "lctt": "LCTT", "cf": "LCTT", "cash_flow": "LCTT",
+}
+
+def _alias_table() -> pd.DataFrame:
+    """Bảng (sheet, nhãn chuẩn hóa, khoản mục) từ ALIAS_IS/ALIAS_BS/ALIAS_CF theo thứ tự ưu tiên của RATIO_ITEMS."""
+    rows = [(sheet, alias, name)
+            for name, (sheet, key) in RATIO_ITEMS.items()
+            for alias in _SHEET_ALIASES[sheet][key]]
+    table = pd.DataFrame(rows, columns=["sheet", "label", "item"])
+    table["label"] = _norm_label(table["label"])
+    return table.drop_duplicates(["sheet", "label"])
+
+def map_line_items(long_df: pd.DataFrame) -> pd.Series:
+    """
+    Gán khoản mục (DTT, TTS, ...) cho từng dòng: join trên nhãn chuẩn hóa, nhãn chưa khớp thì
+    tìm alias là chuỗi con bằng _label_contains (cùng bộ so khớp với workbook) - chỉ trên tập
+    nhãn duy nhất, không theo từng dòng.
+    """
+    keys = pd.DataFrame({
+        "sheet": long_df["sheet"].astype(str).str.strip().str.lower().map(_SHEET_CODES),
+        "label": _norm_label(long_df["line_item"]),
+    })
+    unique = keys.drop_duplicates().dropna(subset=["sheet"])
+    aliases = _alias_table()
+    matched = unique.merge(aliases, on=["sheet", "label"], how="left")
+    for sheet, alias, item in aliases.itertuples(index=False):
+        pending = matched["item"].isna() & (matched["sheet"] == sheet)
+        if not pending.any():
+            continue
+        hit = pending & _label_contains(matched["label"], alias)
+        matched.loc[hit, "item"] = item
+    return keys.merge(matched, on=["sheet", "label"], how="left")["item"].set_axis(long_df.index)
+
+def read_long_statements(uploaded) -> pd.DataFrame:
+    """Đọc file dạng dài (CSV hoặc Parquet) qua bộ nhớ đệm nạp dữ liệu và kiểm tra cột bắt buộc."""
+    if uploaded.name.lower().endswith(".parquet"):
+        try:
+            frame = ingest_table(uploaded.getvalue(), pd.read_parquet, kind="long_parquet")
+        except ImportError as e:
+            raise ValueError("Đọc Parquet cần cài pyarrow hoặc fastparquet") from e
+    else:
+        frame = ingest_table(uploaded.getvalue(), pd.read_csv, kind="long_csv")
+    frame.columns = [str(c).strip().lower() for c in frame.columns]
+    missing = [c for c in LONG_REQUIRED_COLS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"Thiếu cột: {missing}")
+    return frame
+
+def long_statements_to_ratios(long_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pivot báo cáo dạng dài về dạng hai kỳ (năm gần nhất + năm liền trước của từng doanh nghiệp)
+    và tính X1..X14 cho toàn bộ doanh nghiệp trong một lần gọi _ratios_from_arrays.
+    Kỳ trước là đúng năm year - 1: doanh nghiệp thiếu năm đó (kể cả có năm cũ hơn) được tính như
+    hồ sơ một kỳ - bình quân dùng số cuối kỳ - và đánh dấu has_prev_year = False.
+
+    Returns:
+        DataFrame index firm_id: year, has_prev_year, (firm_name), cột tiếng Việt + X_1..X_14
+    """
+    data = pd.DataFrame({
+        "firm_id": long_df["firm_id"].astype(str).str.strip(),
+        "year": pd.to_numeric(long_df["year"], errors="coerce"),
+        "item": map_line_items(long_df),
+        "value": pd.to_numeric(long_df["value"].astype(str).str.replace(",", "").str.replace(" ", ""), errors="coerce"),
+    }).dropna(subset=["year", "item"])
+    data["year"] = data["year"].astype(int)
+    if data.empty:
+        raise ValueError("Không khớp được khoản mục nào với bảng alias (CDKT/BCTN/LCTT)")
+
+    wide = (data.groupby(["firm_id", "year", "item"], sort=True)["value"].first()
+                .unstack("item").reindex(columns=list(RATIO_ITEMS)))
+    latest = ~wide.index.get_level_values("firm_id").duplicated(keep="last")
+    cur_wide = wide[latest]
+    firm_ids, years = cur_wide.index.get_level_values("firm_id"), cur_wide.index.get_level_values("year")
+    prev_wide = wide.reindex(pd.MultiIndex.from_arrays([firm_ids, years - 1], names=wide.index.names))
+    has_prev = prev_wide.index.isin(wide.index)
+
+    ratios = _ratio_frame(
+        _ratios_from_arrays({k: prev_wide[k].to_numpy() for k in RATIO_ITEMS}, {k: cur_wide[k].to_numpy() for k in RATIO_ITEMS}),
+        index=pd.Index(cur_wide.index.get_level_values("firm_id"), name="firm_id"),
+    )
+    ratios.insert(0, "has_prev_year", has_prev)
+    ratios.insert(0, "year", years)
+    if "firm_name" in long_df.columns:
+        names = long_df.assign(firm_id=long_df["firm_id"].astype(str).str.strip()).groupby("firm_id")["firm_name"].first()
+        ratios.insert(0, "firm_name", names.reindex(ratios.index).to_numpy())
+    return ratios
+
+def score_portfolio(ratios: pd.DataFrame, model, calibrator, model_cols: list, similar_index=None, k: int = SIMILAR_K) -> pd.DataFrame:
+    """PD thô/nhãn/PD hiệu chỉnh/hạng (+ tỷ lệ vỡ nợ nhóm tương tự) cho toàn bộ danh mục, vector hóa."""
+    scored = rate_pd(model, calibrator, ratios, model_cols)
+    scored.insert(1, "Dự đoán", np.where(scored["PD thô"] >= 0.15, "Default", "Non-Default"))
+    if similar_index is not None and "default" in similar_index.outcomes:
+        neighbours = similar_index.query(ratios.reset_index(drop=True), k=k)
+        scored["Tỷ lệ vỡ nợ nhóm tương tự"] = neighbours.groupby("Hồ sơ")["default"].mean().to_numpy()
+    return pd.concat([ratios.drop(columns=COMPUTED_COLS), scored], axis=1)
+
+# =========================
+# HÀM ĐỌC RSS FEED (SONG SONG, TIMEOUT, CONDITIONAL GET, STALE-WHILE-REVALIDATE)
+# =========================
+
+def _parse_feed_entries(feed, limit: int = RSS_MAX_ARTICLES) -> list:
+    """Chuyển entries của feedparser thành list dict {title, link, published}."""
+    articles = []
+
+    # Lấy các bài mới nhất
+    for entry in feed.entries[:limit]:
+        title = entry.get('title', 'Không có tiêu đề')
+        link = entry.get('link', '#')
+
+        # Xử lý thời gian
+        published = entry.get('published', '')
+        if not published:
+            published = entry.get('updated', '')
+
+        # Parse thời gian nếu có
+        pub_time = ""
+        if published:
+            try:
+                from dateutil import parser as date_parser
+                dt = date_parser.parse(published)
+                pub_time = dt.strftime('%d/%m/%Y %H:%M')
+            except:
+                pub_time = published
+
+        articles.append({
+            'title': title,
+            'link': link,
+            'published': pub_time
+        })
+
+    return articles
+
+
+class RSSFeedCache:
+    """
+    Cache RSS dùng chung cho mọi phiên trong tiến trình.
+
+    - Mỗi nguồn được tải trong thread riêng với timeout RSS_FETCH_TIMEOUT_S.
+    - Làm mới bằng conditional GET (If-None-Match / If-Modified-Since); 304 giữ nguyên bài cũ.
+    - Hết RSS_TTL_S: trả ngay bản cũ (stale) và làm mới nền (stale-while-revalidate).
+    - Tải lỗi: ghi lỗi kèm thời điểm (negative cache RSS_ERROR_TTL_S); đã có bản tải thành công
+      thì tiếp tục trả bản cũ, chưa có thì trả lỗi ngay thay vì chờ deadline ở mỗi lượt rerun.
+    - Single-flight: mỗi URL chỉ có tối đa một lượt tải đang chạy.
+    """
+
+    def __init__(self, mention_index=None):
+        self._lock = threading.Lock()
+        self._mention_index = mention_index
+        self._entries = {}   # url -> {"articles", "etag", "modified", "fetched_at", ("error", "failed_at")}
+        self._inflight = {}  # url -> Future
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rss")
+
+    @perf_span("rss_fetch")
+    def _revalidate(self, url: str, source_name: str) -> list:
+        with self._lock:
+            entry = self._entries.get(url)
+        headers = {"User-Agent": RSS_USER_AGENT}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("modified"):
+            headers["If-Modified-Since"] = entry["modified"]
+
+        try:
+            request = urllib.request.Request(url, headers=headers)
+            with urllib.request.urlopen(request, timeout=RSS_FETCH_TIMEOUT_S) as response:
+                body = response.read()
+                etag = response.headers.get("ETag")
+                modified = response.headers.get("Last-Modified")
+        except Exception as e:
+            if isinstance(e, urllib.error.HTTPError) and e.code == 304 and entry and entry["articles"] is not None:
+                with self._lock:
+                    entry["fetched_at"] = time.time()
+                    entry.pop("failed_at", None)
+                return entry["articles"]
+            self._record_failure(url, str(e))
+            raise
+
+        feed = feedparser.parse(body)
+        articles = _parse_feed_entries(feed)
+        try:
+            # Lưu toàn bộ entries (không chỉ 5 bài hiển thị) vào kho tin tức cục bộ,
+            # rồi dò tên khách hàng trong watchlist trên các bài mới
+            new_articles = archive_news_entries(feed.entries, source_name)
+            if new_articles and self._mention_index is not None:
+                self._mention_index.index_articles(new_articles)
+        except Exception:
+            pass
+        with self._lock:
+            self._entries[url] = {
+                "articles": articles,
+                "etag": etag,
+                "modified": modified,
+                "fetched_at": time.time(),
+            }
+        return articles
+
+    def _record_failure(self, url: str, message: str):
+        # Giữ nguyên bài/etag của lần thành công trước (nếu có) để tiếp tục phục vụ bản cũ
+        with self._lock:
+            entry = self._entries.setdefault(url, {"articles": None, "etag": None, "modified": None, "fetched_at": None})
+            entry["error"] = message
+            entry["failed_at"] = time.time()
+
+    def recently_failed(self, url: str) -> bool:
+        """Lần tải gần nhất lỗi và chưa quá RSS_ERROR_TTL_S: chưa thử lại."""
+        with self._lock:
+            entry = self._entries.get(url)
+        failed_at = entry.get("failed_at") if entry else None
+        return failed_at is not None and time.time() - failed_at < RSS_ERROR_TTL_S
+
+    def refresh(self, url: str, source_name: str = ""):
+        """Bắt đầu (hoặc dùng lại) lượt tải đang chạy của URL, trả về Future."""
+        with self._lock:
+            future = self._inflight.get(url)
+            if future is None:
+                future = self._executor.submit(self._revalidate, url, source_name)
+                self._inflight[url] = future
+                future.add_done_callback(lambda f, u=url: self._finish(u, f))
+        return future
+
+    def _finish(self, url: str, future):
+        with self._lock:
+            if self._inflight.get(url) is future:
+                del self._inflight[url]
+
+    def age(self, url: str):
+        """Số giây kể từ lần tải/xác nhận thành công gần nhất (None nếu chưa có)."""
+        with self._lock:
+            entry = self._entries.get(url)
+        return None if entry is None or entry["fetched_at"] is None else time.time() - entry["fetched_at"]
+
+    def cached(self, url: str, source_name: str = ""):
+        """
+        Trả về (articles, is_fresh) nếu đã có trong cache (kể cả kết quả lỗi), ngược lại None.
+        Bản đã cũ vẫn được trả về và lượt làm mới nền được khởi động (trừ khi vừa tải lỗi).
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        is_fresh = entry is not None and entry["fetched_at"] is not None and time.time() - entry["fetched_at"] < RSS_TTL_S
+        perf_cache("rss", hit=is_fresh)
+        if entry is None:
+            return None
+        if not is_fresh and not self.recently_failed(url):
+            self.refresh(url, source_name)
+        if entry["articles"] is None:
+            return _rss_error_article(f"⚠️ Lỗi khi đọc RSS: {entry['error'][:50]}"), False
+        return entry["articles"], is_fresh
+
+
+@st.cache_resource
+def get_rss_feed_cache() -> RSSFeedCache:
+    return RSSFeedCache(get_borrower_mention_index())
+
+
+def _rss_error_article(message: str) -> list:
+    return [{"title": message, "link": "#", "published": ""}]
+
+
+def _rss_result(future) -> list:
+    try:
+        articles = future.result()
+    except Exception as e:
+        return _rss_error_article(f"⚠️ Lỗi khi đọc RSS: {str(e)[:50]}")
+    return articles if articles else _rss_error_article("Không có bài viết mới")
+
+
+def iter_rss_feeds(sources: dict, timeout_s: float = RSS_FETCH_TIMEOUT_S):
+    """
+    Đọc đồng thời nhiều nguồn RSS, trả về lần lượt (tên nguồn, danh sách bài)
+    theo thứ tự nguồn nào có dữ liệu trước.
+
+    Parameters:
+    - sources: dict {tên nguồn: URL}
+    - timeout_s: deadline cho các nguồn chưa có trong cache
+
+    Yields:
+    - (source_name, list dict {title, link, published})
+    """
+    if not _FEEDPARSER_OK:
+        for source_name in sources:
+            yield source_name, _rss_error_article("⚠️ Thiếu thư viện feedparser")
+        return
+
+    cache = get_rss_feed_cache()
+    pending = {}
+    for source_name, url in sources.items():
+        cached = cache.cached(url, source_name)
+        if cached is not None:
+            articles, _is_fresh = cached
+            yield source_name, articles if articles else _rss_error_article("Không có bài viết mới")
+        else:
+            pending[cache.refresh(url, source_name)] = source_name
+
+    try:
+        for future in as_completed(pending, timeout=timeout_s):
+            yield pending.pop(future), _rss_result(future)
+    except FuturesTimeoutError:
+        for source_name in pending.values():
+            yield source_name, _rss_error_article(f"⚠️ Nguồn tin phản hồi quá {timeout_s:g} giây, thử lại sau")
+
+
+def fetch_rss_feed(url, source_name):
+    """
+    Đọc RSS feed từ URL và trả về 5 bài mới nhất.
+
+    Parameters:
+    - url: Đường dẫn RSS feed
+    - source_name: Tên nguồn tin
+
+    Returns:
+    - List của dict chứa {title, link, published}
+    """
+    for _name, articles in iter_rss_feeds({source_name: url}):
+        return articles
+
+
+def _render_news_articles(articles: list) -> str:
+    """HTML thẻ tin tức cho một nguồn."""
+    cards = []
+    for article in articles:
+        cards.append(f"""
+                    <div style='
+                        padding: 10px;
+                        margin: 8px 0;
+                        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
+                        border-radius: 8px;
+                        border-left: 4px solid #667eea;
+                    '>
+                        <div style='font-size: 14px; font-weight: 600; color: #2c3e50; margin-bottom: 5px;'>
+                            📌 {article['title']}
+                        </div>
+                        <div style='font-size: 12px; color: #7f8c8d; margin-bottom: 8px;'>
+                            🕐 {article['published']}
+                        </div>
+                        <a href='{article['link']}' target='_blank' style='
+                            color: #667eea;
+                            text-decoration: none;
+                            font-size: 12px;
+                            font-weight: 600;
+                        '>
+                            🔗 Đọc chi tiết →
+                        </a>
+                    </div>
+                    """)
+    return "".join(cards)
+
+
+# =========================
+# KHO TIN TỨC CỤC BỘ (SQLITE + FTS5): CHỈ GHI THÊM, KHỬ TRÙNG THEO LINK, TÌM KIẾM TOÀN VĂN
+# =========================
+
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _ensure_news_schema(conn: sqlite3.Connection) -> bool:
+    """Tạo bảng bài viết + chỉ mục FTS5. Trả về False nếu SQLite không hỗ trợ FTS5."""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS news_articles (
+               link_hash TEXT PRIMARY KEY,
+               link TEXT NOT NULL,
+               title TEXT NOT NULL,
+               summary TEXT,
+               source TEXT,
+               published_ts INTEGER,
+               first_seen_ts INTEGER NOT NULL
+           )"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_news_ts ON news_articles(COALESCE(published_ts, first_seen_ts))"
+    )
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5("
+            "title, summary, content='news_articles', content_rowid='rowid', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute(
+            """CREATE TRIGGER IF NOT EXISTS news_articles_ai AFTER INSERT ON news_articles BEGIN
+                   INSERT INTO news_fts(rowid, title, summary) VALUES (new.rowid, new.title, new.summary);
+               END"""
+        )
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _news_link_hash(link: str) -> str:
+    return hashlib.sha1(link.strip().encode("utf-8")).hexdigest()
+
+
+def _entry_timestamp(entry):
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    return calendar.timegm(parsed) if parsed else None
+
+
+def archive_news_entries(entries, source_name: str) -> list:
+    """
+    Ghi các entry RSS vào kho (bỏ qua bài đã có theo hash của link).
+
+    Returns:
+        List dict các bài mới được thêm {link_hash, link, title, summary, source, published_ts}
+    """
+    now = int(time.time())
+    new_articles = []
+    with closing(_store_connect(NEWS_ARCHIVE_PATH)) as conn, conn:
+        _ensure_news_schema(conn)
+        for entry in entries:
+            link = (entry.get("link") or "").strip()
+            if not link:
+                continue
+            summary = html.unescape(_HTML_TAG_RE.sub(" ", entry.get("summary", "") or ""))
+            article = {
+                "link_hash": _news_link_hash(link),
+                "link": link,
+                "title": (entry.get("title") or "Không có tiêu đề").strip(),
+                "summary": " ".join(summary.split()),
+                "source": source_name,
+                "published_ts": _entry_timestamp(entry),
+            }
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO news_articles "
+                "(link_hash, link, title, summary, source, published_ts, first_seen_ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (article["link_hash"], link, article["title"], article["summary"], source_name,
+                 article["published_ts"], now),
+            )
+            if cursor.rowcount:
+                new_articles.append(article)
+    return new_articles
+
+
+def _fts_query(keywords: str) -> str:
+    """Biến chuỗi người dùng nhập thành truy vấn FTS5 an toàn (mọi từ đều phải xuất hiện)."""
+    terms = [t.replace('"', '""') for t in keywords.split() if t.strip()]
+    return " ".join(f'"{t}"' for t in terms)
+
+
+def search_news_archive(keywords: str = "", date_from=None, date_to=None, limit: int = 200) -> pd.DataFrame:
+    """
+    Tìm bài trong kho theo từ khóa (tiêu đề + tóm tắt, không phân biệt dấu) và khoảng ngày.
+
+    Parameters:
+    - keywords: từ khóa (rỗng = chỉ lọc theo ngày)
+    - date_from, date_to: datetime.date theo giờ Việt Nam (NEWS_TZ, bao gồm cả hai đầu), None = không giới hạn
+    - limit: số bài tối đa trả về (mới nhất trước)
+    """
+    clauses, params = [], []
+    if date_from is not None:
+        clauses.append("COALESCE(a.published_ts, a.first_seen_ts) >= ?")
+        params.append(int(pd.Timestamp(date_from, tz=NEWS_TZ).timestamp()))
+    if date_to is not None:
+        clauses.append("COALESCE(a.published_ts, a.first_seen_ts) < ?")
+        params.append(int((pd.Timestamp(date_to, tz=NEWS_TZ) + pd.Timedelta(days=1)).timestamp()))
+
+    with closing(_store_connect(NEWS_ARCHIVE_PATH)) as conn:
+        fts_ok = _ensure_news_schema(conn)
+        query = _fts_query(keywords)
+        source_sql = "news_articles a"
+        if query and fts_ok:
+            source_sql = "news_fts JOIN news_articles a ON a.rowid = news_fts.rowid"
+            clauses.insert(0, "news_fts MATCH ?")
+            params.insert(0, query)
+        elif query:
+            for term in keywords.split():
+                clauses.append("(a.title LIKE ? OR a.summary LIKE ?)")
+                params += [f"%{term}%", f"%{term}%"]
+        where_sql = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        rows = pd.read_sql_query(
+            f"SELECT COALESCE(a.published_ts, a.first_seen_ts) AS ts, a.source, a.title, a.link "
+            f"FROM {source_sql} {where_sql} ORDER BY ts DESC LIMIT ?",
+            conn,
+            params=params + [int(limit)],
+        )
+
+    return pd.DataFrame({
+        "Thời gian": pd.to_datetime(rows["ts"], unit="s", utc=True).dt.tz_convert(NEWS_TZ).dt.strftime("%d/%m/%Y %H:%M"),
+        "Nguồn": rows["source"],
+        "Tiêu đề": rows["title"],
+        "Link": rows["link"],
+    })
+
+
+def news_archive_count() -> int:
+    with closing(_store_connect(NEWS_ARCHIVE_PATH)) as conn:
+        _ensure_news_schema(conn)
+        return conn.execute("SELECT COUNT(*) FROM news_articles").fetchone()[0]
+
+
+# =========================
+# DÒ TÊN KHÁCH HÀNG TRÊN TIN TỨC (AHO-CORASICK, BỎ DẤU TIẾNG VIỆT)
+# =========================
+
+_NON_ALNUM_RE = re.compile(r"[^0-9a-z]+")
+# Loại hình doanh nghiệp ở đầu tên, bỏ đi để khớp được cách báo chí gọi tắt. Chỉ gồm cụm nhiều từ và
+# viết tắt không trùng tên thương mại ("cp" bị loại: "CP Foods" phải giữ nguyên, không thành "foods")
+_LEGAL_FORM_RE = re.compile(
+    r"^(tong cong ty|tap doan|cong ty|cty|co phan|ctcp|tnhh mot thanh vien|tnhh|"
+    r"trach nhiem huu han|hop danh|doanh nghiep tu nhan|dntn)\s+"
+)
+
+
+def normalize_vi(text) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ), thay ký tự không phải chữ/số bằng 1 khoảng trắng."""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_NON_ALNUM_RE.sub(" ", text).split())
+
+
+def borrower_key(name) -> str:
+    """Khóa watchlist của khách hàng: tên đã chuẩn hóa, bỏ tiền tố loại hình doanh nghiệp."""
+    key = normalize_vi(name)
+    while True:
+        stripped = _LEGAL_FORM_RE.sub("", key)
+        if stripped == key:
+            return key
+        key = stripped
+
+
+def is_watchlist_key(key: str) -> bool:
+    """Khóa đủ đặc trưng để dò trên tin tức: ít nhất BORROWER_MIN_KEY_TOKENS từ hoặc một từ dài."""
+    return len(key.split()) >= BORROWER_MIN_KEY_TOKENS or len(key) >= BORROWER_MIN_KEY_LEN
+
+
+class BorrowerMatcher:
+    """
+    Bộ dò đa mẫu Aho-Corasick trên các khóa watchlist đã chuẩn hóa.
+
+    Xây một lần cho cả watchlist; mỗi bài viết được quét trong thời gian tuyến tính
+    theo độ dài văn bản, bất kể watchlist có bao nhiêu tên. Chỉ nhận khớp trọn từ.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(p for p in patterns if is_watchlist_key(p)))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for idx, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(idx)
+
+        # Liên kết fail theo BFS
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text_norm: str) -> set:
+        """Trả về tập khóa watchlist xuất hiện (trọn từ) trong văn bản đã normalize_vi."""
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        n = len(text_norm)
+        hits = set()
+        node = 0
+        for i, ch in enumerate(text_norm):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                start = i - len(patterns[idx]) + 1
+                if (start == 0 or text_norm[start - 1] == " ") and (i + 1 == n or text_norm[i + 1] == " "):
+                    hits.add(patterns[idx])
+        return hits
+
+
+def _ensure_watchlist_schema(conn: sqlite3.Connection):
+    _ensure_news_schema(conn)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS borrower_watchlist (
+               name_norm TEXT PRIMARY KEY,
+               name TEXT NOT NULL,
+               pd REAL,
+               added_ts INTEGER NOT NULL,
+               updated_ts INTEGER NOT NULL
+           )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS news_mentions (
+               link_hash TEXT NOT NULL,
+               name_norm TEXT NOT NULL,
+               PRIMARY KEY (link_hash, name_norm)
+           )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mentions_name ON news_mentions(name_norm)")
+
+
+def _match_articles(matcher: BorrowerMatcher, articles) -> list:
+    """Các cặp (link_hash, name_norm) khớp trên tiêu đề + tóm tắt."""
+    rows = []
+    for article in articles:
+        text = normalize_vi(f"{article['title']} {article.get('summary') or ''}")
+        rows.extend((article["link_hash"], key) for key in matcher.find(text))
+    return rows
+
+
+class BorrowerMentionIndex:
+    """Giữ bộ dò đã biên dịch cho watchlist hiện tại, chỉ xây lại khi watchlist có tên mới."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._matcher = None
+
+    def _current_matcher(self, conn: sqlite3.Connection) -> BorrowerMatcher:
+        signature = conn.execute("SELECT COUNT(*), COALESCE(MAX(added_ts), 0) FROM borrower_watchlist").fetchone()
+        with self._lock:
+            if signature != self._signature:
+                keys = [row[0] for row in conn.execute("SELECT name_norm FROM borrower_watchlist")]
+                self._matcher = BorrowerMatcher(keys)
+                self._signature = signature
+            return self._matcher
+
+    def index_articles(self, articles) -> int:
+        """Dò watchlist trên các bài mới được lưu vào kho; trả về số lượt nhắc tên ghi nhận."""
+        with closing(_store_connect(NEWS_ARCHIVE_PATH)) as conn, conn:
+            _ensure_watchlist_schema(conn)
+            matcher = self._current_matcher(conn)
+            if not matcher.patterns:
+                return 0
+            rows = _match_articles(matcher, articles)
+            conn.executemany("INSERT OR IGNORE INTO news_mentions (link_hash, name_norm) VALUES (?, ?)", rows)
+        return len(rows)
+
+
+@st.cache_resource
+def get_borrower_mention_index() -> BorrowerMentionIndex:
+    return BorrowerMentionIndex()
+
+
+def add_borrowers_to_watchlist(borrowers) -> int:
+    """
+    Thêm/cập nhật khách hàng vào watchlist theo dõi tin tức.
+
+    Parameters:
+    - borrowers: iterable (tên khách hàng, PD) - từ báo cáo Word hoặc kết quả chấm điểm hàng loạt
+
+    Returns:
+    - Số khách hàng mới; các tên mới được quét ngược một lần trên toàn bộ kho tin tức.
+    """
+    now = int(time.time())
+    new_keys = []
+    with closing(_store_connect(NEWS_ARCHIVE_PATH)) as conn, conn:
+        _ensure_watchlist_schema(conn)
+        for name, pd_value in borrowers:
+            key = borrower_key(name)
+            if not is_watchlist_key(key):
+                continue
+            pd_value = float(pd_value) if pd.notna(pd_value) else None
+            existed = conn.execute("SELECT 1 FROM borrower_watchlist WHERE name_norm = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT INTO borrower_watchlist (name_norm, name, pd, added_ts, updated_ts) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name_norm) DO UPDATE SET name = excluded.name, pd = excluded.pd, updated_ts = excluded.updated_ts",
+                (key, str(name).strip(), pd_value, now, now),
+            )
+            if not existed:
+                new_keys.append(key)
+
+        if new_keys:
+            matcher = BorrowerMatcher(new_keys)
+            cursor = conn.execute("SELECT link_hash, title, summary FROM news_articles")
+            while True:
+                batch = cursor.fetchmany(5000)
+                if not batch:
+                    break
+                articles = [{"link_hash": h, "title": t, "summary": sm} for h, t, sm in batch]
+                conn.executemany(
+                    "INSERT OR IGNORE INTO news_mentions (link_hash, name_norm) VALUES (?, ?)",
+                    _match_articles(matcher, articles),
+                )
+    return len(new_keys)
+
+
+def borrower_news_mentions(name: str = None, limit: int = 50) -> pd.DataFrame:
+    """
+    Các bài viết nhắc đến khách hàng trong watchlist, mới nhất trước.
+    name=None: mọi khách hàng trong watchlist (bảng cảnh báo sớm).
+    """
+    params = []
+    where_sql = ""
+    if name is not None:
+        where_sql = "WHERE m.name_norm = ?"
+        params.append(borrower_key(name))
+    with closing(_store_connect(NEWS_ARCHIVE_PATH)) as conn:
+        _ensure_watchlist_schema(conn)
+        rows = pd.read_sql_query(
+            "SELECT w.name, w.pd, COALESCE(a.published_ts, a.first_seen_ts) AS ts, a.source, a.title, a.link "
+            "FROM news_mentions m "
+            "JOIN news_articles a ON a.link_hash = m.link_hash "
+            "JOIN borrower_watchlist w ON w.name_norm = m.name_norm "
+            f"{where_sql} ORDER BY ts DESC LIMIT ?",
+            conn,
+            params=params + [int(limit)],
+        )
+    return pd.DataFrame({
+        "Khách hàng": rows["name"],
+        "PD": rows["pd"],
+        "Thời gian": pd.to_datetime(rows["ts"], unit="s", utc=True).dt.tz_convert(NEWS_TZ).dt.strftime("%d/%m/%Y %H:%M"),
+        "Nguồn": rows["source"],
+        "Tiêu đề": rows["title"],
+        "Link": rows["link"],
+    })
+
+# =========================
+# TIỀN XỬ LÝ & MÔ HÌNH PD (PIPELINE: WINSORIZE -> ĐIỀN THIẾU -> CHUẨN HÓA -> LOGREG)
+# =========================
+
+class QuantileClipper(BaseEstimator, TransformerMixin):
+    """
+    Winsorize từng cột theo phân vị học từ dữ liệu huấn luyện; inf/-inf (từ phép chia cho 0)
+    được đổi thành NaN để bước SimpleImputer xử lý.
+    """
+
+    def __init__(self, lower: float = WINSOR_QUANTILES[0], upper: float = WINSOR_QUANTILES[1]):
+        self.lower = lower
+        self.upper = upper
+
+    def _to_array(self, X) -> np.ndarray:
+        if hasattr(X, "columns") and hasattr(self, "feature_names_in_"):
+            X = X[list(self.feature_names_in_)]  # Đúng thứ tự cột lúc huấn luyện
+        X = np.array(X, dtype=np.float64)
+        X[~np.isfinite(X)] = np.nan
+        return X
+
+    def fit(self, X, y=None):
+        if hasattr(X, "columns"):
+            self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        X = self._to_array(X)
+        self.n_features_in_ = X.shape[1]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Cột toàn NaN
+            lo, hi = np.nanpercentile(X, [self.lower * 100, self.upper * 100], axis=0)
+        self.lower_ = np.where(np.isnan(lo), -np.inf, lo)
+        self.upper_ = np.where(np.isnan(hi), np.inf, hi)
+        return self
+
+    def transform(self, X):
+        return np.clip(self._to_array(X), self.lower_, self.upper_)
+
+
+def make_preprocessor() -> Pipeline:
+    """Bước tiền xử lý dùng chung cho huấn luyện, chấm điểm đơn lẻ và chấm điểm hàng loạt."""
+    return Pipeline([
+        ("clip", QuantileClipper()),
+        ("impute", SimpleImputer(strategy="median", keep_empty_features=True)),
+        ("scale", StandardScaler()),
+    ])
+
+
+def make_pd_model() -> Pipeline:
+    """Pipeline PD đầy đủ; tiền xử lý được fit một lần và lưu cùng mô hình."""
+    return Pipeline(make_preprocessor().steps + [
+        ("clf", LogisticRegression(random_state=42, max_iter=LOGREG_MAX_ITER, class_weight="balanced", solver="lbfgs")),
+    ])
+
+
+def score_pd(model, frame: pd.DataFrame, model_cols: list) -> np.ndarray:
+    """PD thô (predict_proba lớp 1) cho mọi dòng của `frame`, vector hóa."""
+    return model.predict_proba(frame[model_cols])[:, 1]
+
+
+class PDCalibrator:
+    """
+    Đưa điểm thô của mô hình (bị đẩy lên do class_weight="balanced") về PD khớp tỷ lệ vỡ nợ quan sát.
+    Isotonic khi có từ PD_ISOTONIC_MIN_DEFAULTS quan sát vỡ nợ, ngược lại Platt (logistic trên logit điểm).
+    Cần fit trên điểm out-of-fold/hold-out, không dùng điểm của chính dữ liệu đã huấn luyện.
+    """
+
+    def __init__(self, method: str = "auto"):
+        self.method = method
+
+    @staticmethod
+    def _logit(scores) -> np.ndarray:
+        p = np.clip(np.asarray(scores, dtype=np.float64), 1e-6, 1 - 1e-6)
+        return np.log(p / (1 - p)).reshape(-1, 1)
+
+    def fit(self, scores, y):
+        y = np.asarray(y, dtype=int)
+        method = self.method
+        if method == "auto":
+            method = "isotonic" if y.sum() >= PD_ISOTONIC_MIN_DEFAULTS else "platt"
+        if method == "isotonic":
+            self.estimator_ = IsotonicRegression(out_of_bounds="clip", y_min=0.0, y_max=1.0)
+            self.estimator_.fit(np.asarray(scores, dtype=np.float64), y)
+        else:
+            self.estimator_ = LogisticRegression(C=1e4).fit(self._logit(scores), y)
+        self.method_ = method
+        return self
+
+    def predict(self, scores) -> np.ndarray:
+        if self.method_ == "isotonic":
+            calibrated = self.estimator_.predict(np.asarray(scores, dtype=np.float64))
+        else:
+            calibrated = self.estimator_.predict_proba(self._logit(scores))[:, 1]
+        return np.clip(calibrated, PD_FLOOR, 1.0)
+
+
+def fit_pd_calibrator(X_train, y_train) -> PDCalibrator:
+    """Hiệu chỉnh trên điểm out-of-fold (cross_val_predict) của chính pipeline PD."""
+    cv = StratifiedKFold(n_splits=PD_CALIBRATION_FOLDS, shuffle=True, random_state=42)
+    oof = cross_val_predict(make_pd_model(), X_train, y_train, cv=cv, method="predict_proba")[:, 1]
+    return PDCalibrator().fit(oof, y_train)
+
+
+_PD_GRADE_EDGES = np.array([upper for _, upper, _ in PD_MASTER_SCALE])
+_PD_GRADES = np.array([grade for grade, _, _ in PD_MASTER_SCALE], dtype=object)
+_PD_GRADE_DESC = {grade: desc for grade, _, desc in PD_MASTER_SCALE}
+
+
+def pd_grade(pd_values) -> np.ndarray:
+    """Hạng master scale cho mảng PD: tìm nhị phân trên cận trên các bậc (O(log n) mỗi PD)."""
+    pd_values = np.atleast_1d(np.asarray(pd_values, dtype=np.float64))
+    idx = np.searchsorted(_PD_GRADE_EDGES, np.clip(np.nan_to_num(pd_values, nan=1.0), 0, 1), side="left")
+    grades = _PD_GRADES[np.minimum(idx, len(_PD_GRADES) - 1)]
+    grades[np.isnan(pd_values)] = "N/A"
+    return grades
+
+
+def master_scale_table() -> pd.DataFrame:
+    """Bảng thang xếp hạng để hiển thị."""
+    lower = np.concatenate([[0.0], _PD_GRADE_EDGES[:-1]])
+    return pd.DataFrame({
+        "Hạng": _PD_GRADES,
+        "PD từ": lower,
+        "PD đến": _PD_GRADE_EDGES,
+        "Mô tả": [desc for _, _, desc in PD_MASTER_SCALE],
+    })
+
+
+def rate_pd(model, calibrator: PDCalibrator, frame: pd.DataFrame, model_cols: list) -> pd.DataFrame:
+    """Chấm điểm hàng loạt: PD thô, PD hiệu chỉnh và hạng cho mọi dòng của `frame`."""
+    raw = score_pd(model, frame, model_cols)
+    calibrated = calibrator.predict(raw)
+    return pd.DataFrame({"PD thô": raw, "PD hiệu chỉnh": calibrated, "Hạng": pd_grade(calibrated)}, index=frame.index)
+
+# =========================
+# SO SÁNH VỚI TỔNG THỂ HUẤN LUYỆN (PHÂN VỊ THEO TỪNG CHỈ SỐ)
+# =========================
+
+class PeerBenchmark:
+    """
+    Mảng giá trị đã sắp xếp cho từng chỉ số của tổng thể huấn luyện (tính một lần mỗi bộ dữ liệu).
+    Phân vị của một/nhiều doanh nghiệp = tìm nhị phân (searchsorted) trên các mảng này.
+    """
+
+    def __init__(self, frame: pd.DataFrame, model_cols: list):
+        self.model_cols = list(model_cols)
+        self.sorted_values = {}
+        for col in self.model_cols:
+            values = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=np.float64)
+            self.sorted_values[col] = np.sort(values[np.isfinite(values)])
+
+    def percentiles(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Phân vị (0-100, hạng giữa cho giá trị trùng) của mọi dòng trong `frame`; NaN nếu giá trị không hữu hạn."""
+        out = {}
+        for col in self.model_cols:
+            ref = self.sorted_values[col]
+            values = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=np.float64)
+            if len(ref) == 0:
+                out[col] = np.full(len(values), np.nan)
+                continue
+            rank = (np.searchsorted(ref, values, side="left") + np.searchsorted(ref, values, side="right")) / 2.0
+            pct = 100.0 * rank / len(ref)
+            pct[~np.isfinite(values)] = np.nan
+            out[col] = pct
+        return pd.DataFrame(out, index=frame.index)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_peer_benchmark(dataset_key: str, _frame: pd.DataFrame, model_cols: tuple) -> PeerBenchmark:
+    return PeerBenchmark(_frame, list(model_cols))
+
+
+class SimilarBorrowerIndex:
+    """
+    KD-tree trên X_1..X_14 của dữ liệu huấn luyện sau bước tiền xử lý của mô hình
+    (winsorize, điền thiếu, chuẩn hóa) để các chỉ số có cùng thang khoảng cách.
+    """
+
+    def __init__(self, frame: pd.DataFrame, preprocessor, model_cols: list):
+        self.model_cols = list(model_cols)
+        self.preprocessor = preprocessor
+        self.tree = KDTree(preprocessor.transform(frame[self.model_cols]))
+        outcome_cols = [c for c in SIMILAR_OUTCOME_COLS if c in frame.columns]
+        self.outcomes = frame[outcome_cols].reset_index(drop=True)
+        self.row_ids = frame.index.to_numpy()
+
+    def query(self, frame: pd.DataFrame, k: int = SIMILAR_K) -> pd.DataFrame:
+        """
+        k láng giềng gần nhất cho mọi dòng của `frame` (một hồ sơ hoặc cả danh mục).
+
+        Returns:
+            DataFrame dạng dài: Hồ sơ (index dòng truy vấn), Thứ hạng, Khoảng cách, Dòng dữ liệu + default/LGD/EAD
+        """
+        k = max(1, min(int(k), len(self.row_ids)))
+        dist, idx = self.tree.query(self.preprocessor.transform(frame[self.model_cols]), k=k)
+        flat = idx.ravel()
+        result = pd.DataFrame({
+            "Hồ sơ": np.repeat(frame.index.to_numpy(), k),
+            "Thứ hạng": np.tile(np.arange(1, k + 1), len(frame)),
+            "Khoảng cách": dist.ravel(),
+            "Dòng dữ liệu": self.row_ids[flat],
+        })
+        return pd.concat([result, self.outcomes.iloc[flat].reset_index(drop=True)], axis=1)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_similar_borrower_index(dataset_key: str, _frame: pd.DataFrame, _preprocessor, model_cols: tuple) -> SimilarBorrowerIndex:
+    return SimilarBorrowerIndex(_frame, _preprocessor, list(model_cols))
+
+# =========================
+# HUẤN LUYỆN DẠNG LUỒNG (CSV LỚN, NGOÀI BỘ NHỚ)
+# =========================
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    """Hàm băm splitmix64 (vector hóa) cho chỉ số dòng."""
+    with np.errstate(over="ignore"):
+        z = x.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+class StratifiedHoldout:
+    """
+    Tách hold-out phân tầng theo lớp khi đọc file theo khối, không cần giữ cả file: dòng thứ k của lớp c
+    (đếm nối tiếp qua các khối) vào tập test khi ⌊(k+1)·f + φ_c⌋ > ⌊k·f + φ_c⌋, độ lệch φ_c băm từ nhãn
+    (splitmix64). Mỗi lớp có đúng ⌊n_c·f + φ_c⌋ dòng test, tức f·n_c làm tròn lên hoặc xuống; cùng thứ tự
+    dòng thì cùng kết quả, nên mỗi lượt đọc file dùng một đối tượng mới.
+    """
+
+    def __init__(self, fraction: float = STREAM_TEST_FRACTION):
+        self.fraction = fraction
+        self.seen = np.zeros(2, dtype=np.int64)
+        self.phase = (_splitmix64(np.arange(2)) >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+    def mask(self, y: np.ndarray) -> np.ndarray:
+        """Mặt nạ test cho khối kế tiếp (nhãn 0/1 theo thứ tự dòng trong file)."""
+        test = np.zeros(len(y), dtype=bool)
+        for c in (0, 1):
+            rows = np.flatnonzero(y == c)
+            k = self.seen[c] + np.arange(len(rows), dtype=np.int64)
+            test[rows] = (np.floor((k + 1) * self.fraction + self.phase[c])
+                          > np.floor(k * self.fraction + self.phase[c]))
+            self.seen[c] += len(rows)
+        return test
+
+
+class StreamingBinaryMetrics:
+    """Tích lũy ma trận nhầm lẫn và histogram xác suất theo lớp để tính Accuracy/Precision/Recall/F1/AUC."""
+
+    def __init__(self, bins: int = STREAM_AUC_BINS, threshold: float = 0.5):
+        self.threshold = threshold
+        self.cm = np.zeros((2, 2), dtype=np.int64)
+        self.hist = np.zeros((2, bins), dtype=np.int64)
+
+    def update(self, y_true: np.ndarray, proba: np.ndarray):
+        y_pred = (proba >= self.threshold).astype(np.int64)
+        np.add.at(self.cm, (y_true, y_pred), 1)
+        bins = np.minimum((proba * self.hist.shape[1]).astype(np.int64), self.hist.shape[1] - 1)
+        np.add.at(self.hist, (y_true, bins), 1)
+
+    def auc(self) -> float:
+        neg, pos = self.hist
+        if neg.sum() == 0 or pos.sum() == 0:
+            return float("nan")
+        neg_below = np.cumsum(neg) - neg
+        # Cặp (dương, âm) cùng bin tính nửa, như xử lý điểm hòa trong ROC AUC
+        return float((pos * (neg_below + 0.5 * neg)).sum() / (pos.sum() * neg.sum()))
+
+    def as_dict(self, suffix: str) -> dict:
+        (tn, fp), (fn, tp) = self.cm
+        total = self.cm.sum()
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {
+            f"accuracy_{suffix}": (tp + tn) / total if total else float("nan"),
+            f"precision_{suffix}": precision,
+            f"recall_{suffix}": recall,
+            f"f1_{suffix}": f1,
+            f"auc_{suffix}": self.auc(),
+        }
+
+
+def _iter_training_chunks(source, chunk_rows: int, model_cols: list):
+    """
+    Đọc CSV huấn luyện theo khối -> (khối gốc, X float64, y int).
+    Bỏ các dòng có default không phải 0/1; giá trị thiếu/inf ở X để bước tiền xử lý xử lý.
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+    for i, chunk in enumerate(pd.read_csv(source, encoding='latin-1', chunksize=chunk_rows)):
+        if i == 0:
+            missing = [c for c in ['default'] + model_cols if c not in chunk.columns]
+            if missing:
+                raise ValueError(f"Thiếu cột: {missing}")
+        X = chunk[model_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        y = pd.to_numeric(chunk['default'], errors='coerce').to_numpy(dtype=np.float64)
+        valid = np.isin(y, (0, 1))
+        yield chunk[valid], X[valid], y[valid].astype(np.int64)
+
+
+@st.cache_resource(show_spinner="🌊 Đang huấn luyện mô hình dạng luồng trên dữ liệu lớn...")
+def train_streaming_model(source_key: str, _source, model_cols: tuple, chunk_rows: int = STREAM_CHUNK_ROWS,
+                          _progress=None) -> dict:
+    """
+    Huấn luyện logistic dạng luồng: CSV được đọc theo khối nhiều lượt, không lúc nào giữ cả file.
+
+    - Lượt 1: đếm lớp, lấy mẫu ngẫu nhiên STREAM_SAMPLE_ROWS dòng; bộ tiền xử lý (make_preprocessor)
+      được fit trên các dòng train của mẫu.
+    - STREAM_EPOCHS lượt: SGDClassifier(log_loss).partial_fit với trọng số cân bằng lớp.
+    - Lượt cuối: ma trận nhầm lẫn + histogram xác suất cho train/test (AUC dạng luồng).
+
+    Parameters:
+    - source_key: định danh nội dung nguồn (khóa cache)
+    - _source: đường dẫn CSV hoặc file tải lên (không dùng làm khóa cache)
+    - _progress: hàm (tỷ lệ 0-1, thông điệp) gọi sau mỗi lượt đọc file (job nền báo tiến độ), có thể None
+
+    Returns:
+        dict: model (Pipeline tiền xử lý + SGD), calibrator, metrics_in, metrics_out, cm_out, sample, n_rows, n_train, n_test
+    """
+    note_cache_miss()
+    model_cols = list(model_cols)
+    n_passes = STREAM_EPOCHS + 2
+
+    def report(done: int, message: str):
+        if _progress is not None:
+            _progress(done / n_passes, message)
+
+    rng = np.random.default_rng(42)
+    class_counts = np.zeros(2, dtype=np.int64)
+    n_rows = n_test = 0
+    sample, sample_keys, sample_test = None, np.empty(0), np.empty(0, dtype=bool)
+
+    holdout = StratifiedHoldout()
+    for chunk, X, y in _iter_training_chunks(_source, chunk_rows, model_cols):
+        train = ~holdout.mask(y)
+        class_counts += np.bincount(y[train], minlength=2)
+        n_rows += len(y)
+        n_test += int((~train).sum())
+        # Lấy mẫu theo khóa ngẫu nhiên nhỏ nhất: tương đương reservoir sampling, vector hóa theo khối
+        keys = np.concatenate([sample_keys, rng.random(len(chunk))])
+        flags = np.concatenate([sample_test, ~train])
+        pool = chunk if sample is None else pd.concat([sample, chunk], ignore_index=True)
+        keep = np.sort(np.argsort(keys, kind="stable")[:STREAM_SAMPLE_ROWS])
+        sample, sample_keys, sample_test = pool.iloc[keep].reset_index(drop=True), keys[keep], flags[keep]
+
+    if n_rows == 0 or (class_counts == 0).any():
+        raise ValueError("Dữ liệu huấn luyện cần đủ cả hai lớp default = 0 và 1")
+    report(1, f"Đã đọc {n_rows:,} dòng, bắt đầu huấn luyện")
+    class_weight = class_counts.sum() / (2.0 * class_counts)
+    sample_X = sample[model_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    prep = make_preprocessor().fit(sample_X[~sample_test])
+
+    clf = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42)
+    for epoch in range(STREAM_EPOCHS):
+        holdout = StratifiedHoldout()
+        for _, X, y in _iter_training_chunks(_source, chunk_rows, model_cols):
+            train = ~holdout.mask(y)
+            if not train.any():
+                continue
+            order = rng.permutation(int(train.sum()))
+            X_tr, y_tr = prep.transform(X[train])[order], y[train][order]
+            clf.partial_fit(X_tr, y_tr, classes=np.array([0, 1]), sample_weight=class_weight[y_tr])
+        report(2 + epoch, f"Xong lượt huấn luyện {epoch + 1}/{STREAM_EPOCHS}")
+
+    model = Pipeline(prep.steps + [("clf", clf)])
+    # Hiệu chỉnh PD trên các dòng hold-out của mẫu (chưa dùng để huấn luyện)
+    sample_y = pd.to_numeric(sample['default'], errors='coerce').to_numpy().astype(int)
+    sample_scores = clf.predict_proba(prep.transform(sample_X))[:, 1]
+    calib_rows = sample_test
+    if np.unique(sample_y[calib_rows]).size < 2:
+        calib_rows = np.ones(len(sample_y), dtype=bool)
+    calibrator = PDCalibrator().fit(sample_scores[calib_rows], sample_y[calib_rows])
+
+    acc_in, acc_out = StreamingBinaryMetrics(), StreamingBinaryMetrics()
+    holdout = StratifiedHoldout()
+    for _, X, y in _iter_training_chunks(_source, chunk_rows, model_cols):
+        test = holdout.mask(y)
+        proba = clf.predict_proba(prep.transform(X))[:, 1]
+        acc_in.update(y[~test], proba[~test])
+        acc_out.update(y[test], proba[test])
+
+    return {
+        "model": model,
+        "calibrator": calibrator,
+        "metrics_in": acc_in.as_dict("in"),
+        "metrics_out": acc_out.as_dict("out"),
+        "cm_out": acc_out.cm,
+        "sample": sample,
+        "n_rows": n_rows,
+        "n_train": n_rows - n_test,
+        "n_test": n_test,
+    }
+
+
+@st.cache_resource(max_entries=4, show_spinner="🛠️ Đang huấn luyện mô hình...")
+def train_batch_model(dataset_key: str, _df: pd.DataFrame, model_cols: tuple) -> dict:
+    """
+    Huấn luyện LogReg trên toàn bộ dữ liệu trong bộ nhớ (tách 80/20 phân tầng), một lần cho mỗi bộ dữ liệu:
+    các lần rerun và các phiên khác dùng lại mô hình thay vì fit lại.
+
+    Returns:
+        dict cùng dạng với train_streaming_model: model, calibrator, metrics_in, metrics_out, cm_out
+    """
+    note_cache_miss()
+    X = _df[list(model_cols)].astype(np.float64)  # Bản sao float64 (cột đọc từ memory-map chỉ đọc)
+    y = _df['default'].astype(int)
+
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42, stratify=y
+    )
+    model = make_pd_model()  # Winsorize + điền thiếu + chuẩn hóa được fit cùng LogReg
+    model.fit(X_train, y_train)
+    calibrator = fit_pd_calibrator(X_train, y_train)
+
+    y_pred_in = model.predict(X_train)
+    y_proba_in = model.predict_proba(X_train)[:, 1]
+    y_pred_out = model.predict(X_test)
+    y_proba_out = model.predict_proba(X_test)[:, 1]
+
+    return {
+        "model": model,
+        "calibrator": calibrator,
+        "metrics_in": {
+            "accuracy_in": accuracy_score(y_train, y_pred_in),
+            "precision_in": precision_score(y_train, y_pred_in, zero_division=0),
+            "recall_in": recall_score(y_train, y_pred_in, zero_division=0),
+            "f1_in": f1_score(y_train, y_pred_in, zero_division=0),
+            "auc_in": roc_auc_score(y_train, y_proba_in),
+        },
+        "metrics_out": {
+            "accuracy_out": accuracy_score(y_test, y_pred_out),
+            "precision_out": precision_score(y_test, y_pred_out, zero_division=0),
+            "recall_out": recall_score(y_test, y_pred_out, zero_division=0),
+            "f1_out": f1_score(y_test, y_pred_out, zero_division=0),
+            "auc_out": roc_auc_score(y_test, y_proba_out),
+        },
+        "cm_out": confusion_matrix(y_test, y_pred_out),
+    }
+
+
+def training_source_key(uploaded_file, path: str) -> str:
+    """Khóa nhận diện nguồn huấn luyện mà không cần đọc hết nội dung file."""
+    if uploaded_file is not None:
+        return f"upload:{uploaded_file.file_id}:{uploaded_file.size}"
+    stat = os.stat(path)
+    return f"path:{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+# =========================
+# BIỂU ĐỒ DASHBOARD GSO (PLOTLY, VẼ TRÊN TRÌNH DUYỆT)
+# =========================
+
+_CHART_LAYOUT = dict(
+    paper_bgcolor='#fff5f7',
+    plot_bgcolor='#ffffff',
+    font=dict(color='#4a5568'),
+    title_font=dict(size=16, color='#c2185b'),
+    hovermode='x unified',
+    legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='left', x=0),
+    margin=dict(l=60, r=20, t=80, b=60),
+)
+
+
+@st.cache_data(show_spinner=False)
+def gso_columnar(gso_data: pd.DataFrame) -> dict:
+    """
+    Bản sao dạng cột của dữ liệu GSO: nhãn quý + mảng float64 cho từng cột số.
+    Được cache theo nội dung DataFrame nên các lần rerun (đổi bộ lọc quý...) không chuyển đổi lại.
+    """
+    columns = {'Quý': gso_data['Quý'].astype(str).to_numpy()}
+    for col in gso_data.columns:
+        if col != 'Quý':
+            columns[col] = pd.to_numeric(gso_data[col], errors='coerce').to_numpy(dtype=np.float64)
+    return columns
+
+
+def lttb_indices(y: np.ndarray, threshold: int = CHART_MAX_POINTS) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: chọn `threshold` điểm giữ được hình dạng chuỗi.
+    Trả về chỉ số các điểm được giữ (luôn gồm điểm đầu và cuối).
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    x = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_lo, nxt_hi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[nxt_lo:nxt_hi].mean() if nxt_hi > nxt_lo else x[-1]
+        avg_y = y[nxt_lo:nxt_hi].mean() if nxt_hi > nxt_lo else y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def _quarter_axis(fig, quarters: np.ndarray, max_ticks: int = 16):
+    """Trục x dạng số thứ tự quý, hiển thị tối đa `max_ticks` nhãn quý cách đều."""
+    step = max(1, int(np.ceil(len(quarters) / max_ticks)))
+    ticks = np.arange(0, len(quarters), step)
+    fig.update_xaxes(title_text='Quý', tickmode='array', tickvals=ticks, ticktext=quarters[ticks],
+                     tickangle=-45, showgrid=False, linecolor='#d0d0d0')
+    fig.update_yaxes(gridcolor='rgba(255,107,157,0.2)', griddash='dash', linecolor='#d0d0d0')
+
+
+def _line_trace(columns: dict, col: str, name: str, color: str, symbol: str, fill: bool = False):
+    idx = lttb_indices(columns[col])
+    return go.Scatter(
+        x=idx, y=columns[col][idx], customdata=columns['Quý'][idx],
+        mode='lines+markers', name=name,
+        line=dict(color=color, width=3), marker=dict(symbol=symbol, size=8),
+        fill='tozeroy' if fill else None, fillcolor='rgba(255,179,198,0.2)' if fill else None,
+        hovertemplate='%{customdata}: %{y:,.0f} tỷ VNĐ<extra>' + name + '</extra>',
+    )
+
+
+def build_revenue_trend_figure(columns: dict):
+    fig = go.Figure(_line_trace(columns, 'Doanh thu (tỷ VNĐ)', 'Doanh thu', '#ff6b9d', 'circle', fill=True))
+    fig.update_layout(title='Xu hướng Doanh thu Doanh nghiệp Việt Nam theo Quý',
+                      yaxis_title='Doanh thu (tỷ VNĐ)', height=450, **_CHART_LAYOUT)
+    _quarter_axis(fig, columns['Quý'])
+    return fig
+
+
+def build_revenue_assets_figure(columns: dict):
+    fig = go.Figure([
+        _line_trace(columns, 'Doanh thu (tỷ VNĐ)', 'Doanh thu', '#ff6b9d', 'circle'),
+        _line_trace(columns, 'Tổng tài sản (tỷ VNĐ)', 'Tổng tài sản', '#4a90e2', 'square'),
+    ])
+    fig.update_layout(title='So sánh Doanh thu và Tổng Tài sản theo Quý',
+                      yaxis_title='Giá trị (tỷ VNĐ)', height=450, **_CHART_LAYOUT)
+    _quarter_axis(fig, columns['Quý'])
+    return fig
+
+
+def build_indicator_bar_figure(columns: dict, indicator_cols: list, selected_quarters: list):
+    mask = np.isin(columns['Quý'], selected_quarters)
+    quarters = columns['Quý'][mask]
+    colors = ['#ff6b9d', '#4a90e2', '#50c878']
+    fig = go.Figure([
+        go.Bar(x=quarters, y=columns[col][mask], name=col.replace(' (tỷ VNĐ)', ''),
+               marker=dict(color=colors[i % len(colors)], opacity=0.8, line=dict(color='white', width=1.5)),
+               hovertemplate='%{x}: %{y:,.0f} tỷ VNĐ')
+        for i, col in enumerate(indicator_cols)
+    ])
+    fig.update_layout(title='So sánh các Chỉ số Tài chính theo Quý', barmode='group',
+                      xaxis_title='Quý', yaxis_title='Giá trị (tỷ VNĐ)', height=500, **_CHART_LAYOUT)
+    fig.update_xaxes(tickangle=-45, type='category', linecolor='#d0d0d0')
+    fig.update_yaxes(gridcolor='rgba(255,107,157,0.2)', griddash='dash', linecolor='#d0d0d0')
+    return fig
+
+
+# =========================
+# BIỂU ĐỒ TĨNH (MATPLOTLIB HƯỚNG ĐỐI TƯỢNG, RENDER PNG BẰNG AGG)
+# =========================
+# Mỗi hàm build_* tạo Figure riêng (không qua pyplot) nên các phiên vẽ song song không lẫn figure của
+# nhau và không cần plt.close; Figure được giải phóng như object thường khi hết tham chiếu.
+
+_CHART_BG = '#fff5f7'
+_CHART_PANEL_BG = '#f8f9fa'
+_CHART_ACCENT = '#c2185b'
+_CHART_TEXT = '#4a5568'
+_CHART_GRID = '#ff6b9d'
+_CHART_SPINE = '#d0d0d0'
+
+
+def _style_axes(ax, grid_axis: str = 'both'):
+    ax.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color=_CHART_GRID, axis=grid_axis)
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_color(_CHART_SPINE)
+    ax.spines['bottom'].set_color(_CHART_SPINE)
+
+
+def build_ratio_bar_figure(indicators: list, values, percentiles):
+    """Biểu đồ cột ngang giá trị 14 chỉ số, nhãn cuối cột kèm phân vị so với tổng thể huấn luyện."""
+    fig = mpl_figure.Figure(figsize=(8, 10))
+    fig.patch.set_facecolor(_CHART_BG)
+    ax = fig.subplots()
+    ax.set_facecolor('#ffffff')
+
+    # Màu gradient từ nhạt đến đậm để dễ phân biệt các cột
+    bar_colors = mpl.colormaps['RdPu'](np.linspace(0.3, 0.9, len(indicators)))
+    bars = ax.barh(indicators, values, color=bar_colors, edgecolor='white', linewidth=1.5)
+    for bar, val, pct in zip(bars, values, percentiles):
+        pct_text = f" · P{pct:.0f}" if pd.notna(pct) else ""
+        ax.text(bar.get_width(), bar.get_y() + bar.get_height() / 2, f' {val:.3f}{pct_text}',
+                ha='left', va='center', fontsize=9, fontweight='600', color=_CHART_ACCENT)
+
+    ax.set_xlabel('Giá trị', fontsize=12, fontweight='600', color=_CHART_TEXT)
+    ax.set_title('Các Chỉ số Tài chính', fontsize=14, fontweight='bold', color=_CHART_ACCENT, pad=15)
+    _style_axes(ax, grid_axis='x')
+    fig.tight_layout()
+    return fig
+
+
+def build_ratio_radar_figure(indicators: list, percentiles):
+    """Biểu đồ radar: mỗi trục là phân vị của chỉ số so với tổng thể huấn luyện (0 = thấp nhất, 1 = cao nhất)."""
+    fig = mpl_figure.Figure(figsize=(10, 10))
+    fig.patch.set_facecolor(_CHART_BG)
+    ax = fig.add_subplot(111, projection='polar')
+
+    normalized = np.nan_to_num(np.asarray(percentiles, dtype=np.float64) / 100.0, nan=0.0).tolist()
+    angles = np.linspace(0, 2 * np.pi, len(indicators), endpoint=False).tolist()
+    # Đóng vòng tròn
+    angles += angles[:1]
+    normalized += normalized[:1]
+
+    ax.plot(angles, normalized, 'o-', linewidth=2.5, color='#ff6b9d', label='Chỉ số')
+    ax.fill(angles, normalized, alpha=0.25, color='#ffb3c6')
+    ax.set_xticks(angles[:-1])
+    # Rút ngắn tên chỉ số để dễ đọc
+    short_labels = [label.split('(')[0].strip()[:20] for label in indicators]
+    ax.set_xticklabels(short_labels, size=8, color=_CHART_TEXT, fontweight='600')
+
+    ax.set_ylim(0, 1)
+    ax.set_title('Vị trí các Chỉ số so với Tổng thể Huấn luyện\n(Phân vị 0-1)',
+                 fontsize=14, fontweight='bold', color=_CHART_ACCENT, pad=20)
+    ax.grid(True, alpha=0.3, linestyle='--', linewidth=0.8, color=_CHART_GRID)
+    ax.set_facecolor('#ffffff')
+    fig.tight_layout()
+    return fig
+
+
+def build_confusion_figure(cm, labels=('Non-Default (0)', 'Default (1)')):
+    """Ma trận nhầm lẫn (tập kiểm tra) với thang màu hồng và số đếm trong từng ô."""
+    cm = np.asarray(cm)
+    cmap = mpl.colors.LinearSegmentedColormap.from_list(
+        'pink_rose', ['#fff5f7', '#ffe8f0', '#ffd4dd', '#ff85a1', '#ff6b9d'], N=100)
+    fig = mpl_figure.Figure(figsize=(7, 7))
+    fig.patch.set_facecolor(_CHART_PANEL_BG)
+    ax = fig.subplots()
+
+    image = ax.imshow(cm, interpolation='nearest', cmap=cmap)
+    # Chữ tương phản với nền ô (như ConfusionMatrixDisplay của scikit-learn)
+    threshold = (cm.max() + cm.min()) / 2.0
+    for (i, j), count in np.ndenumerate(cm):
+        ax.text(j, i, f"{count:,}", ha='center', va='center',
+                color=cmap(1.0) if count < threshold else cmap(0.0))
+    fig.colorbar(image, ax=ax)
+
+    ax.set_xticks(range(len(labels)), labels)
+    ax.set_yticks(range(len(labels)), labels)
+    ax.set_ylim(len(labels) - 0.5, -0.5)
+    ax.set_title('Ma trận Nhầm lẫn', fontsize=14, fontweight='bold', color=_CHART_ACCENT, pad=15)
+    ax.set_xlabel('Predicted Label', fontsize=12, fontweight='600', color=_CHART_TEXT)
+    ax.set_ylabel('True Label', fontsize=12, fontweight='600', color=_CHART_TEXT)
+    return fig
+
+
+def build_default_scatter_figure(x, y, col: str):
+    """Phân tán một biến X theo nhãn default, kèm đường logistic regression một biến."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y)
+    fig = mpl_figure.Figure(figsize=(12, 7))
+    fig.patch.set_facecolor(_CHART_PANEL_BG)
+    ax = fig.subplots()
+    ax.set_facecolor('#ffffff')
+
+    for label, color in zip((0, 1), ('#ff6b9d', '#ffb3c6')):
+        mask = y == label
+        ax.scatter(x[mask], y[mask], s=80, alpha=0.65, color=color, edgecolors='white', linewidths=0.5,
+                   label=str(label))
+
+    # Đường logistic regression theo 1 biến
+    valid = np.isfinite(x)
+    x_range = np.linspace(np.nanmin(x), np.nanmax(x), 100)
+    lr_temp = LogisticRegression(max_iter=1000)
+    lr_temp.fit(pd.DataFrame({col: x[valid]}), y[valid])
+    y_curve = lr_temp.predict_proba(pd.DataFrame({col: x_range}))[:, 1]
+    ax.plot(x_range, y_curve, color=_CHART_ACCENT, linewidth=4, label='Đường LogReg', linestyle='-', alpha=0.9)
+
+    ax.set_title(f'Quan hệ giữa {col} và Xác suất Vỡ nợ', fontsize=16, fontweight='bold', color=_CHART_ACCENT, pad=20)
+    ax.set_ylabel('Xác suất Default (0: Non-Default, 1: Default)', fontsize=13, fontweight='600', color=_CHART_TEXT)
+    ax.set_xlabel(col, fontsize=13, fontweight='600', color=_CHART_TEXT)
+    _style_axes(ax)
+    legend = ax.legend(title='Default Status', title_fontsize=11, fontsize=10, frameon=True, fancybox=True, shadow=True)
+    legend.get_frame().set_facecolor(_CHART_PANEL_BG)
+    legend.get_frame().set_alpha(0.9)
+    return fig
+
+
+CHART_BUILDERS = {
+    "ratio_bar": build_ratio_bar_figure,
+    "ratio_radar": build_ratio_radar_figure,
+    "confusion": build_confusion_figure,
+    "scatter": build_default_scatter_figure,
+}
+
+
+def figure_png(fig, dpi: int = CHART_DPI) -> bytes:
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def chart_png(kind: str, *args) -> bytes:
+    """Dựng biểu đồ `kind` (khóa CHART_BUILDERS) và render PNG, không qua cache."""
+    return figure_png(CHART_BUILDERS[kind](*args))
+
+
+@st.cache_data(max_entries=CHART_CACHE_ENTRIES, show_spinner=False)
+def render_chart_png(kind: str, *args) -> bytes:
+    """PNG của biểu đồ, cache theo dữ liệu đầu vào (rerun và nút xuất Word dùng lại ảnh đã render)."""
+    note_cache_miss()
+    return chart_png(kind, *args)
+
+
+def chart_image(kind: str, *args) -> bytes:
+    with perf_cache_lookup("chart"):
+        return render_chart_png(kind, *args)
+
+
+# =========================
+# LÀM ẤM CACHE NỀN (RSS + DỮ LIỆU VĨ MÔ)
+# =========================
+
+class CacheWarmer:
+    """
+    Luồng nền làm mới cache nguồn ngoài trước khi hết hạn, theo chu kỳ CACHE_WARM_INTERVAL_S
+    (có jitter). RSS được làm mới khi tuổi cache vượt RSS_TTL_S - RSS_REFRESH_AHEAD_S; dữ liệu
+    vĩ mô được lấy thêm khi kho còn thiếu quý và đã qua cửa sổ thử lại GSO_REFRESH_RETRY_S
+    (dùng chung nhật ký với phiên người dùng). Mọi lượt làm mới đi qua single-flight nên không
+    trùng với phiên người dùng hay worker khác.
+
+    Khóa API được luồng script truyền vào (set_api_keys): luồng nền không đọc st.secrets.
+    """
+
+    def __init__(self, rss_cache: RSSFeedCache, flights: SingleFlight, interval_s: float = CACHE_WARM_INTERVAL_S,
+                 api_keys: tuple = (None, None)):
+        self._rss_cache = rss_cache
+        self._flights = flights
+        self._interval_s = interval_s
+        self._stop = threading.Event()
+        self._api_keys = tuple(api_keys)
+        self.last_run = None
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+
+    def _next_delay(self) -> float:
+        return self._interval_s * (1 + random.uniform(-CACHE_WARM_JITTER, CACHE_WARM_JITTER))
+
+    def _run(self):
+        # Làm ấm ngay khi khởi động để phiên đầu tiên không gặp cache lạnh
+        while True:
+            try:
+                self.warm_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self.last_run = datetime.now()
+            if self._stop.wait(self._next_delay()):
+                return
+
+    def set_api_keys(self, api_key: str = None, openai_api_key: str = None):
+        """Khóa Gemini/OpenAI cho lượt làm mới dữ liệu vĩ mô (gọi từ luồng script)."""
+        self._api_keys = (api_key, openai_api_key)
+
+    def warm_once(self):
+        if _FEEDPARSER_OK:
+            for source_name, url in RSS_SOURCES.items():
+                age = self._rss_cache.age(url)
+                if (age is None or age >= RSS_TTL_S - RSS_REFRESH_AHEAD_S) and not self._rss_cache.recently_failed(url):
+                    self._rss_cache.refresh(url, source_name)
+
+        api_key, openai_api_key = self._api_keys
+        if (_GEMINI_OK or _OPENAI_OK) and (api_key or openai_api_key) and macro_refresh_due():
+            refresh_macro_store(api_key, openai_api_key, flights=self._flights, blocking=False)
+
+    def stop(self):
+        self._stop.set()
+
+
+@st.cache_resource
+def get_cache_warmer(_api_keys: tuple = (None, None)) -> CacheWarmer:
+    """Một bộ làm ấm cho mỗi tiến trình Streamlit; `_api_keys` chỉ dùng cho lượt làm ấm đầu tiên."""
+    return CacheWarmer(get_rss_feed_cache(), get_single_flight(), api_keys=_api_keys)
+
+
+if CACHE_WARMER_ENABLED:
+    # Đọc secrets trên luồng script rồi truyền cho luồng nền (cập nhật mỗi lượt chạy nếu khóa đổi)
+    _warmer_keys = (_secret("GEMINI_API_KEY"), _secret("OPENAI_API_KEY"))
+    get_cache_warmer(_warmer_keys).set_api_keys(*_warmer_keys)
+
+# =========================
+# CÔNG VIỆC NỀN: HÀNG ĐỢI SQLITE + TIẾN TRÌNH WORKER (ed_jobs.py)
+# =========================
+# Huấn luyện, chấm điểm danh mục, xuất Word hàng loạt, mô phỏng Monte Carlo không chạy trong luồng
+# script của phiên: phiên ghi job vào jobs.sqlite3, tiến trình ed_jobs.py lấy job ra chạy trong
+# process pool và ghi tiến độ/kết quả ngược lại. Job và file kết quả nằm trên đĩa nên tải lại trang
+# hay khởi động lại Streamlit/worker đều không mất việc.
+
+JOB_KIND_LABELS = {
+    "train": "🛠️ Huấn luyện mô hình",
+    "score": "🏭 Chấm điểm danh mục (báo cáo dạng dài)",
+    "word_bulk": "📄 Xuất Word hàng loạt",
+    "monte_carlo": "🎲 Mô phỏng Monte Carlo tổn thất danh mục",
+}
+JOB_STATUS_LABELS = {
+    "queued": "⏳ Đang chờ", "running": "⚙️ Đang chạy", "done": "✅ Hoàn thành",
+    "failed": "❌ Lỗi", "cancelled": "🚫 Đã hủy",
+}
+JOB_ACTIVE_STATUSES = ("queued", "running")
+_JOB_COLUMNS = ("id", "kind", "owner", "title", "params", "status", "progress", "message", "result", "error",
+                "attempts", "cancel_requested", "worker", "created_ts", "started_ts", "heartbeat_ts", "finished_ts")
+_JOB_MODEL_COLS = tuple(f"X_{i}" for i in range(1, 15))
+_JOB_WORKER_LOCK = "job_worker"
+JOB_MODEL_FILE = "MoHinh_PD.pkl"
+
+
+class JobCancelled(Exception):
+    """Người dùng đã yêu cầu hủy job đang chạy (phát ra ở lần báo tiến độ kế tiếp)."""
+
+
+def _ensure_jobs_schema(conn: sqlite3.Connection):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS jobs (
+               id TEXT PRIMARY KEY,
+               kind TEXT NOT NULL,
+               owner TEXT NOT NULL,
+               title TEXT,
+               params TEXT NOT NULL,
+               status TEXT NOT NULL DEFAULT 'queued',
+               progress REAL NOT NULL DEFAULT 0,
+               message TEXT,
+               result TEXT,
+               error TEXT,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               cancel_requested INTEGER NOT NULL DEFAULT 0,
+               worker TEXT,
+               created_ts REAL NOT NULL,
+               started_ts REAL,
+               heartbeat_ts REAL,
+               finished_ts REAL
+           )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, created_ts)")
+
+
+def _job_from_row(row) -> dict:
+    job = dict(zip(_JOB_COLUMNS, row))
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def job_dir(job_id: str, sub: str = "") -> str:
+    return os.path.join(JOBS_DIR, job_id, sub)
+
+
+def submit_job(kind: str, params: dict, owner: str, files=(), title: str = None) -> str:
+    """
+    Ghi job mới vào hàng đợi (trạng thái queued) và tự khởi động worker nếu cần.
+
+    Parameters:
+    - kind: khóa trong JOB_HANDLERS
+    - params: tham số dạng JSON của job
+    - owner: mã chủ sở hữu (job_owner) - mỗi trình duyệt chỉ thấy job của mình
+    - files: các cặp (tên file, bytes) chép vào <job_id>/input cho worker đọc
+
+    Returns:
+        job_id
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Loại công việc không hợp lệ: {kind}")
+    job_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.urandom(4).hex()}"
+    os.makedirs(job_dir(job_id, "output"), exist_ok=True)
+    os.makedirs(job_dir(job_id, "input"), exist_ok=True)
+    for name, data in files:
+        with open(os.path.join(job_dir(job_id, "input"), os.path.basename(name)), "wb") as f:
+            f.write(data)
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        _ensure_jobs_schema(conn)
+        conn.execute(
+            "INSERT INTO jobs (id, kind, owner, title, params, created_ts) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, owner, title or JOB_KIND_LABELS[kind], json.dumps(params, ensure_ascii=False), time.time()),
+        )
+    ensure_job_worker()
+    return job_id
+
+
+def list_jobs(owner: str, limit: int = JOB_LIST_LIMIT, kind: str = None, status: str = None) -> list:
+    """Các job của `owner`, mới nhất trước (lọc thêm theo loại/trạng thái nếu có)."""
+    query = f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE owner = ?"
+    args = [owner]
+    if kind is not None:
+        query += " AND kind = ?"
+        args.append(kind)
+    if status is not None:
+        query += " AND status = ?"
+        args.append(status)
+    with closing(_store_connect(JOBS_DB_PATH)) as conn:
+        _ensure_jobs_schema(conn)
+        rows = conn.execute(query + " ORDER BY created_ts DESC LIMIT ?", (*args, limit)).fetchall()
+    return [_job_from_row(row) for row in rows]
+
+
+def get_job(job_id: str):
+    with closing(_store_connect(JOBS_DB_PATH)) as conn:
+        _ensure_jobs_schema(conn)
+        row = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _job_from_row(row) if row else None
+
+
+def cancel_job(job_id: str, owner: str) -> bool:
+    """Job đang chờ bị hủy ngay; job đang chạy được đánh dấu để worker dừng ở lần báo tiến độ kế tiếp."""
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        _ensure_jobs_schema(conn)
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', message = 'Đã hủy trước khi chạy', finished_ts = ? "
+            "WHERE id = ? AND owner = ? AND status = 'queued'",
+            (time.time(), job_id, owner),
+        )
+        if not cursor.rowcount:
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, message = 'Đang dừng...' "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (job_id, owner),
+            )
+        return cursor.rowcount > 0
+
+
+def claim_job(worker: str):
+    """Worker lấy job đang chờ lâu nhất (giao dịch IMMEDIATE: mỗi job chỉ một worker nhận). None nếu hàng đợi rỗng."""
+    now = time.time()
+    with closing(_store_connect(JOBS_DB_PATH)) as conn:
+        with conn:
+            _ensure_jobs_schema(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_ts LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, progress = 0, "
+                "message = 'Đang khởi động...', started_ts = ?, heartbeat_ts = ? WHERE id = ?",
+                (worker, now, now, row[0]),
+            )
+            job = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+    return _job_from_row(job)
+
+
+def heartbeat_jobs(job_ids):
+    """Gia hạn lease cho các job worker còn đang chạy (kể cả khi handler chưa báo tiến độ)."""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        conn.executemany(
+            "UPDATE jobs SET heartbeat_ts = ? WHERE id = ? AND status = 'running'",
+            [(time.time(), job_id) for job_id in job_ids],
+        )
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Job 'running' quá JOB_LEASE_S không được gia hạn (worker bị tắt/chết): xếp lại hàng đợi nếu còn
+    lượt thử, hết lượt thì đánh dấu lỗi. Trả về số job đã xử lý.
+    """
+    cutoff = time.time() - JOB_LEASE_S
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        _ensure_jobs_schema(conn)
+        requeued = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, message = 'Worker dừng giữa chừng, chờ chạy lại' "
+            "WHERE status = 'running' AND heartbeat_ts < ? AND attempts < ? AND cancel_requested = 0",
+            (cutoff, JOB_MAX_ATTEMPTS),
+        ).rowcount
+        failed = conn.execute(
+            "UPDATE jobs SET status = CASE cancel_requested WHEN 1 THEN 'cancelled' ELSE 'failed' END, "
+            "error = CASE cancel_requested WHEN 1 THEN NULL ELSE 'Worker dừng giữa chừng, đã hết lượt chạy lại' END, "
+            "finished_ts = ? WHERE status = 'running' AND heartbeat_ts < ?",
+            (time.time(), cutoff),
+        ).rowcount
+    return requeued + failed
+
+
+def release_jobs(job_ids, count_attempt: bool = False):
+    """
+    Trả các job đang chạy về hàng đợi khi worker tắt có kiểm soát (không tính là một lượt thử);
+    job đã được yêu cầu hủy thì kết thúc luôn. count_attempt=True: lượt vừa chạy vẫn được tính
+    (tiến trình con chết giữa chừng - job gây lỗi không được chạy lại mãi).
+    """
+    job_ids = [(job_id,) for job_id in job_ids]
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        conn.executemany(
+            "UPDATE jobs SET status = 'cancelled', message = 'Đã hủy theo yêu cầu', finished_ts = ? "
+            "WHERE id = ? AND status = 'running' AND cancel_requested = 1",
+            [(time.time(), job_id) for (job_id,) in job_ids],
+        )
+        conn.executemany(
+            "UPDATE jobs SET status = 'queued', worker = NULL, attempts = attempts - ?, progress = 0, "
+            "message = 'Worker khởi động lại, chờ chạy lại' WHERE id = ? AND status = 'running'",
+            [(0 if count_attempt else 1, job_id) for (job_id,) in job_ids],
+        )
+
+
+def finish_job(job_id: str, status: str, result: dict = None, error: str = None, message: str = None):
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, "
+            "result = ?, error = ?, message = COALESCE(?, message), finished_ts = ? WHERE id = ? AND status = 'running'",
+            (status, status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+             error, message, time.time(), job_id),
+        )
+
+
+def prune_jobs(retention_days: float = JOB_RETENTION_DAYS) -> int:
+    """Xóa job đã kết thúc quá `retention_days` ngày cùng thư mục file của chúng."""
+    cutoff = time.time() - retention_days * 86400
+    with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+        _ensure_jobs_schema(conn)
+        old = [row[0] for row in conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_ts < ?", (cutoff,)
+        )]
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in old])
+    for job_id in old:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+    return len(old)
+
+
+def _job_files(job_id: str, sub: str) -> list:
+    folder = job_dir(job_id, sub)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+
+
+def job_output_files(job_id: str) -> list:
+    """Đường dẫn các file kết quả của job (theo tên)."""
+    return _job_files(job_id, "output")
+
+
+def job_input_files(job_id: str) -> list:
+    """Đường dẫn các file gửi kèm job (theo tên)."""
+    return _job_files(job_id, "input")
+
+
+def job_worker_running() -> bool:
+    """True nếu đang có tiến trình ed_jobs.py giữ khóa worker (flock trong DATA_STORE_DIR/locks)."""
+    with get_single_flight().hold(_JOB_WORKER_LOCK, blocking=False) as acquired:
+        return not acquired
+
+
+def job_worker_state() -> str:
+    """
+    Trạng thái worker: "running" (đang giữ khóa), "starting" (vừa được khởi động trong JOB_WORKER_START_GRACE_S
+    giây, còn đang nạp ED.py), "stopped"; "unknown" khi không có fcntl (Windows) nên không phát hiện được worker.
+    """
+    if fcntl is None:
+        return "unknown"
+    if job_worker_running():
+        return "running"
+    marker = os.path.join(JOBS_DIR, "worker.started")
+    if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < JOB_WORKER_START_GRACE_S:
+        return "starting"
+    return "stopped"
+
+
+def job_worker_available() -> bool:
+    """True nếu job gửi đi sẽ được xử lý: worker đang chạy/đang khởi động, hoặc phiên được phép tự khởi động."""
+    state = job_worker_state()
+    return state in ("running", "starting") or (state == "stopped" and JOB_AUTOSTART)
+
+
+def ensure_job_worker() -> bool:
+    """
+    Khởi động ed_jobs.py (tách khỏi tiến trình Streamlit) khi chưa có worker nào chạy. Hai phiên cùng
+    khởi động thì worker thứ hai không giành được khóa và tự thoát; trong JOB_WORKER_START_GRACE_S giây sau
+    một lần khởi động thì không khởi động thêm. Trả về True nếu vừa khởi động.
+    Cần fcntl để phát hiện worker; nơi không có (Windows) hãy chạy `python ed_jobs.py` riêng.
+    """
+    if not JOB_AUTOSTART or job_worker_state() != "stopped":
+        return False
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with open(os.path.join(JOBS_DIR, "worker.started"), "w"):
+        pass
+    with open(os.path.join(JOBS_DIR, "worker.log"), "ab") as log:
+        subprocess.Popen(
+            [sys.executable, JOB_WORKER_SCRIPT, "--idle-exit", str(JOB_WORKER_IDLE_EXIT_S)],
+            cwd=os.getcwd(), env={**os.environ, "ED_DATA_DIR": DATA_STORE_DIR},
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+    return True
+
+
+def job_owner() -> str:
+    """
+    Mã chủ sở hữu job của trình duyệt này, giữ trên URL (?jobs=<mã>): tải lại trang hoặc mở lại
+    đường dẫn vẫn thấy các job đã gửi.
+    """
+    owner = st.query_params.get("jobs")
+    if not owner or not re.fullmatch(r"[0-9a-f]{16}", owner):
+        owner = os.urandom(8).hex()
+        st.query_params["jobs"] = owner
+    return owner
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _upload_sha256(upload_key: str, _data: bytes) -> str:
+    """SHA-256 của file tải lên, tính một lần cho mỗi lần tải (khóa: file_id + kích thước)."""
+    return hashlib.sha256(_data).hexdigest()
+
+
+def training_model_key(uploaded_file, streaming: bool) -> str:
+    """
+    Khóa mô hình dùng chung giữa trang dự báo và job huấn luyện (params["model_key"]): nội dung CSV
+    tải lên (SHA-256, không phụ thuộc phiên) hoặc CSV mặc định của máy chủ, kèm chế độ batch/luồng.
+    """
+    if uploaded_file is not None:
+        upload_key = training_source_key(uploaded_file, TRAIN_CSV_PATH)
+        base = f"sha256:{_upload_sha256(upload_key, uploaded_file.getvalue())}"
+    else:
+        base = training_source_key(None, TRAIN_CSV_PATH)
+    return base + (":stream" if streaming else "")
+
+
+def latest_model_job(model_key: str):
+    """
+    Job huấn luyện cho model_key của mọi phiên: job đã xong mới nhất; chưa có thì job gửi gần nhất
+    (đang chờ/chạy/lỗi/hủy). None nếu chưa từng gửi.
+    """
+    with closing(_store_connect(JOBS_DB_PATH)) as conn:
+        _ensure_jobs_schema(conn)
+        row = conn.execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs "
+            "WHERE kind = 'train' AND json_extract(params, '$.model_key') = ? "
+            "ORDER BY status = 'done' DESC, COALESCE(finished_ts, created_ts) DESC LIMIT 1",
+            (model_key,),
+        ).fetchone()
+    return _job_from_row(row) if row else None
+
+
+def submit_model_job(model_key: str, streaming: bool, owner: str, uploaded_file=None) -> str:
+    """Gửi job huấn luyện cho trang dự báo/xây dựng mô hình (CSV tải lên hoặc dữ liệu mặc định)."""
+    files = [("train.csv", uploaded_file.getvalue())] if uploaded_file is not None else []
+    source = uploaded_file.name if uploaded_file is not None else "dữ liệu mặc định"
+    title = f"Huấn luyện mô hình ({'dạng luồng' if streaming else 'batch'}, {source})"
+    return submit_job("train", {"streaming": streaming, "model_key": model_key}, owner, files=files, title=title)
+
+
+def ensure_model_job(model_key: str, streaming: bool, owner: str, uploaded_file=None) -> dict:
+    """Job huấn luyện cho model_key; chưa có thì gửi mới (single-flight: nhiều phiên cùng mở chỉ gửi một job)."""
+    with get_single_flight().hold("model_job_submit"):
+        job = latest_model_job(model_key)
+        if job is None:
+            job = get_job(submit_model_job(model_key, streaming, owner, uploaded_file))
+    return job
+
+
+class _JobModelUnpickler(pickle.Unpickler):
+    """
+    Worker pickle mô hình trong module ed_app (ed_headless); trong Streamlit, ED.py chạy dưới tên
+    __main__. Các lớp của ed_app được lấy từ module đang chạy thay vì import ed_app.
+    """
+
+    def find_class(self, module, name):
+        if module == ED_MODULE_NAME:
+            try:
+                return globals()[name]
+            except KeyError:
+                raise pickle.UnpicklingError(f"Không có lớp {name} trong ED.py") from None
+        return super().find_class(module, name)
+
+
+@st.cache_resource(max_entries=4, show_spinner="📦 Đang nạp mô hình đã huấn luyện...")
+def load_job_model(job_id: str) -> dict:
+    """
+    Mô hình do job huấn luyện lưu (MoHinh_PD.pkl), cùng dạng với train_batch_model/train_streaming_model;
+    nạp một lần cho mỗi job, các phiên dùng chung.
+    """
+    note_cache_miss()
+    with open(os.path.join(job_dir(job_id, "output"), JOB_MODEL_FILE), "rb") as f:
+        return _JobModelUnpickler(f).load()
+
+
+class JobContext:
+    """Job đang chạy trong tiến trình con của worker: tham số, file vào/ra và kênh báo tiến độ/hủy."""
+
+    def __init__(self, job: dict):
+        self.id = job["id"]
+        self.kind = job["kind"]
+        self.params = job["params"]
+        self.input_dir = job_dir(self.id, "input")
+        self.output_dir = job_dir(self.id, "output")
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._last_report = 0.0
+
+    def input_files(self) -> list:
+        return job_input_files(self.id)
+
+    def output_path(self, name: str) -> str:
+        return os.path.join(self.output_dir, name)
+
+    def progress(self, fraction: float, message: str = None, force: bool = False):
+        """Ghi tiến độ (tối đa mỗi JOB_PROGRESS_INTERVAL_S giây); phát JobCancelled nếu người dùng đã hủy."""
+        now = time.monotonic()
+        if not force and now - self._last_report < JOB_PROGRESS_INTERVAL_S:
+            return
+        self._last_report = now
+        with closing(_store_connect(JOBS_DB_PATH)) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat_ts = ? WHERE id = ?",
+                (min(max(float(fraction), 0.0), 1.0), message, time.time(), self.id),
+            )
+            cancel = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,)).fetchone()
+        if cancel and cancel[0]:
+            raise JobCancelled()
+
+
+def run_job(job: dict) -> str:
+    """Chạy một job đã nhận (trong tiến trình con của worker), ghi trạng thái cuối và trả về trạng thái đó."""
+    ctx = JobContext(job)
+    try:
+        result = JOB_HANDLERS[job["kind"]](ctx)
+    except JobCancelled:
+        finish_job(ctx.id, "cancelled", message="Đã hủy theo yêu cầu")
+        return "cancelled"
+    except Exception as e:
+        finish_job(ctx.id, "failed", error=traceback.format_exc(), message=f"{type(e).__name__}: {e}")
+        return "failed"
+    finish_job(ctx.id, "done", result=result, message="Hoàn thành")
+    return "done"
+
+
+def _stored_upload(path: str) -> BytesIO:
+    """File trên đĩa dưới dạng giống file tải lên (name + getvalue) cho các hàm đọc upload."""
+    with open(path, "rb") as f:
+        buffer = BytesIO(f.read())
+    buffer.name = os.path.basename(path)
+    return buffer
+
+
+def _job_training_model(ctx: JobContext) -> tuple:
+    """
+    Mô hình PD của job: params["model_job"] (job huấn luyện mà trang dự báo đang dùng) nếu có; không thì
+    mô hình trên dữ liệu mặc định của máy chủ (TRAIN_CSV_PATH) theo chế độ batch/luồng - job huấn luyện
+    đã xong cho dữ liệu này, hoặc huấn luyện tại chỗ (cache_resource giữ cho các job sau).
+
+    Returns:
+        (trained, df, dataset_key) như khối nạp mô hình của giao diện
+    """
+    ctx.progress(0.02, "Đang nạp mô hình PD...", force=True)
+    streaming = bool(ctx.params.get("streaming"))
+    if ctx.params.get("model_job"):
+        model_job = get_job(ctx.params["model_job"])
+        if model_job is None or model_job["status"] != "done":
+            raise ValueError(f"Không còn mô hình của job huấn luyện {ctx.params['model_job']}")
+    else:
+        model_job = latest_model_job(training_model_key(None, streaming))
+    source = TRAIN_CSV_PATH
+    if model_job is not None and model_job["status"] == "done":
+        trained = load_job_model(model_job["id"])
+        streaming = bool(model_job["params"].get("streaming"))
+        model_key = model_job["params"].get("model_key") or f"job:{model_job['id']}"
+        source = next(iter(job_input_files(model_job["id"])), TRAIN_CSV_PATH)
+    else:
+        source_key = training_source_key(None, TRAIN_CSV_PATH)
+        model_key = source_key + (":stream" if streaming else "")
+        if streaming:
+            trained = train_streaming_model(source_key, TRAIN_CSV_PATH, _JOB_MODEL_COLS)
+        else:
+            trained = train_batch_model(source_key, read_training_csv(TRAIN_CSV_PATH), _JOB_MODEL_COLS)
+    df = trained["sample"] if streaming else read_training_csv(source)
+    return trained, df, model_key
+
 
-    def to_num(x):
-        try:
-            # Xóa dấu phẩy, khoảng trắng
-            return float(str(x).replace(",", "").replace(" ", ""))
-        except Exception:
-            return np.nan
+def _metrics_summary(metrics: dict) -> dict:
+    return {key.rsplit("_", 1)[0]: f"{value:.4f}" for key, value in metrics.items()}
 
-    return to_num(row[prev_col]), to_num(row[cur_col])
 
-def compute_ratios_from_three_sheets(xlsx_file) -> pd.DataFrame:
-    """Đọc 3 sheet CDKT/BCTN/LCTT và tính X1..X14 theo yêu cầu."""
-    bs = pd.read_excel(xlsx_file, sheet_name="CDKT", engine="openpyxl")
-    is_ = pd.read_excel(xlsx_file, sheet_name="BCTN", engine="openpyxl")
-    cf = pd.read_excel(xlsx_file, sheet_name="LCTT", engine="openpyxl")
-
-    # ---- Tính toán các biến số tài chính (GIỮ NGUYÊN CÁCH TÍNH)
-    DTT_prev, DTT_cur         = _get_row_vals(is_, ALIAS_IS["doanh_thu_thuan"])
-    GVHB_prev, GVHB_cur = _get_row_vals(is_, ALIAS_IS["gia_von"])
-    LNG_prev, LNG_cur         = _get_row_vals(is_, ALIAS_IS["loi_nhuan_gop"])
-    LNTT_prev, LNTT_cur = _get_row_vals(is_, ALIAS_IS["loi_nhuan_truoc_thue"])
-    LV_prev, LV_cur           = _get_row_vals(is_, ALIAS_IS["chi_phi_lai_vay"])
-    TTS_prev, TTS_cur           = _get_row_vals(bs, ALIAS_BS["tong_tai_san"])
-    VCSH_prev, VCSH_cur         = _get_row_vals(bs, ALIAS_BS["von_chu_so_huu"])
-    NPT_prev, NPT_cur           = _get_row_vals(bs, ALIAS_BS["no_phai_tra"])
-    TSNH_prev, TSNH_cur         = _get_row_vals(bs, ALIAS_BS["tai_san_ngan_han"])
-    NNH_prev, NNH_cur           = _get_row_vals(bs, ALIAS_BS["no_ngan_han"])
-    HTK_prev, HTK_cur           = _get_row_vals(bs, ALIAS_BS["hang_ton_kho"])
-    Tien_prev, Tien_cur         = _get_row_vals(bs, ALIAS_BS["tien_tdt"])
-    KPT_prev, KPT_cur           = _get_row_vals(bs, ALIAS_BS["phai_thu_kh"])
-    NDH_prev, NDH_cur           = _get_row_vals(bs, ALIAS_BS["no_dai_han_den_han"])
-    KH_prev, KH_cur = _get_row_vals(cf, ALIAS_CF["khau_hao"])
-
-    if pd.notna(GVHB_cur): GVHB_cur = abs(GVHB_cur)
-    if pd.notna(LV_cur):      LV_cur     = abs(LV_cur)
-    if pd.notna(KH_cur):      KH_cur     = abs(KH_cur)
-
-    def avg(a, b):
-        if pd.isna(a) and pd.isna(b): return np.nan
-        if pd.isna(a): return b
-        if pd.isna(b): return a
-        return (a + b) / 2.0
-    TTS_avg    = avg(TTS_cur,    TTS_prev)
-    VCSH_avg = avg(VCSH_cur, VCSH_prev)
-    HTK_avg    = avg(HTK_cur,    HTK_prev)
-    KPT_avg    = avg(KPT_cur,    KPT_prev)
-
-    EBIT_cur = (LNTT_cur + LV_cur) if (pd.notna(LNTT_cur) and pd.notna(LV_cur)) else np.nan
-    NDH_cur = 0.0 if pd.isna(NDH_cur) else NDH_cur
-
-    def div(a, b):
-        return np.nan if (b is None or pd.isna(b) or b == 0) else a / b
-
-    # ==== TÍNH X1..X14 ==== (GIỮ NGUYÊN CÔNG THỨC)
-    X1  = div(LNG_cur, DTT_cur)
-    X2  = div(LNTT_cur, DTT_cur)
-    X3  = div(LNTT_cur, TTS_avg)
-    X4  = div(LNTT_cur, VCSH_avg)
-    X5  = div(NPT_cur,  TTS_cur)
-    X6  = div(NPT_cur,  VCSH_cur)
-    X7  = div(TSNH_cur, NNH_cur)
-    X8  = div((TSNH_cur - HTK_cur) if pd.notna(TSNH_cur) and pd.notna(HTK_cur) else np.nan, NNH_cur)
-    X9  = div(EBIT_cur, LV_cur)
-    X10 = div((EBIT_cur + (KH_cur if pd.notna(KH_cur) else 0.0)), (LV_cur + NDH_cur) if pd.notna(LV_cur) else np.nan)
-    X11 = div(Tien_cur, VCSH_cur)
-    X12 = div(GVHB_cur, HTK_avg)
-    turnover = div(DTT_cur, KPT_avg)
-    X13 = div(365.0, turnover) if pd.notna(turnover) and turnover != 0 else np.nan
-    X14 = div(DTT_cur, TTS_avg)
-
-    # Khởi tạo DataFrame với tên cột tiếng Việt mới
-    ratios = pd.DataFrame([[X1, X2, X3, X4, X5, X6, X7, X8, X9, X10, X11, X12, X13, X14]],
-                          columns=COMPUTED_COLS)
-                          
-    # Thêm cột X_1..X_14 ẩn để phục vụ việc dự báo mô hình
-    ratios[[f"X_{i}" for i in range(1, 15)]] = ratios.values
-    return ratios
+def job_train_model(ctx: JobContext) -> dict:
+    """
+    Huấn luyện mô hình PD trên CSV gửi kèm (hoặc dữ liệu mặc định), lưu mô hình pickle + bảng chỉ số.
+    Job có params["model_key"] được trang dự báo/xây dựng mô hình dùng lại (load_job_model).
+    """
+    files = ctx.input_files()
+    source = files[0] if files else TRAIN_CSV_PATH
+    source_key = training_source_key(None, source)
+    if ctx.params.get("streaming"):
+        ctx.progress(0.0, "Lượt 1: đọc dữ liệu, lấy mẫu...", force=True)
+        trained = train_streaming_model(source_key, source, _JOB_MODEL_COLS, _progress=ctx.progress)
+    else:
+        ctx.progress(0.05, "Đang đọc dữ liệu huấn luyện...", force=True)
+        df = read_training_csv(source)
+        missing = [c for c in ('default',) + _JOB_MODEL_COLS if c not in df.columns]
+        if missing:
+            raise ValueError(f"Thiếu cột: {missing}")
+        ctx.progress(0.3, f"Đang huấn luyện LogReg trên {len(df):,} dòng...", force=True)
+        trained = train_batch_model(source_key, df, _JOB_MODEL_COLS)
+
+    ctx.progress(0.95, "Đang lưu mô hình...", force=True)
+    with open(ctx.output_path(JOB_MODEL_FILE), "wb") as f:
+        pickle.dump(dict(trained), f)
+    metrics = pd.DataFrame({"Train (in-sample)": list(trained["metrics_in"].values()),
+                            "Test (out-of-sample)": list(trained["metrics_out"].values())},
+                           index=[key.rsplit("_", 1)[0] for key in trained["metrics_in"]])
+    metrics.to_csv(ctx.output_path("ChiSo_MoHinh.csv"), encoding="utf-8-sig")
+    return _metrics_summary(trained["metrics_out"])
+
+
+def job_score_portfolio(ctx: JobContext) -> dict:
+    """Chấm điểm toàn bộ báo cáo dạng dài gửi kèm theo lô JOB_SCORE_CHUNK_ROWS doanh nghiệp, ghi CSV kết quả."""
+    trained, df, dataset_key = _job_training_model(ctx)
+    ctx.progress(0.1, "Đang đọc báo cáo dạng dài và tính X1..X14...", force=True)
+    ratios = long_statements_to_ratios(read_long_statements(_stored_upload(ctx.input_files()[0])))
+    model, model_cols = trained["model"], list(_JOB_MODEL_COLS)
+    similar_index = get_similar_borrower_index(dataset_key, df, model[:-1], _JOB_MODEL_COLS)
+
+    parts = []
+    for start in range(0, len(ratios), JOB_SCORE_CHUNK_ROWS):
+        ctx.progress(0.2 + 0.75 * start / len(ratios), f"Đã chấm {start:,}/{len(ratios):,} doanh nghiệp")
+        parts.append(score_portfolio(ratios.iloc[start:start + JOB_SCORE_CHUNK_ROWS], model, trained["calibrator"],
+                                     model_cols, similar_index=similar_index))
+    portfolio = pd.concat(parts)
+    portfolio.to_csv(ctx.output_path("ChamDiem_HangLoat.csv"), encoding="utf-8-sig")
+    return portfolio_summary(portfolio)
+
+
+def portfolio_summary(portfolio: pd.DataFrame) -> dict:
+    """Các chỉ số tóm tắt của danh mục đã chấm điểm (kết quả job chấm điểm và bản chấm trên trang)."""
+    return {
+        "Số doanh nghiệp": f"{len(portfolio):,}",
+        "PD hiệu chỉnh trung bình": f"{portfolio['PD hiệu chỉnh'].mean():.2%}",
+        "Dự đoán Default (ngưỡng 0.15)": f"{(portfolio['Dự đoán'] == 'Default').sum():,}",
+    }
 
-# =========================
-# HÀM ĐỌC RSS FEED
-# =========================
 
-@st.cache_data(ttl=7200)  # Cache 120 phút = 7200 giây
-def fetch_rss_feed(url, source_name):
+def job_word_bulk(ctx: JobContext) -> dict:
     """
-    Đọc RSS feed từ URL và trả về 5 bài mới nhất.
+    Báo cáo Word (không kèm phân tích AI) cho từng hồ sơ ho_so_dn.xlsx gửi kèm, nén thành một file ZIP
+    cùng bảng tổng hợp PD/hạng; hồ sơ lỗi được ghi vào bảng tổng hợp thay vì dừng cả job.
+    """
+    if not _WORD_OK:
+        raise RuntimeError("Thiếu thư viện python-docx. Không thể xuất Word.")
+    trained, df, dataset_key = _job_training_model(ctx)
+    peers = get_peer_benchmark(dataset_key, df, _JOB_MODEL_COLS)
+    files = ctx.input_files()
+    rows = []
+    with zipfile.ZipFile(ctx.output_path("BaoCao_HangLoat.zip"), "w", zipfile.ZIP_DEFLATED) as bundle:
+        for i, path in enumerate(files):
+            # Tên file gửi kèm có tiền tố số thứ tự (trùng tên vẫn giữ đủ)
+            name = os.path.basename(path).split("_", 1)[-1]
+            company = os.path.splitext(name)[0]
+            ctx.progress(0.1 + 0.85 * i / len(files), f"Hồ sơ {i + 1}/{len(files)}: {name}")
+            try:
+                ratios_df = compute_ratios_from_three_sheets(path)
+            except Exception as e:
+                rows.append({"Hồ sơ": name, "Lỗi": str(e)})
+                continue
+            ratios_display = ratios_df[COMPUTED_COLS].T.rename(columns={0: 'Giá trị'})
+            rated = rate_pd(trained["model"], trained["calibrator"], ratios_df, list(_JOB_MODEL_COLS))
+            probs, pd_cal, grade = float(rated["PD thô"].iloc[0]), float(rated["PD hiệu chỉnh"].iloc[0]), str(rated["Hạng"].iloc[0])
+            peer_pct = pd.Series(peers.percentiles(ratios_df[list(_JOB_MODEL_COLS)]).iloc[0].to_numpy(),
+                                 index=ratios_display.index, name="Phân vị")
+            indicators = ratios_display.index.tolist()
+            values = ratios_display['Giá trị'].to_numpy(dtype=np.float64)
+            peer_values = peer_pct.to_numpy(dtype=np.float64)
+            word_buffer = generate_word_report(
+                ratios_display=ratios_display,
+                pd_value=probs,
+                pd_label="Default (Vỡ nợ)" if probs >= 0.15 else "Non-Default (Không vỡ nợ)",
+                ai_analysis="",
+                fig_bar=chart_png("ratio_bar", indicators, values, peer_values),
+                fig_radar=chart_png("ratio_radar", indicators, peer_values),
+                company_name=company,
+                pd_calibrated=pd_cal,
+                rating_grade=grade,
+                peer_percentiles=peer_pct,
+            )
+            bundle.writestr(f"BaoCao_TinDung_{company}.docx", word_buffer.getvalue())
+            rows.append({"Hồ sơ": name, "PD thô": probs, "PD hiệu chỉnh": pd_cal, "Hạng": grade, "Lỗi": ""})
+        summary = pd.DataFrame(rows, columns=["Hồ sơ", "PD thô", "PD hiệu chỉnh", "Hạng", "Lỗi"])
+        bundle.writestr("TongHop.csv", summary.to_csv(index=False).encode("utf-8-sig"))
+    n_failed = int((summary["Lỗi"].fillna("") != "").sum())
+    return {"Số báo cáo": f"{len(files) - n_failed:,}", "Hồ sơ lỗi": f"{n_failed:,}"}
 
-    Parameters:
-    - url: Đường dẫn RSS feed
-    - source_name: Tên nguồn tin
 
-    Returns:
-    - List của dict chứa {title, link, published}
+def simulate_portfolio_losses(pd_values, exposure, rho: float = MC_DEFAULT_RHO, n_scenarios: int = MC_DEFAULT_SCENARIOS,
+                              seed: int = 0, progress=None) -> np.ndarray:
     """
-    if not _FEEDPARSER_OK:
-        return [{"title": "⚠️ Thiếu thư viện feedparser", "link": "#", "published": ""}]
+    Mô phỏng tổn thất danh mục theo mô hình Vasicek một nhân tố: mỗi kịch bản rút nhân tố hệ thống Z,
+    PD có điều kiện = Φ((Φ⁻¹(PD) - √ρ·Z) / √(1-ρ)), vỡ nợ từng khoản rút độc lập theo PD có điều kiện.
+    Chạy theo lô MC_BATCH_CELLS ô (kịch bản x khoản vay) nên bộ nhớ không phụ thuộc số kịch bản.
 
-    try:
-        feed = feedparser.parse(url)
-        articles = []
-
-        # Lấy 5 bài mới nhất
-        for entry in feed.entries[:5]:
-            title = entry.get('title', 'Không có tiêu đề')
-            link = entry.get('link', '#')
-
-            # Xử lý thời gian
-            published = entry.get('published', '')
-            if not published:
-                published = entry.get('updated', '')
-
-            # Parse thời gian nếu có
-            pub_time = ""
-            if published:
-                try:
-                    from dateutil import parser as date_parser
-                    dt = date_parser.parse(published)
-                    pub_time = dt.strftime('%d/%m/%Y %H:%M')
-                except:
-                    pub_time = published
+    Parameters:
+    - pd_values: PD từng khoản vay (0-1)
+    - exposure: LGD x EAD từng khoản vay
+    - rho: tương quan tài sản với nhân tố hệ thống
+    - progress: hàm (tỷ lệ 0-1) gọi sau mỗi lô, có thể None
 
-            articles.append({
-                'title': title,
-                'link': link,
-                'published': pub_time
-            })
+    Returns:
+        Mảng tổn thất (n_scenarios,)
+    """
+    threshold = ndtri(np.clip(np.asarray(pd_values, dtype=np.float64), PD_FLOOR, 1 - 1e-9))
+    exposure = np.asarray(exposure, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    batch = max(1, MC_BATCH_CELLS // max(len(threshold), 1))
+    losses = np.empty(n_scenarios)
+    for start in range(0, n_scenarios, batch):
+        stop = min(start + batch, n_scenarios)
+        z = rng.standard_normal(stop - start)
+        conditional = ndtr((threshold[None, :] - np.sqrt(rho) * z[:, None]) / np.sqrt(1 - rho))
+        losses[start:stop] = (rng.random(conditional.shape) < conditional) @ exposure
+        if progress is not None:
+            progress(stop / n_scenarios)
+    return losses
+
+
+def loss_distribution_table(losses: np.ndarray, total_exposure: float) -> pd.DataFrame:
+    """EL, độ lệch chuẩn, VaR/ES theo các mức tin cậy (giá trị tuyệt đối và % tổng dư nợ)."""
+    rows = {"Tổn thất kỳ vọng (EL)": losses.mean(), "Độ lệch chuẩn": losses.std()}
+    for level in (95, 99, 99.9):
+        var = np.percentile(losses, level)
+        rows[f"VaR {level}%"] = var
+        rows[f"ES {level}%"] = losses[losses >= var].mean()
+    rows["Vốn kinh tế (VaR 99.9% - EL)"] = rows["VaR 99.9%"] - rows["Tổn thất kỳ vọng (EL)"]
+    table = pd.DataFrame({"Giá trị": pd.Series(rows)})
+    table["% tổng dư nợ"] = table["Giá trị"] / total_exposure if total_exposure > 0 else np.nan
+    return table
+
+
+def job_monte_carlo(ctx: JobContext) -> dict:
+    """
+    Mô phỏng Monte Carlo tổn thất danh mục đã chấm điểm (kết quả job chấm điểm hoặc CSV gửi kèm có cột PD):
+    LGD/EAD lấy từ cột cùng tên nếu có, không thì LGD mặc định và EAD = 1 mỗi khoản vay.
+    """
+    params = ctx.params
+    if params.get("source_job"):
+        path = os.path.join(job_dir(params["source_job"], "output"), "ChamDiem_HangLoat.csv")
+    else:
+        path = ctx.input_files()[0]
+    ctx.progress(0.0, "Đang đọc danh mục...", force=True)
+    portfolio = pd.read_csv(path, encoding="utf-8-sig")
+    pd_col = next((c for c in ("PD hiệu chỉnh", "PD thô", "PD", "pd") if c in portfolio.columns), None)
+    if pd_col is None:
+        raise ValueError("Danh mục cần cột 'PD hiệu chỉnh' (hoặc 'PD')")
+    pd_values = pd.to_numeric(portfolio[pd_col], errors="coerce")
+    valid = pd_values.notna().to_numpy()
+    lgd = (pd.to_numeric(portfolio["LGD"], errors="coerce").fillna(params["lgd"]) if "LGD" in portfolio
+           else pd.Series(params["lgd"], index=portfolio.index))
+    ead = (pd.to_numeric(portfolio["EAD"], errors="coerce").fillna(0.0) if "EAD" in portfolio
+           else pd.Series(1.0, index=portfolio.index))
+    exposure = (lgd * ead).to_numpy(dtype=np.float64)[valid]
+    if not valid.any():
+        raise ValueError("Danh mục không có PD hợp lệ")
+
+    n_scenarios = int(params["scenarios"])
+    losses = simulate_portfolio_losses(
+        pd_values.to_numpy(dtype=np.float64)[valid], exposure, rho=float(params["rho"]), n_scenarios=n_scenarios,
+        seed=int(params.get("seed", 0)),
+        progress=lambda done: ctx.progress(0.05 + 0.9 * done, f"Đã mô phỏng {int(done * n_scenarios):,}/{n_scenarios:,} kịch bản"),
+    )
+    total_exposure = float(ead.to_numpy(dtype=np.float64)[valid].sum())
+    table = loss_distribution_table(losses, total_exposure)
+    table.to_csv(ctx.output_path("RuiRo_DanhMuc.csv"), encoding="utf-8-sig")
+    pd.DataFrame({"Tổn thất": losses}).to_csv(ctx.output_path("TonThat_KichBan.csv"), index_label="Kịch bản",
+                                              encoding="utf-8-sig")
+    el, var999 = table.loc["Tổn thất kỳ vọng (EL)"], table.loc["VaR 99.9%"]
+    return {
+        "Số khoản vay": f"{int(valid.sum()):,}",
+        "EL": f"{el['Giá trị']:,.2f} ({el['% tổng dư nợ']:.2%})",
+        "VaR 99.9%": f"{var999['Giá trị']:,.2f} ({var999['% tổng dư nợ']:.2%})",
+    }
 
-        return articles if articles else [{"title": "Không có bài viết mới", "link": "#", "published": ""}]
 
-    except Exception as e:
-        return [{"title": f"⚠️ Lỗi khi đọc RSS: {str(e)[:50]}", "link": "#", "published": ""}]
+JOB_HANDLERS = {
+    "train": job_train_model,
+    "score": job_score_portfolio,
+    "word_bulk": job_word_bulk,
+    "monte_carlo": job_monte_carlo,
+}
 
 # =========================
 # UI & TRAIN MODEL
@@ -1071,109 +4240,163 @@ with col_title:
 
 st.markdown('</div>', unsafe_allow_html=True)
 
-# Load dữ liệu huấn luyện (CSV có default, X_1..X_14) - Giữ nguyên logic load data
-try:
-    df = pd.read_csv('DATASET.csv', encoding='latin-1')
-    # Tên cột cho việc huấn luyện (phải giữ nguyên X_1..X_14)
-    MODEL_COLS = [f"X_{i}" for i in range(1, 15)]
-except Exception:
-    df = None
+# Tên cột cho việc huấn luyện (phải giữ nguyên X_1..X_14)
+MODEL_COLS = [f"X_{i}" for i in range(1, 15)]
 
 # DI CHUYỂN UPLOADER VỀ ĐẦU SIDEBAR (Không còn selectbox)
 uploaded_file = st.sidebar.file_uploader("📂 Tải CSV Dữ liệu Huấn luyện", type=['csv'])
 if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file, encoding='latin-1')
-    MODEL_COLS = [f"X_{i}" for i in range(1, 15)]
-    
-# Định nghĩa các Tabs
-# ------------------------------------------------------------------------------------------------
-# THAY ĐỔI 4: Vị trí Tabs được giữ nguyên, CSS mới sẽ đảm bảo Tabs có màu
-# Tab mới: Dashboard tài chính doanh nghiệp (GSO) và Tin tức tài chính
-# ------------------------------------------------------------------------------------------------
-tab_predict, tab_dashboard, tab_news, tab_authors, tab_build, tab_goal = st.tabs([
-    "🚀 Sử dụng mô hình dự báo",
-    "📊 Dashboard tài chính doanh nghiệp",
-    "📰 Tin tức tài chính",
-    "👥 Nhóm tác giả",
-    "🛠️ Xây dựng mô hình",
-    "🎯 Mục tiêu của mô hình"
-])
-
-# --- Logic xử lý khi chưa có data huấn luyện ---
-if df is None:
-    st.sidebar.info("💡 Hãy tải file CSV huấn luyện (có cột 'default' và X_1...X_14) để xây dựng mô hình.")
-    
-    # Logic cho các tab khi thiếu data huấn luyện
-    with tab_predict:
-        st.header("⚡ Dự báo PD & Phân tích AI cho Hồ sơ mới")
-        st.warning("⚠️ **Không thể dự báo PD**. Vui lòng tải file **CSV Dữ liệu Huấn luyện** ở sidebar để xây dựng mô hình Logistic Regression.")
-        up_xlsx = st.file_uploader("Tải **ho_so_dn.xlsx**", type=["xlsx"], key="ho_so_dn")
-        if up_xlsx is None:
-            st.info("Hãy tải **ho_so_dn.xlsx** (đủ 3 sheet) để tính X1…X14 và phân tích AI.")
-
-    with tab_goal:
-        st.header("🎯 Mục tiêu của Mô hình")
-        st.info("Ứng dụng này cần dữ liệu huấn luyện để bắt đầu hoạt động.")
-    
-    with tab_build:
-          st.header("🛠️ Xây dựng & Đánh giá Mô hình LogReg")
-          st.error("❌ **Không thể xây dựng mô hình**. Vui lòng tải file **CSV Dữ liệu Huấn luyện** ở sidebar để bắt đầu.")
-          
-    st.stop()
-# ------------------------------------------------------------------------------------------------
+    train_size = uploaded_file.size
+else:
+    train_size = os.path.getsize(TRAIN_CSV_PATH) if os.path.exists(TRAIN_CSV_PATH) else 0
+streaming_train = st.sidebar.toggle(
+    "🌊 Huấn luyện dạng luồng (dữ liệu lớn)",
+    value=train_size >= STREAM_TRAIN_AUTO_BYTES,
+    help="Đọc CSV theo khối và huấn luyện SGD logistic tăng dần; bộ nhớ không phụ thuộc kích thước file. "
+         f"Tự bật khi file từ {STREAM_TRAIN_AUTO_BYTES // (1024 * 1024)} MB."
+)
 
 # Hiển thị trạng thái thư viện AI (Sử dụng cột để bố trí đẹp hơn)
 col_ai_status, col_date = st.columns([3, 1])
 with col_ai_status:
     ai_status = ("✅ sẵn sàng (cần 'GEMINI_API_KEY' trong Secrets)" if _GEMINI_OK else "⚠️ Thiếu thư viện google-genai.")
-    st.caption(f"🔎 Trạng thái Gemini AI: **<span style='color: #004c99; font-weight: bold;'>{ai_status}</span>**", unsafe_allow_html=True)
+    fallback_status = ("dự phòng OpenAI khi có 'OPENAI_API_KEY'" if _OPENAI_OK else "không có dự phòng OpenAI")
+    st.caption(f"🔎 Trạng thái Gemini AI: **<span style='color: #004c99; font-weight: bold;'>{ai_status}</span>** · {fallback_status}", unsafe_allow_html=True)
+    with st.expander("⏱️ Độ trễ nhà cung cấp AI"):
+        st.dataframe(get_ai_router().snapshot().style.format({"p50 (giây)": "{:.2f}", "p95 (giây)": "{:.2f}"}), use_container_width=True)
+    with st.expander("📦 Thời gian nạp thư viện"):
+        st.dataframe(import_report().style.format({"Thời gian (giây)": "{:.3f}"}), use_container_width=True, hide_index=True)
 with col_date:
     st.caption(f"📅 Cập nhật: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
 
+# Điều hướng theo trang: khác với st.tabs (chạy cả 6 tab mỗi lần rerun), chỉ code của trang
+# đang xem được thực thi; huấn luyện, ảnh, RSS... chỉ chạy khi trang cần đến được mở.
+VIEW_PREDICT, VIEW_DASHBOARD, VIEW_NEWS, VIEW_AUTHORS, VIEW_BUILD, VIEW_GOAL, VIEW_JOBS = (
+    "predict", "dashboard", "news", "authors", "build", "goal", "jobs"
+)
+VIEW_LABELS = {
+    VIEW_PREDICT: "🚀 Sử dụng mô hình dự báo",
+    VIEW_DASHBOARD: "📊 Dashboard tài chính doanh nghiệp",
+    VIEW_NEWS: "📰 Tin tức tài chính",
+    VIEW_AUTHORS: "👥 Nhóm tác giả",
+    VIEW_BUILD: "🛠️ Xây dựng mô hình",
+    VIEW_GOAL: "🎯 Mục tiêu của mô hình",
+    VIEW_JOBS: "⚙️ Công việc nền",
+}
+MODEL_VIEWS = (VIEW_PREDICT, VIEW_BUILD)  # Các trang cần dữ liệu huấn luyện và mô hình
+
+active_view = st.radio(
+    "Điều hướng", options=list(VIEW_LABELS), format_func=VIEW_LABELS.get,
+    horizontal=True, key="active_view", label_visibility="collapsed"
+)
 st.divider()
 
-# Kiểm tra cột cần thiết
-required_cols = ['default'] + MODEL_COLS
-missing = [c for c in required_cols if c not in df.columns]
-if missing:
-    st.error(f"❌ Thiếu cột: **{missing}**. Vui lòng kiểm tra lại file CSV huấn luyện.")
-    st.stop()
+@st.fragment(run_every=JOB_POLL_S)
+def job_wait_panel(job_id: str):
+    """Tiến độ của một job đang chờ/chạy, tự làm mới; job kết thúc thì chạy lại cả trang để hiện kết quả."""
+    job = get_job(job_id)
+    if job is None or job["status"] not in JOB_ACTIVE_STATUSES:
+        st.rerun()
+    if job["status"] == "queued":
+        worker_state = job_worker_state()
+        if worker_state == "stopped":
+            st.warning("⚠️ Không có tiến trình xử lý job (ed_jobs.py) nào đang chạy nên job chưa được nhận. "
+                       + ("Đang khởi động lại; nếu vẫn lặp lại, xem nhật ký "
+                          f"`{os.path.join(JOBS_DIR, 'worker.log')}`." if JOB_AUTOSTART
+                          else "Hãy chạy `python ed_jobs.py` trên máy chủ."))
+            ensure_job_worker()
+        elif worker_state == "unknown":
+            st.caption("Job chờ tiến trình `python ed_jobs.py` (không kiểm tra được worker trên hệ điều hành này).")
+    st.progress(job["progress"], text=job["message"] or JOB_STATUS_LABELS[job["status"]])
+
+
+stream_result = None
+if active_view in MODEL_VIEWS:
+    # Mô hình được huấn luyện bởi job nền (ed_jobs.py), không chạy trong luồng script: trang dùng job
+    # huấn luyện đã xong mới nhất cho bộ dữ liệu + chế độ đang chọn, chưa có thì gửi job và chờ. Không có
+    # worker nào xử lý được job (không có fcntl, hoặc ED_JOB_AUTOSTART=0 mà chưa chạy ed_jobs.py) thì huấn
+    # luyện ngay trên trang; cache_resource giữ mô hình cho các phiên sau.
+    df = model_job = trained = None
+    try:
+        if uploaded_file is not None or os.path.exists(TRAIN_CSV_PATH):
+            # Khóa bộ dữ liệu cho các chỉ mục tính một lần mỗi bộ dữ liệu (mô hình, phân vị, ...)
+            dataset_key = training_model_key(uploaded_file, streaming_train)
+            train_source = uploaded_file if uploaded_file is not None else TRAIN_CSV_PATH
+            if job_worker_available():
+                model_job = ensure_model_job(dataset_key, streaming_train, job_owner(), uploaded_file)
+                if model_job["status"] == "done":
+                    with perf_span("train"), perf_cache_lookup("model"):
+                        trained = load_job_model(model_job["id"])
+                    if not streaming_train:
+                        df = read_training_csv(train_source)
+            elif streaming_train:
+                with perf_span("train"), perf_cache_lookup("model"):
+                    trained = train_streaming_model(training_source_key(uploaded_file, TRAIN_CSV_PATH),
+                                                    train_source, tuple(MODEL_COLS))
+            else:
+                df = read_training_csv(train_source)
+                if set(MODEL_COLS + ['default']) <= set(df.columns):
+                    with perf_span("train"), perf_cache_lookup("model"):
+                        trained = train_batch_model(dataset_key, df, tuple(MODEL_COLS))
+            if streaming_train and trained is not None:
+                stream_result = trained
+                df = stream_result["sample"]  # Mẫu ngẫu nhiên thay cho toàn bộ dữ liệu khi hiển thị
+    except Exception as e:
+        df = model_job = None
+        st.sidebar.error(f"❌ Không đọc được dữ liệu huấn luyện: {e}")
 
+    # --- Mô hình đang huấn luyện ở tiến trình nền, hoặc lần huấn luyện gần nhất không thành công ---
+    if model_job is not None and model_job["status"] != "done":
+        if active_view == VIEW_PREDICT:
+            st.header("⚡ Dự báo PD & Phân tích AI cho Hồ sơ mới")
+        else:
+            st.header("🛠️ Xây dựng & Đánh giá Mô hình LogReg")
+        if model_job["status"] in JOB_ACTIVE_STATUSES:
+            if model_job["status"] == "queued":
+                ensure_job_worker()
+            st.info(f"⏳ Mô hình cho bộ dữ liệu này đang được huấn luyện ở tiến trình nền (job `{model_job['id']}`). "
+                    "Trang tự tải lại khi xong; có thể chuyển sang trang khác trong lúc chờ.")
+            job_wait_panel(model_job["id"])
+        else:
+            st.error(f"❌ Huấn luyện mô hình không thành công: {model_job['message'] or JOB_STATUS_LABELS[model_job['status']]}")
+            if st.button("🔁 Huấn luyện lại", key="retrain_model", type="primary"):
+                submit_model_job(dataset_key, streaming_train, job_owner(), uploaded_file)
+                st.rerun()
+        st.stop()
+
+    # --- Logic xử lý khi chưa có data huấn luyện ---
+    if df is None:
+        st.sidebar.info("💡 Hãy tải file CSV huấn luyện (có cột 'default' và X_1...X_14) để xây dựng mô hình.")
+
+        if active_view == VIEW_PREDICT:
+            st.header("⚡ Dự báo PD & Phân tích AI cho Hồ sơ mới")
+            st.warning("⚠️ **Không thể dự báo PD**. Vui lòng tải file **CSV Dữ liệu Huấn luyện** ở sidebar để xây dựng mô hình Logistic Regression.")
+            up_xlsx = st.file_uploader("Tải **ho_so_dn.xlsx**", type=["xlsx"], key="ho_so_dn")
+            if up_xlsx is None:
+                st.info("Hãy tải **ho_so_dn.xlsx** (đủ 3 sheet) để tính X1…X14 và phân tích AI.")
+        else:
+            st.header("🛠️ Xây dựng & Đánh giá Mô hình LogReg")
+            st.error("❌ **Không thể xây dựng mô hình**. Vui lòng tải file **CSV Dữ liệu Huấn luyện** ở sidebar để bắt đầu.")
 
-# Train model (GIỮ NGUYÊN)
-X = df[MODEL_COLS] # Chỉ lấy các cột X_1..X_14
-y = df['default'].astype(int)
+        st.stop()
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42, stratify=y
-)
-model = LogisticRegression(random_state=42, max_iter=1000, class_weight="balanced", solver="lbfgs")
-model.fit(X_train, y_train)
-
-# Dự báo & đánh giá (GIỮ NGUYÊN)
-y_pred_in = model.predict(X_train)
-y_proba_in = model.predict_proba(X_train)[:, 1]
-y_pred_out = model.predict(X_test)
-y_proba_out = model.predict_proba(X_test)[:, 1]
-
-metrics_in = {
-    "accuracy_in": accuracy_score(y_train, y_pred_in),
-    "precision_in": precision_score(y_train, y_pred_in, zero_division=0),
-    "recall_in": recall_score(y_train, y_pred_in, zero_division=0),
-    "f1_in": f1_score(y_train, y_pred_in, zero_division=0),
-    "auc_in": roc_auc_score(y_train, y_proba_in),
-}
-metrics_out = {
-    "accuracy_out": accuracy_score(y_test, y_pred_out),
-    "precision_out": precision_score(y_test, y_pred_out, zero_division=0),
-    "recall_out": recall_score(y_test, y_pred_out, zero_division=0),
-    "f1_out": f1_score(y_test, y_pred_out, zero_division=0),
-    "auc_out": roc_auc_score(y_test, y_proba_out),
-}
+    # Kiểm tra cột cần thiết
+    required_cols = ['default'] + MODEL_COLS
+    missing = [c for c in required_cols if c not in df.columns]
+    if missing:
+        st.error(f"❌ Thiếu cột: **{missing}**. Vui lòng kiểm tra lại file CSV huấn luyện.")
+        st.stop()
 
-# --- CÁC PHẦN UI DỰA TRÊN TABS ---
+    X = df[MODEL_COLS]
+    model = trained["model"]
+    pd_calibrator = trained["calibrator"]
+    metrics_in = trained["metrics_in"]
+    metrics_out = trained["metrics_out"]
+    cm_out = trained["cm_out"]
 
-with tab_goal:
+# --- CÁC PHẦN UI THEO TRANG ĐANG XEM ---
+
+if active_view == VIEW_GOAL:
     st.header("🎯 Mục tiêu của Mô hình")
     st.markdown("**Dự báo xác suất vỡ nợ (PD) của khách hàng doanh nghiệp** dựa trên bộ chỉ số $\text{X1}–\text{X14}$ (tính từ Bảng Cân đối Kế toán, Báo cáo Kết quả Kinh doanh và Báo cáo Lưu chuyển Tiền tệ).")
     
@@ -1219,9 +4442,14 @@ with tab_goal:
         </div>
     """, unsafe_allow_html=True)
 
-with tab_build:
+if active_view == VIEW_BUILD:
     st.header("🛠️ Xây dựng & Đánh giá Mô hình LogReg")
-    st.info("Mô hình Hồi quy Logistic đã được huấn luyện trên **20% dữ liệu Test (chưa thấy)**.")
+    if stream_result is not None:
+        st.info(f"🌊 Chế độ luồng: SGD logistic huấn luyện trên **{stream_result['n_train']:,}** dòng, "
+                f"đánh giá trên **{stream_result['n_test']:,}** dòng hold-out (phân tầng theo lớp). "
+                f"Thống kê và biểu đồ bên dưới dùng mẫu ngẫu nhiên **{len(df):,}** dòng.")
+    else:
+        st.info("Mô hình Hồi quy Logistic đã được huấn luyện trên **20% dữ liệu Test (chưa thấy)**.")
     
     # Hiển thị Metrics quan trọng bằng st.metric
     st.subheader("1. Tổng quan Kết quả Đánh giá (Test Set)")
@@ -1249,48 +4477,8 @@ with tab_build:
     # Biểu đồ Scatter Plot và Đường Hồi quy Logisitc (GIỮ NGUYÊN LOGIC, CẢI THIỆN MÀU SẮC)
     if col in df.columns:
         try:
-            # Dùng Streamlit.pyplot với theme banking hiện đại
-            fig, ax = plt.subplots(figsize=(12, 7))
-
-            # Set background color
-            fig.patch.set_facecolor('#f8f9fa')
-            ax.set_facecolor('#ffffff')
-
-            # Scatter plot với màu sắc pink rose theme
-            sns.scatterplot(data=df, x=col, y='default', alpha=0.65, ax=ax, hue='default',
-                          palette=['#ff6b9d', '#ffb3c6'], s=80, edgecolor='white', linewidth=0.5)
-
-            # Vẽ đường logistic regression theo 1 biến
-            x_range = np.linspace(df[col].min(), df[col].max(), 100).reshape(-1, 1)
-            X_temp = df[[col]].copy()
-            y_temp = df['default']
-            lr_temp = LogisticRegression(max_iter=1000)
-            lr_temp.fit(X_temp, y_temp)
-            x_test = pd.DataFrame({col: x_range[:, 0]})
-            y_curve = lr_temp.predict_proba(x_test)[:, 1]
-            ax.plot(x_range, y_curve, color='#c2185b', linewidth=4, label='Đường LogReg',
-                   linestyle='-', alpha=0.9)
-
-            # Styling cho tiêu đề và labels
-            ax.set_title(f'Quan hệ giữa {col} và Xác suất Vỡ nợ', fontsize=16, fontweight='bold', color='#c2185b', pad=20)
-            ax.set_ylabel('Xác suất Default (0: Non-Default, 1: Default)', fontsize=13, fontweight='600', color='#4a5568')
-            ax.set_xlabel(col, fontsize=13, fontweight='600', color='#4a5568')
-
-            # Grid styling
-            ax.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color='#ff6b9d')
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['left'].set_color('#d0d0d0')
-            ax.spines['bottom'].set_color('#d0d0d0')
-
-            # Legend styling
-            legend = ax.legend(title='Default Status', title_fontsize=11, fontsize=10,
-                             frameon=True, fancybox=True, shadow=True)
-            legend.get_frame().set_facecolor('#f8f9fa')
-            legend.get_frame().set_alpha(0.9)
-
-            st.pyplot(fig)
-            plt.close(fig)
+            # Scatter + đường LogReg một biến (PNG cache theo dữ liệu và biến được chọn)
+            st.image(chart_image("scatter", df[col].to_numpy(dtype=np.float64), df['default'].to_numpy(), col))
         except Exception as e:
             st.error(f"Lỗi khi vẽ biểu đồ: {e}")
     else:
@@ -1303,27 +4491,7 @@ with tab_build:
     
     with col_cm:
         st.markdown("##### Ma trận Nhầm lẫn (Test Set)")
-        cm = confusion_matrix(y_test, y_pred_out)
-
-        # Tạo custom colormap cho pink rose theme
-        from matplotlib.colors import LinearSegmentedColormap
-        colors_pink = ['#fff5f7', '#ffe8f0', '#ffd4dd', '#ff85a1', '#ff6b9d']
-        n_bins = 100
-        cmap_pink = LinearSegmentedColormap.from_list('pink_rose', colors_pink, N=n_bins)
-
-        disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=['Non-Default (0)', 'Default (1)'])
-        fig2, ax = plt.subplots(figsize=(7, 7))
-        fig2.patch.set_facecolor('#f8f9fa')
-
-        disp.plot(ax=ax, cmap=cmap_pink, colorbar=True)
-
-        # Styling
-        ax.set_title('Ma trận Nhầm lẫn', fontsize=14, fontweight='bold', color='#c2185b', pad=15)
-        ax.set_xlabel('Predicted Label', fontsize=12, fontweight='600', color='#4a5568')
-        ax.set_ylabel('True Label', fontsize=12, fontweight='600', color='#4a5568')
-
-        st.pyplot(fig2)
-        plt.close(fig2)
+        st.image(chart_image("confusion", np.asarray(cm_out)))
         
     with col_metrics_table:
         st.markdown("##### Bảng Metrics Chi tiết")
@@ -1339,6 +4507,15 @@ with tab_build:
 
         st.dataframe(dt.style.format("{:.4f}").apply(highlight_max, axis=1), use_container_width=True)
 
+    with st.expander("🏷️ Hiệu chỉnh PD & Thang xếp hạng (Master Scale)"):
+        calib_name = "Isotonic" if pd_calibrator.method_ == "isotonic" else "Platt (logistic trên logit điểm)"
+        st.markdown(f"PD thô được hiệu chỉnh bằng **{calib_name}**, fit trên điểm out-of-fold/hold-out; "
+                    f"PD tối thiểu **{PD_FLOOR:.2%}**. Hạng được tra theo thang dưới đây.")
+        st.dataframe(
+            master_scale_table().style.format({"PD từ": "{:.2%}", "PD đến": "{:.2%}"}),
+            use_container_width=True, hide_index=True
+        )
+
     # Nút lên đầu trang
     st.markdown("""
         <div style='text-align: center; margin-top: 40px; margin-bottom: 20px;'>
@@ -1361,7 +4538,7 @@ with tab_build:
         </div>
     """, unsafe_allow_html=True)
 
-with tab_predict:
+if active_view == VIEW_PREDICT:
     # Trang này được hiển thị mặc định
     st.header("⚡ Dự báo PD & Phân tích AI cho Hồ sơ mới")
     
@@ -1370,14 +4547,27 @@ with tab_predict:
     with input_container:
         st.markdown("##### 📥 Tải lên Hồ sơ Doanh nghiệp (Excel)")
         st.caption("File phải có đủ **3 sheet**: **CDKT** (Bảng Cân đối Kế toán) ; **BCTN** (Báo cáo Kết quả Kinh doanh) ; **LCTT** (Báo cáo Lưu chuyển Tiền tệ).")
-        up_xlsx = st.file_uploader("Tải **ho_so_dn.xlsx**", type=["xlsx"], key="ho_so_dn_main", label_visibility="collapsed")
-    
+        # Widget bị gỡ khi chuyển sang trang khác nên file tải lên mất theo: giữ bản sao trong phiên
+        # để quay lại trang vẫn dùng được (người dùng đổi hoặc bấm ✕ trên uploader thì bỏ bản sao)
+        up_xlsx = st.file_uploader(
+            "Tải **ho_so_dn.xlsx**", type=["xlsx"], key="ho_so_dn_main", label_visibility="collapsed",
+            on_change=lambda: st.session_state.pop('kept_ho_so_dn', None)
+        )
+        if up_xlsx is not None:
+            st.session_state['kept_ho_so_dn'] = (up_xlsx.name, up_xlsx.getvalue())
+        elif 'kept_ho_so_dn' in st.session_state:
+            kept_name, kept_data = st.session_state['kept_ho_so_dn']
+            st.caption(f"📎 Đang dùng hồ sơ đã tải trước đó: **{kept_name}** (tải file khác để thay thế).")
+            up_xlsx = BytesIO(kept_data)
+
     if up_xlsx is not None:
         # Tính X1..X14 từ 3 sheet (GIỮ NGUYÊN)
         try:
             # Hiển thị thanh tiến trình giả lập (thêm hiệu ứng động)
             with st.spinner('Đang đọc và xử lý dữ liệu tài chính...'):
-                ratios_df = compute_ratios_from_three_sheets(up_xlsx)
+                # Một lần đọc file cho mọi kỳ; kỳ gần nhất dùng cho phân tích chi tiết
+                ratio_series = ratio_series_for_upload(up_xlsx)
+                ratios_df = ratio_series.iloc[[-1]].reset_index(drop=True)
             
             # Tách riêng 14 cột tiếng Việt (hiển thị) và 14 cột tiếng Anh (dự báo)
             # ratios_display là DataFrame 1 cột: Index (Tên chỉ số) | Giá trị
@@ -1395,19 +4585,32 @@ with tab_predict:
         data_for_ai = ratios_display.to_dict()['Giá trị']
         
         # (Tuỳ chọn) dự báo PD nếu mô hình đã huấn luyện đúng cấu trúc X_1..X_14
+        # Phân vị từng chỉ số so với tổng thể huấn luyện (theo thứ tự COMPUTED_COLS)
+        peer_pct = pd.Series(
+            get_peer_benchmark(dataset_key, df, tuple(MODEL_COLS)).percentiles(ratios_predict).iloc[0].to_numpy(),
+            index=ratios_display.index, name="Phân vị"
+        )
+
         probs = np.nan
         preds = np.nan
+        pd_cal = np.nan
+        grade = "N/A"
         # Kiểm tra mô hình có sẵn sàng dự báo không (đã train và cột khớp)
         if set(X.columns) == set(ratios_predict.columns):
             try:
                 # Đảm bảo thứ tự cột cho predict đúng như thứ tự cột huấn luyện
-                probs_array = model.predict_proba(ratios_predict[X.columns])[:, 1]
+                probs_array = score_pd(model, ratios_predict, list(X.columns))
                 # Chuyển từ numpy array sang scalar để tránh lỗi ambiguous truth value
                 probs = float(probs_array[0])
                 preds = int(probs >= 0.15)
+                # PD hiệu chỉnh theo tỷ lệ vỡ nợ quan sát + hạng master scale
+                pd_cal = float(pd_calibrator.predict(probs_array)[0])
+                grade = str(pd_grade(pd_cal)[0])
                 # Thêm PD vào payload AI
                 data_for_ai['Xác suất Vỡ nợ (PD)'] = probs
                 data_for_ai['Dự đoán PD'] = "Default (Vỡ nợ)" if preds == 1 else "Non-Default (Không vỡ nợ)"
+                data_for_ai['PD hiệu chỉnh'] = pd_cal
+                data_for_ai['Hạng tín nhiệm (master scale)'] = f"{grade} - {_PD_GRADE_DESC[grade]}"
             except Exception as e:
                 # Nếu có lỗi dự báo, chỉ cảnh báo, không dừng app
                 st.warning(f"Không dự báo được PD: {e}")
@@ -1465,8 +4668,80 @@ with tab_predict:
                 # Đảo ngược màu sắc delta cho PD: Rủi ro cao là màu đỏ (inverse), rủi ro thấp là màu xanh (normal)
                 delta_color=("inverse" if pd.notna(preds) and preds == 1 else "normal")
             )
+            if pd.notna(pd_cal):
+                st.metric(
+                    label="**PD hiệu chỉnh · Hạng**",
+                    value=f"{pd_cal:.2%}",
+                    delta=f"Hạng {grade}",
+                    delta_color="off",
+                    help="PD thô được hiệu chỉnh theo tỷ lệ vỡ nợ quan sát (fit trên điểm out-of-fold) "
+                         "và xếp hạng theo thang master scale."
+                )
+                st.caption(f"🏷️ {grade}: {_PD_GRADE_DESC[grade]}")
+
+            # Cảnh báo sớm: tin tức nhắc đến khách hàng (tên nhập ở mục Xuất Báo cáo Word)
+            borrower_name = st.session_state.get("company_name_word", "").strip()
+            if borrower_name and borrower_name != "KHÁCH HÀNG DOANH NGHIỆP":
+                try:
+                    mentions = borrower_news_mentions(borrower_name, limit=10)
+                except Exception:
+                    mentions = pd.DataFrame()
+                if not mentions.empty:
+                    st.warning(f"📰 **{len(mentions)}** tin gần đây nhắc đến khách hàng")
+                    for _, mention in mentions.iterrows():
+                        st.caption(f"🕐 {mention['Thời gian']} · {mention['Nguồn']} · [{mention['Tiêu đề']}]({mention['Link']})")
+                else:
+                    st.caption("📰 Chưa ghi nhận tin tức nhắc đến khách hàng (theo dõi từ khi xuất báo cáo Word).")
         # ------------------------------------------------------------------------------------------------
 
+        # Diễn biến PD theo từng năm trong hồ sơ (mỗi cặp năm liên tiếp một lần tính)
+        if len(ratio_series) > 1:
+            with st.expander(f"📈 Diễn biến PD & Chỉ số theo năm ({len(ratio_series)} kỳ)", expanded=True):
+                try:
+                    pd_trend = rate_pd(model, pd_calibrator, ratio_series, MODEL_COLS)
+                except Exception as e:
+                    st.warning(f"Không tính được PD theo năm: {e}")
+                else:
+                    period_labels = [str(p) for p in ratio_series.index]
+                    fig_trend = go.Figure(go.Scatter(
+                        x=period_labels, y=pd_trend["PD hiệu chỉnh"], mode="lines+markers+text",
+                        text=pd_trend["Hạng"], textposition="top center", name="PD hiệu chỉnh",
+                        line=dict(color="#ff6b9d", width=3), marker=dict(size=9),
+                        hovertemplate="%{x}: %{y:.2%} (%{text})<extra></extra>",
+                    ))
+                    fig_trend.update_layout(title="PD hiệu chỉnh theo năm", yaxis_title="PD", yaxis_tickformat=".1%",
+                                            xaxis_title="Năm", xaxis_type="category", height=350, **_CHART_LAYOUT)
+                    st.plotly_chart(fig_trend, use_container_width=True)
+                    trend_table = pd.concat([pd_trend, ratio_series[COMPUTED_COLS]], axis=1)
+                    trend_table.index = period_labels
+                    # Bảng chuyển vị trộn hạng (chữ) với số: định dạng sẵn thành chuỗi để hiển thị
+                    st.dataframe(
+                        trend_table.T.map(lambda v: v if isinstance(v, str) else f"{v:.4f}"),
+                        use_container_width=True
+                    )
+
+        # Doanh nghiệp tương tự trong lịch sử: láng giềng gần nhất trên X đã qua tiền xử lý của mô hình
+        with st.expander("🔎 Doanh nghiệp tương tự trong dữ liệu lịch sử"):
+            k_similar = st.slider("Số doanh nghiệp tương tự (k)", 3, 20, SIMILAR_K, key="similar_k")
+            try:
+                similar_index = get_similar_borrower_index(dataset_key, df, model[:-1], tuple(MODEL_COLS))
+                neighbours = similar_index.query(ratios_predict, k=k_similar)
+            except Exception as e:
+                st.warning(f"Không tra cứu được doanh nghiệp tương tự: {e}")
+            else:
+                sim_cols = st.columns(3)
+                if "default" in neighbours:
+                    sim_cols[0].metric("Tỷ lệ vỡ nợ nhóm tương tự", f"{neighbours['default'].mean():.0%}")
+                if "LGD" in neighbours:
+                    sim_cols[1].metric("LGD trung bình", f"{neighbours['LGD'].mean():.2%}")
+                if "EAD" in neighbours:
+                    sim_cols[2].metric("EAD trung bình", f"{neighbours['EAD'].mean():.3f}")
+                st.dataframe(
+                    neighbours.drop(columns=["Hồ sơ"]).style.format({"Khoảng cách": "{:.3f}", "LGD": "{:.2%}", "EAD": "{:.3f}"}),
+                    use_container_width=True, hide_index=True
+                )
+                st.caption("Khoảng cách Euclid trên 14 chỉ số đã winsorize và chuẩn hóa như khi huấn luyện.")
+
         st.divider()
 
         # ========================================
@@ -1474,88 +4749,24 @@ with tab_predict:
         # ========================================
         st.markdown("### 2. 📊 Trực quan hóa Các Chỉ số Tài chính")
 
+        # Dữ liệu chung cho biểu đồ cột, radar và báo cáo Word (PNG cache theo dữ liệu nên nút xuất Word
+        # và các lần rerun không vẽ lại)
+        indicators = ratios_display.index.tolist()
+        values = ratios_display['Giá trị'].to_numpy(dtype=np.float64)
+        peer_values = peer_pct.to_numpy(dtype=np.float64)
+
         # Tạo 2 cột cho 2 loại biểu đồ
+        charts_t0 = time.perf_counter()
         chart_col1, chart_col2 = st.columns(2)
 
         with chart_col1:
             st.markdown("#### 📈 Biểu đồ Cột - Giá trị các Chỉ số")
-            # Tạo bar chart
-            fig_bar, ax_bar = plt.subplots(figsize=(8, 10))
-            fig_bar.patch.set_facecolor('#fff5f7')
-            ax_bar.set_facecolor('#ffffff')
-
-            # Chuẩn bị data cho bar chart
-            indicators = ratios_display.index.tolist()
-            values = ratios_display['Giá trị'].values
-
-            # Tạo màu gradient cho các bars
-            bar_colors = plt.cm.RdPu(np.linspace(0.3, 0.9, len(indicators)))
-
-            # Vẽ horizontal bar chart
-            bars = ax_bar.barh(indicators, values, color=bar_colors, edgecolor='white', linewidth=1.5)
-
-            # Thêm giá trị vào cuối mỗi bar
-            for i, (bar, val) in enumerate(zip(bars, values)):
-                width = bar.get_width()
-                ax_bar.text(width, bar.get_y() + bar.get_height()/2,
-                           f' {val:.3f}', ha='left', va='center',
-                           fontsize=9, fontweight='600', color='#c2185b')
-
-            # Styling
-            ax_bar.set_xlabel('Giá trị', fontsize=12, fontweight='600', color='#4a5568')
-            ax_bar.set_title('Các Chỉ số Tài chính', fontsize=14, fontweight='bold', color='#c2185b', pad=15)
-            ax_bar.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color='#ff6b9d', axis='x')
-            ax_bar.spines['top'].set_visible(False)
-            ax_bar.spines['right'].set_visible(False)
-            ax_bar.spines['left'].set_color('#d0d0d0')
-            ax_bar.spines['bottom'].set_color('#d0d0d0')
-
-            # Điều chỉnh layout để labels không bị cắt
-            plt.tight_layout()
-            st.pyplot(fig_bar)
-            plt.close(fig_bar)
+            st.image(chart_image("ratio_bar", indicators, values, peer_values))
 
         with chart_col2:
             st.markdown("#### 🎯 Biểu đồ Radar - Phân tích Đa chiều")
-            # Tạo radar chart (spider chart)
-            fig_radar = plt.figure(figsize=(10, 10))
-            fig_radar.patch.set_facecolor('#fff5f7')
-            ax_radar = fig_radar.add_subplot(111, projection='polar')
-
-            # Chuẩn bị data cho radar chart
-            # Normalize các giá trị về khoảng 0-1 để dễ visualize
-            from sklearn.preprocessing import MinMaxScaler
-            scaler = MinMaxScaler()
-            normalized_values = scaler.fit_transform(values.reshape(-1, 1)).flatten()
-
-            # Tạo các góc cho mỗi chỉ số
-            angles = np.linspace(0, 2 * np.pi, len(indicators), endpoint=False).tolist()
-            normalized_values = normalized_values.tolist()
-
-            # Đóng vòng tròn
-            angles += angles[:1]
-            normalized_values += normalized_values[:1]
-
-            # Vẽ radar chart
-            ax_radar.plot(angles, normalized_values, 'o-', linewidth=2.5, color='#ff6b9d', label='Chỉ số')
-            ax_radar.fill(angles, normalized_values, alpha=0.25, color='#ffb3c6')
-
-            # Thêm labels
-            ax_radar.set_xticks(angles[:-1])
-            # Rút ngắn tên chỉ số để dễ đọc
-            short_labels = [label.split('(')[0].strip()[:20] for label in indicators]
-            ax_radar.set_xticklabels(short_labels, size=8, color='#4a5568', fontweight='600')
-
-            # Styling
-            ax_radar.set_ylim(0, 1)
-            ax_radar.set_title('Phân tích Đa chiều các Chỉ số\n(Normalized 0-1)',
-                              fontsize=14, fontweight='bold', color='#c2185b', pad=20)
-            ax_radar.grid(True, alpha=0.3, linestyle='--', linewidth=0.8, color='#ff6b9d')
-            ax_radar.set_facecolor('#ffffff')
-
-            plt.tight_layout()
-            st.pyplot(fig_radar)
-            plt.close(fig_radar)
+            st.image(chart_image("ratio_radar", indicators, peer_values))
+        perf_record("charts", time.perf_counter() - charts_t0)
 
         # Thêm expander với thông tin bổ sung
         with st.expander("ℹ️ Giải thích về Biểu đồ"):
@@ -1566,8 +4777,8 @@ with tab_predict:
             - Giá trị cụ thể được hiển thị bên cạnh mỗi cột
 
             **Biểu đồ Radar (Spider Chart):**
-            - Hiển thị cân bằng tổng thể giữa các chỉ số
-            - Giá trị được chuẩn hóa về thang 0-1 để dễ so sánh
+            - Mỗi trục là phân vị của chỉ số so với toàn bộ doanh nghiệp trong dữ liệu huấn luyện
+            - 0,5 = ngang trung vị; lưu ý với chỉ số nợ (X5, X6) phân vị cao nghĩa là đòn bẩy cao hơn
             - Diện tích vùng phủ thể hiện độ mạnh của các chỉ số
             - Hình dạng đều = tốt, hình dạng lệch = cần cân bằng
             """)
@@ -1587,67 +4798,76 @@ with tab_predict:
         if 'ai_context_data' not in st.session_state:
             st.session_state['ai_context_data'] = {}
 
-        ai_container = st.container(border=True)
-        with ai_container:
-            st.markdown("Sử dụng AI để phân tích toàn diện các chỉ số và đưa ra khuyến nghị chuyên nghiệp.")
-
-            # Tạo 2 cột cho nút phân tích và nút ẩn
-            col_btn1, col_btn2 = st.columns([3, 1])
-
-            with col_btn1:
-                analyze_button = st.button("✨ Yêu cầu AI Phân tích & Đề xuất", use_container_width=True, type="primary", key="analyze_ai_btn")
-
-            with col_btn2:
-                if st.session_state['show_ai_analysis']:
-                    hide_button = st.button("🔽 Ẩn phân tích", use_container_width=True, key="hide_ai_btn")
-                    if hide_button:
-                        st.session_state['show_ai_analysis'] = False
-                        st.session_state['chat_messages'] = []
+        # Khung phân tích AI, chatbot và xuất Word là các fragment: tương tác bên trong chỉ chạy lại
+        # chính khung đó (không huấn luyện lại, không vẽ lại biểu đồ, không gọi RSS).
+        @st.fragment
+        def ai_analysis_panel():
+            ai_container = st.container(border=True)
+            with ai_container:
+                st.markdown("Sử dụng AI để phân tích toàn diện các chỉ số và đưa ra khuyến nghị chuyên nghiệp.")
+
+                # Tạo 2 cột cho nút phân tích và nút ẩn
+                col_btn1, col_btn2 = st.columns([3, 1])
+
+                with col_btn1:
+                    analyze_button = st.button("✨ Yêu cầu AI Phân tích & Đề xuất", use_container_width=True, type="primary", key="analyze_ai_btn")
+
+                with col_btn2:
+                    if st.session_state['show_ai_analysis']:
+                        hide_button = st.button("🔽 Ẩn phân tích", use_container_width=True, key="hide_ai_btn")
+                        if hide_button:
+                            st.session_state['show_ai_analysis'] = False
+                            st.session_state['chat_messages'] = []
+                            st.rerun()
+
+                # Xử lý khi người dùng click nút phân tích
+                if analyze_button:
+                    # Kiểm tra API Key: ưu tiên lấy từ secrets
+                    api_key = st.secrets.get("GEMINI_API_KEY")
+                    openai_api_key = st.secrets.get("OPENAI_API_KEY")
+
+                    if api_key or openai_api_key:
+                        # Thêm thanh tiến trình đẹp mắt
+                        progress_bar = st.progress(0, text="Đang gửi dữ liệu và chờ Gemini phân tích...")
+                        for percent_complete in range(100):
+                            import time
+                            time.sleep(0.01) # Giả lập thời gian xử lý
+                            progress_bar.progress(percent_complete + 1, text=f"Đang gửi dữ liệu và chờ Gemini phân tích... {percent_complete+1}%")
+
+                        ai_result = get_ai_analysis(data_for_ai, api_key, openai_api_key)
+                        progress_bar.empty() # Xóa thanh tiến trình
+
+                        # Lưu kết quả vào session_state
+                        st.session_state['ai_analysis'] = ai_result
+                        st.session_state['show_ai_analysis'] = True
+                        st.session_state['ai_context_data'] = data_for_ai
+                        st.session_state['chat_messages'] = []  # Reset chat khi phân tích mới
                         st.rerun()
+                    else:
+                        st.error("❌ **Lỗi Khóa API**: Không tìm thấy Khóa API. Vui lòng cấu hình Khóa **'GEMINI_API_KEY'** (hoặc **'OPENAI_API_KEY'**) trong Streamlit Secrets.")
 
-            # Xử lý khi người dùng click nút phân tích
-            if analyze_button:
-                # Kiểm tra API Key: ưu tiên lấy từ secrets
-                api_key = st.secrets.get("GEMINI_API_KEY")
-
-                if api_key:
-                    # Thêm thanh tiến trình đẹp mắt
-                    progress_bar = st.progress(0, text="Đang gửi dữ liệu và chờ Gemini phân tích...")
-                    for percent_complete in range(100):
-                        import time
-                        time.sleep(0.01) # Giả lập thời gian xử lý
-                        progress_bar.progress(percent_complete + 1, text=f"Đang gửi dữ liệu và chờ Gemini phân tích... {percent_complete+1}%")
-
-                    ai_result = get_ai_analysis(data_for_ai, api_key)
-                    progress_bar.empty() # Xóa thanh tiến trình
-
-                    # Lưu kết quả vào session_state
-                    st.session_state['ai_analysis'] = ai_result
-                    st.session_state['show_ai_analysis'] = True
-                    st.session_state['ai_context_data'] = data_for_ai
-                    st.session_state['chat_messages'] = []  # Reset chat khi phân tích mới
-                    st.rerun()
-                else:
-                    st.error("❌ **Lỗi Khóa API**: Không tìm thấy Khóa API. Vui lòng cấu hình Khóa **'GEMINI_API_KEY'** trong Streamlit Secrets.")
+            # Hiển thị kết quả phân tích AI nếu đã có
+            if st.session_state['show_ai_analysis'] and st.session_state['ai_analysis']:
+                ai_result = st.session_state['ai_analysis']
 
-        # Hiển thị kết quả phân tích AI và chatbot nếu đã có phân tích
-        if st.session_state['show_ai_analysis'] and st.session_state['ai_analysis']:
-            ai_result = st.session_state['ai_analysis']
+                st.markdown("---")
+                st.markdown("**Kết quả Phân tích Chi tiết từ Gemini AI:**")
 
-            st.markdown("---")
-            st.markdown("**Kết quả Phân tích Chi tiết từ Gemini AI:**")
-
-            if "KHÔNG CHO VAY" in ai_result.upper():
-                st.error("🚨 **KHUYẾN NGHỊ CUỐI CÙNG: KHÔNG CHO VAY**")
-                st.snow()
-            elif "CHO VAY" in ai_result.upper():
-                st.success("✅ **KHUYẾN NGHỊ CUỐI CÙNG: CHO VAY**")
-                st.balloons()
-            else:
-                st.info("💡 **KHUYẾN NGHỊ CUỐI CÙNG**")
+                if "KHÔNG CHO VAY" in ai_result.upper():
+                    st.error("🚨 **KHUYẾN NGHỊ CUỐI CÙNG: KHÔNG CHO VAY**")
+                    st.snow()
+                elif "CHO VAY" in ai_result.upper():
+                    st.success("✅ **KHUYẾN NGHỊ CUỐI CÙNG: CHO VAY**")
+                    st.balloons()
+                else:
+                    st.info("💡 **KHUYẾN NGHỊ CUỐI CÙNG**")
 
-            st.info(ai_result)
+                st.info(ai_result)
 
+        @st.fragment
+        def ai_chatbot_panel():
+            if not (st.session_state['show_ai_analysis'] and st.session_state['ai_analysis']):
+                return
             # ===== CHATBOT GEMINI AI =====
             st.markdown("---")
             st.markdown("#### 💬 Chatbot - Hỏi thêm thông tin")
@@ -1685,6 +4905,7 @@ with tab_predict:
                 if submit_button and user_question.strip():
                     # Lấy API key
                     api_key = st.secrets.get("GEMINI_API_KEY")
+                    openai_api_key = st.secrets.get("OPENAI_API_KEY")
 
                     # Lưu câu hỏi của user
                     st.session_state['chat_messages'].append({
@@ -1700,7 +4921,7 @@ with tab_predict:
 
                     # Gọi chatbot API
                     with st.spinner("🤔 Gemini đang suy nghĩ..."):
-                        bot_response = chat_with_gemini(user_question, api_key, context_data)
+                        bot_response = chat_with_gemini(user_question, api_key, context_data, openai_api_key)
 
                     # Lưu response của bot
                     st.session_state['chat_messages'].append({
@@ -1708,135 +4929,173 @@ with tab_predict:
                         'content': bot_response
                     })
 
-                    # Rerun để hiển thị tin nhắn mới
-                    st.rerun()
+                    # Chỉ chạy lại khung chat để hiển thị tin nhắn mới
+                    st.rerun(scope="fragment")
 
                 # Xử lý khi người dùng xóa lịch sử
                 if clear_button:
                     st.session_state['chat_messages'] = []
-                    st.rerun()
+                    st.rerun(scope="fragment")
+
+        ai_analysis_panel()
+        ai_chatbot_panel()
 
         st.divider()
 
         # ===== NÚT XUẤT FILE WORD =====
         st.markdown("### 4. 📄 Xuất Báo cáo Word")
 
-        export_container = st.container(border=True)
-        with export_container:
-            st.markdown("Xuất toàn bộ phân tích (chỉ số tài chính, biểu đồ, PD, khuyến nghị AI) ra file Word chuyên nghiệp.")
-
-            col_export1, col_export2 = st.columns([3, 1])
-
-            with col_export1:
-                company_name_input = st.text_input("Tên Khách hàng (tùy chọn):", value="KHÁCH HÀNG DOANH NGHIỆP", key="company_name_word")
+        @st.fragment
+        def word_export_panel():
+            export_container = st.container(border=True)
+            with export_container:
+                st.markdown("Xuất toàn bộ phân tích (chỉ số tài chính, biểu đồ, PD, khuyến nghị AI) ra file Word chuyên nghiệp.")
+
+                col_export1, col_export2 = st.columns([3, 1])
+
+                with col_export1:
+                    company_name_input = st.text_input("Tên Khách hàng (tùy chọn):", value="KHÁCH HÀNG DOANH NGHIỆP", key="company_name_word")
+                    # Ô tên nằm trong fragment nên chỉ fragment chạy lại khi đổi tên; mục tin tức cảnh báo sớm
+                    # (ngoài fragment, đọc cùng khóa) cần chạy lại cả trang để không hiển thị tên cũ
+                    previous_name = st.session_state.get("_company_name_shown")
+                    st.session_state["_company_name_shown"] = company_name_input
+                    if previous_name is not None and previous_name != company_name_input:
+                        st.rerun()
 
-            with col_export2:
-                st.write("")  # Spacer
+                with col_export2:
+                    st.write("")  # Spacer
 
-            if st.button("📥 Xuất file Word", use_container_width=True, type="primary", key="export_word_btn"):
-                if not _WORD_OK:
-                    st.error("❌ Thiếu thư viện python-docx. Không thể xuất Word.")
-                else:
-                    try:
-                        with st.spinner("Đang tạo báo cáo Word..."):
-                            # Lấy AI analysis từ session_state nếu có
-                            ai_analysis_text = st.session_state.get('ai_analysis', '')
-
-                            # Tạo lại figures để export (không hiển thị)
-                            # Bar chart
-                            fig_bar_export, ax_bar_export = plt.subplots(figsize=(8, 10))
-                            fig_bar_export.patch.set_facecolor('#fff5f7')
-                            ax_bar_export.set_facecolor('#ffffff')
-
-                            indicators_export = ratios_display.index.tolist()
-                            values_export = ratios_display['Giá trị'].values
-                            bar_colors_export = plt.cm.RdPu(np.linspace(0.3, 0.9, len(indicators_export)))
-
-                            bars_export = ax_bar_export.barh(indicators_export, values_export, color=bar_colors_export, edgecolor='white', linewidth=1.5)
-
-                            for i, (bar, val) in enumerate(zip(bars_export, values_export)):
-                                width = bar.get_width()
-                                ax_bar_export.text(width, bar.get_y() + bar.get_height()/2,
-                                           f' {val:.3f}', ha='left', va='center',
-                                           fontsize=9, fontweight='600', color='#c2185b')
-
-                            ax_bar_export.set_xlabel('Giá trị', fontsize=12, fontweight='600', color='#4a5568')
-                            ax_bar_export.set_title('Các Chỉ số Tài chính', fontsize=14, fontweight='bold', color='#c2185b', pad=15)
-                            ax_bar_export.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color='#ff6b9d', axis='x')
-                            ax_bar_export.spines['top'].set_visible(False)
-                            ax_bar_export.spines['right'].set_visible(False)
-                            ax_bar_export.spines['left'].set_color('#d0d0d0')
-                            ax_bar_export.spines['bottom'].set_color('#d0d0d0')
-                            plt.tight_layout()
-
-                            # Radar chart
-                            fig_radar_export = plt.figure(figsize=(10, 10))
-                            fig_radar_export.patch.set_facecolor('#fff5f7')
-                            ax_radar_export = fig_radar_export.add_subplot(111, projection='polar')
-
-                            from sklearn.preprocessing import MinMaxScaler
-                            scaler_export = MinMaxScaler()
-                            normalized_values_export = scaler_export.fit_transform(values_export.reshape(-1, 1)).flatten()
-
-                            angles_export = np.linspace(0, 2 * np.pi, len(indicators_export), endpoint=False).tolist()
-                            normalized_values_list_export = normalized_values_export.tolist()
-
-                            angles_export += angles_export[:1]
-                            normalized_values_list_export += normalized_values_list_export[:1]
-
-                            ax_radar_export.plot(angles_export, normalized_values_list_export, 'o-', linewidth=2.5, color='#ff6b9d', label='Chỉ số')
-                            ax_radar_export.fill(angles_export, normalized_values_list_export, alpha=0.25, color='#ffb3c6')
-
-                            ax_radar_export.set_xticks(angles_export[:-1])
-                            short_labels_export = [label.split('(')[0].strip()[:20] for label in indicators_export]
-                            ax_radar_export.set_xticklabels(short_labels_export, size=8, color='#4a5568', fontweight='600')
-
-                            ax_radar_export.set_ylim(0, 1)
-                            ax_radar_export.set_title('Phân tích Đa chiều các Chỉ số\n(Normalized 0-1)',
-                                              fontsize=14, fontweight='bold', color='#c2185b', pad=20)
-                            ax_radar_export.grid(True, alpha=0.3, linestyle='--', linewidth=0.8, color='#ff6b9d')
-                            ax_radar_export.set_facecolor('#ffffff')
-                            plt.tight_layout()
-
-                            # Tạo PD label
-                            if pd.notna(probs) and pd.notna(preds):
-                                pd_label_text = "Default (Vỡ nợ)" if preds == 1 else "Non-Default (Không vỡ nợ)"
-                            else:
-                                pd_label_text = "N/A"
-
-                            # Generate Word
-                            word_buffer = generate_word_report(
-                                ratios_display=ratios_display,
-                                pd_value=probs if pd.notna(probs) else np.nan,
-                                pd_label=pd_label_text,
-                                ai_analysis=ai_analysis_text,
-                                fig_bar=fig_bar_export,
-                                fig_radar=fig_radar_export,
-                                company_name=company_name_input
+                if st.button("📥 Xuất file Word", use_container_width=True, type="primary", key="export_word_btn"):
+                    if not _WORD_OK:
+                        st.error("❌ Thiếu thư viện python-docx. Không thể xuất Word.")
+                    else:
+                        try:
+                            with st.spinner("Đang tạo báo cáo Word..."):
+                                # Lấy AI analysis từ session_state nếu có
+                                ai_analysis_text = st.session_state.get('ai_analysis', '')
+
+                                # Ảnh biểu đồ đã render ở mục 2 (trúng cache, không vẽ lại)
+                                png_bar_export = chart_image("ratio_bar", indicators, values, peer_values)
+                                png_radar_export = chart_image("ratio_radar", indicators, peer_values)
+
+                                # Tạo PD label
+                                if pd.notna(probs) and pd.notna(preds):
+                                    pd_label_text = "Default (Vỡ nợ)" if preds == 1 else "Non-Default (Không vỡ nợ)"
+                                else:
+                                    pd_label_text = "N/A"
+
+                                # Generate Word
+                                word_buffer = generate_word_report(
+                                    ratios_display=ratios_display,
+                                    pd_value=probs if pd.notna(probs) else np.nan,
+                                    pd_label=pd_label_text,
+                                    ai_analysis=ai_analysis_text,
+                                    fig_bar=png_bar_export,
+                                    fig_radar=png_radar_export,
+                                    company_name=company_name_input,
+                                    pd_calibrated=pd_cal,
+                                    rating_grade=grade,
+                                    peer_percentiles=peer_pct
+                                )
+
+                            # Đưa khách hàng vào watchlist theo dõi tin tức
+                            if company_name_input.strip() and company_name_input.strip() != "KHÁCH HÀNG DOANH NGHIỆP":
+                                try:
+                                    add_borrowers_to_watchlist([(company_name_input, pd_cal if pd.notna(pd_cal) else probs)])
+                                except Exception as e:
+                                    st.warning(f"Không thể thêm khách hàng vào danh sách theo dõi tin tức: {e}")
+
+                            st.success("✅ Báo cáo Word đã được tạo thành công!")
+
+                            # Download button
+                            st.download_button(
+                                label="💾 Tải xuống Báo cáo Word",
+                                data=word_buffer,
+                                file_name=f"BaoCao_TinDung_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx",
+                                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                use_container_width=True
                             )
 
-                            # Close figures
-                            plt.close(fig_bar_export)
-                            plt.close(fig_radar_export)
-
-                        st.success("✅ Báo cáo Word đã được tạo thành công!")
-
-                        # Download button
-                        st.download_button(
-                            label="💾 Tải xuống Báo cáo Word",
-                            data=word_buffer,
-                            file_name=f"BaoCao_TinDung_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx",
-                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                            use_container_width=True
-                        )
+                        except Exception as e:
+                            st.error(f"❌ Lỗi khi tạo Word: {str(e)}")
+                            st.exception(e)
 
-                    except Exception as e:
-                        st.error(f"❌ Lỗi khi tạo Word: {str(e)}")
-                        st.exception(e)
+        word_export_panel()
 
     else:
         st.info("Hãy tải **ho_so_dn.xlsx** (đủ 3 sheet) để tính X1…X14, dự báo PD và phân tích AI.")
 
+    # ===== CHẤM ĐIỂM HÀNG LOẠT TỪ BÁO CÁO DẠNG DÀI =====
+    with st.expander("🏭 Chấm điểm hàng loạt từ báo cáo tài chính dạng dài (CSV/Parquet)"):
+        st.caption("Mỗi dòng một khoản mục: **firm_id, year, sheet, line_item, value** (tùy chọn **firm_name**). "
+                   "sheet là CDKT/BCTN/LCTT (hoặc BS/IS/CF); line_item theo tên chỉ tiêu như trong hồ sơ Excel. "
+                   + ("Danh mục được chấm ở tiến trình nền bằng mô hình đang dùng trên trang này; có thể theo dõi "
+                      "ở trang **⚙️ Công việc nền**." if model_job is not None
+                      else "Không có tiến trình xử lý job nền: danh mục được chấm ngay trên trang này."))
+        up_long = st.file_uploader("Tải báo cáo dạng dài", type=["csv", "parquet"], key="long_statements")
+        portfolio = None
+        if up_long is not None and model_job is None:
+            # Mô hình được huấn luyện ngay trên trang (không có worker): chấm điểm luôn trên trang
+            try:
+                with st.spinner("Đang tính chỉ số và chấm điểm toàn bộ danh mục..."):
+                    long_ratios = long_statements_to_ratios(read_long_statements(up_long))
+                    portfolio = score_portfolio(
+                        long_ratios, model, pd_calibrator, MODEL_COLS,
+                        similar_index=get_similar_borrower_index(dataset_key, df, model[:-1], tuple(MODEL_COLS))
+                    )
+            except Exception as e:
+                st.error(f"❌ Không chấm điểm được file dạng dài: {e}")
+            else:
+                portfolio_summary_values = portfolio_summary(portfolio)
+                portfolio_csv = portfolio.to_csv().encode("utf-8-sig")
+                portfolio_ts = datetime.now()
+        elif up_long is not None:
+            # Mỗi file tải lên gửi một job chấm điểm (mã job giữ trong phiên theo file_id)
+            score_jobs = st.session_state.setdefault("long_score_jobs", {})
+            if up_long.file_id not in score_jobs:
+                score_jobs[up_long.file_id] = submit_job(
+                    "score", {"streaming": streaming_train, "model_job": model_job["id"]}, job_owner(),
+                    files=[(up_long.name, up_long.getvalue())], title=f"Chấm điểm {up_long.name}"
+                )
+            score_job = get_job(score_jobs[up_long.file_id])
+            if score_job is None:
+                score_jobs.pop(up_long.file_id)
+                st.warning("Kết quả chấm điểm đã bị dọn; hãy tải lại file.")
+            elif score_job["status"] in JOB_ACTIVE_STATUSES:
+                job_wait_panel(score_job["id"])
+            elif score_job["status"] != "done":
+                st.error(f"❌ Không chấm điểm được file dạng dài: {score_job['message'] or JOB_STATUS_LABELS[score_job['status']]}")
+            else:
+                portfolio_path = os.path.join(job_dir(score_job["id"], "output"), "ChamDiem_HangLoat.csv")
+                portfolio = pd.read_csv(portfolio_path, index_col="firm_id", encoding="utf-8-sig")
+                portfolio_summary_values = score_job["result"]
+                with open(portfolio_path, "rb") as f:
+                    portfolio_csv = f.read()
+                portfolio_ts = datetime.fromtimestamp(score_job["finished_ts"])
+        if portfolio is not None:
+            grade_counts = portfolio["Hạng"].value_counts().reindex(_PD_GRADES, fill_value=0)
+            for col_metric, (label, value) in zip(st.columns(len(portfolio_summary_values)), portfolio_summary_values.items()):
+                col_metric.metric(label, value)
+            st.bar_chart(grade_counts)
+            no_prev = int((~portfolio["has_prev_year"]).sum())
+            if no_prev:
+                st.caption(f"⚠️ {no_prev:,} doanh nghiệp thiếu số liệu năm liền trước (has_prev_year = False): "
+                           "các bình quân dùng số cuối kỳ.")
+            st.dataframe(
+                portfolio.style.format({"PD thô": "{:.2%}", "PD hiệu chỉnh": "{:.2%}", "Tỷ lệ vỡ nợ nhóm tương tự": "{:.0%}"}),
+                use_container_width=True
+            )
+            st.download_button(
+                "💾 Tải kết quả chấm điểm (CSV)",
+                data=portfolio_csv,
+                file_name=f"ChamDiem_HangLoat_{portfolio_ts:%Y%m%d_%H%M%S}.csv",
+                mime="text/csv",
+                key="download_portfolio"
+            )
+            if "firm_name" in portfolio and st.button("📰 Đưa các doanh nghiệp vào danh sách theo dõi tin tức", key="watch_portfolio"):
+                added = add_borrowers_to_watchlist(zip(portfolio["firm_name"].dropna(), portfolio.loc[portfolio["firm_name"].notna(), "PD hiệu chỉnh"]))
+                st.success(f"✅ Đã thêm {added:,} doanh nghiệp mới vào danh sách theo dõi.")
+
     # Nút lên đầu trang
     st.markdown("""
         <div style='text-align: center; margin-top: 40px; margin-bottom: 20px;'>
@@ -1862,7 +5121,7 @@ with tab_predict:
 # ========================================
 # TAB: DASHBOARD TÀI CHÍNH DOANH NGHIỆP (GSO)
 # ========================================
-with tab_dashboard:
+if active_view == VIEW_DASHBOARD:
     st.header("📊 Dashboard Tài chính Doanh nghiệp Việt Nam")
     st.markdown("""
     Dashboard này hiển thị các xu hướng tài chính của doanh nghiệp Việt Nam theo quý,
@@ -1879,7 +5138,7 @@ with tab_dashboard:
         # Highlight tính năng mới
         st.success("""
         🆕 **TÍNH NĂNG MỚI**: Tự động lấy dữ liệu tài chính doanh nghiệp Việt Nam từ **Gemini AI**!
-        - ✅ Tự động cập nhật theo tháng (cache 30 ngày)
+        - ✅ Lưu trữ bền vững theo quý, chỉ lấy thêm các quý mới
         - ✅ Dữ liệu từ nguồn tin cậy (GSO, Bộ KH&ĐT)
         - ✅ Không cần tải file thủ công
         """)
@@ -1888,7 +5147,7 @@ with tab_dashboard:
             st.markdown("""
             **🚀 Tự động lấy từ Gemini AI (Khuyến nghị):**
             - Nhấn nút **"Bấm để tạo"** để tự động lấy dữ liệu mới nhất
-            - Dữ liệu được cache 30 ngày, tự động cập nhật mỗi tháng
+            - Dữ liệu được lưu bền vững theo quý, chỉ hỏi AI các quý mới chưa có trong kho
             - Nguồn dữ liệu: GSO, Bộ KH&ĐT, báo cáo kinh tế vĩ mô
 
             **📂 Tải lên dữ liệu GSO thủ công:**
@@ -1937,26 +5196,24 @@ with tab_dashboard:
     if uploaded_gso is not None:
         try:
             with st.spinner('Đang đọc dữ liệu từ file...'):
-                if uploaded_gso.name.endswith('.csv'):
-                    gso_data = pd.read_csv(uploaded_gso)
-                else:
-                    gso_data = pd.read_excel(uploaded_gso)
+                gso_data = read_gso_upload(uploaded_gso)
             st.success(f"✅ Đã tải thành công file: **{uploaded_gso.name}**")
         except Exception as e:
             st.error(f"❌ Lỗi khi đọc file: {e}")
 
     # Hoặc lấy dữ liệu tự động từ Gemini AI
     elif use_ai_data:
-        if not _GEMINI_OK:
+        if not (_GEMINI_OK or _OPENAI_OK):
             st.error("❌ Thiếu thư viện google-genai. Vui lòng cài đặt: pip install google-genai")
         else:
             api_key = st.secrets.get("GEMINI_API_KEY")
-            if api_key:
+            openai_api_key = st.secrets.get("OPENAI_API_KEY")
+            if api_key or openai_api_key:
                 with st.spinner('🤖 Đang lấy dữ liệu tài chính từ Gemini AI... (có thể mất 10-20 giây)'):
-                    gso_data = get_financial_data_from_ai(api_key)
+                    gso_data = get_financial_data_from_ai(api_key, openai_api_key)
                     if gso_data is not None and not gso_data.empty:
                         st.success("✅ Đã lấy thành công dữ liệu tài chính doanh nghiệp Việt Nam từ Gemini AI!")
-                        st.info("💡 **Dữ liệu được cache 30 ngày** - Sẽ tự động cập nhật vào tháng sau")
+                        st.info("💡 **Dữ liệu được lưu bền vững theo quý** - Chỉ cập nhật thêm khi có quý mới")
                     else:
                         st.warning("⚠️ Không thể lấy dữ liệu từ AI. Vui lòng thử lại hoặc sử dụng dữ liệu mẫu.")
             else:
@@ -2020,77 +5277,20 @@ with tab_dashboard:
         if missing_cols:
             st.warning(f"⚠️ File dữ liệu thiếu các cột: {', '.join(missing_cols)}. Vui lòng đảm bảo file có đủ các cột yêu cầu.")
         else:
+            # Bản sao dạng cột (cache) dùng chung cho cả 3 biểu đồ
+            gso_columns = gso_columnar(gso_data)
+
             # Biểu đồ 1: Xu hướng Doanh thu theo quý
             st.markdown("#### 💰 Xu hướng Doanh thu theo Quý")
-            fig1, ax1 = plt.subplots(figsize=(14, 6))
-            fig1.patch.set_facecolor('#fff5f7')
-            ax1.set_facecolor('#ffffff')
-
-            # Vẽ đường xu hướng doanh thu
-            ax1.plot(gso_data['Quý'], gso_data['Doanh thu (tỷ VNĐ)'],
-                    marker='o', linewidth=3, markersize=8, color='#ff6b9d',
-                    label='Doanh thu', linestyle='-', alpha=0.9)
-
-            # Fill area under curve
-            ax1.fill_between(gso_data['Quý'], gso_data['Doanh thu (tỷ VNĐ)'],
-                            alpha=0.2, color='#ffb3c6')
-
-            # Styling
-            ax1.set_xlabel('Quý', fontsize=13, fontweight='600', color='#4a5568')
-            ax1.set_ylabel('Doanh thu (tỷ VNĐ)', fontsize=13, fontweight='600', color='#4a5568')
-            ax1.set_title('Xu hướng Doanh thu Doanh nghiệp Việt Nam theo Quý',
-                         fontsize=16, fontweight='bold', color='#c2185b', pad=20)
-            ax1.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color='#ff6b9d')
-            ax1.legend(fontsize=11, frameon=True, shadow=True)
-
-            # Xoay labels trục x
-            plt.xticks(rotation=45, ha='right')
-
-            # Remove top and right spines
-            ax1.spines['top'].set_visible(False)
-            ax1.spines['right'].set_visible(False)
-            ax1.spines['left'].set_color('#d0d0d0')
-            ax1.spines['bottom'].set_color('#d0d0d0')
-
-            plt.tight_layout()
-            st.pyplot(fig1)
-            plt.close(fig1)
+            with perf_span("charts_dashboard"):
+                st.plotly_chart(build_revenue_trend_figure(gso_columns), use_container_width=True)
 
             st.divider()
 
             # Biểu đồ 2: So sánh Doanh thu và Tổng tài sản
             st.markdown("#### 🏢 So sánh Doanh thu và Tổng Tài sản")
-            fig2, ax2 = plt.subplots(figsize=(14, 6))
-            fig2.patch.set_facecolor('#fff5f7')
-            ax2.set_facecolor('#ffffff')
-
-            # Vẽ 2 đường xu hướng
-            ax2.plot(gso_data['Quý'], gso_data['Doanh thu (tỷ VNĐ)'],
-                    marker='o', linewidth=2.5, markersize=7, color='#ff6b9d',
-                    label='Doanh thu', linestyle='-', alpha=0.9)
-
-            ax2.plot(gso_data['Quý'], gso_data['Tổng tài sản (tỷ VNĐ)'],
-                    marker='s', linewidth=2.5, markersize=7, color='#4a90e2',
-                    label='Tổng tài sản', linestyle='-', alpha=0.9)
-
-            # Styling
-            ax2.set_xlabel('Quý', fontsize=13, fontweight='600', color='#4a5568')
-            ax2.set_ylabel('Giá trị (tỷ VNĐ)', fontsize=13, fontweight='600', color='#4a5568')
-            ax2.set_title('So sánh Doanh thu và Tổng Tài sản theo Quý',
-                         fontsize=16, fontweight='bold', color='#c2185b', pad=20)
-            ax2.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color='#ff6b9d')
-            ax2.legend(fontsize=11, frameon=True, shadow=True, loc='upper left')
-
-            plt.xticks(rotation=45, ha='right')
-
-            ax2.spines['top'].set_visible(False)
-            ax2.spines['right'].set_visible(False)
-            ax2.spines['left'].set_color('#d0d0d0')
-            ax2.spines['bottom'].set_color('#d0d0d0')
-
-            plt.tight_layout()
-            st.pyplot(fig2)
-            plt.close(fig2)
+            with perf_span("charts_dashboard"):
+                st.plotly_chart(build_revenue_assets_figure(gso_columns), use_container_width=True)
 
             st.divider()
 
@@ -2110,50 +5310,11 @@ with tab_dashboard:
                 )
 
                 if selected_quarters:
-                    filtered_data = gso_data[gso_data['Quý'].isin(selected_quarters)]
-
-                    # Tạo biểu đồ cột nhóm
-                    fig3, ax3 = plt.subplots(figsize=(14, 7))
-                    fig3.patch.set_facecolor('#fff5f7')
-                    ax3.set_facecolor('#ffffff')
-
-                    # Số lượng quý và chỉ số
-                    n_quarters = len(selected_quarters)
-                    n_indicators = len(available_optional)
-
-                    # Vị trí các cột
-                    x = np.arange(n_quarters)
-                    width = 0.25  # Độ rộng mỗi cột
-
-                    # Màu sắc cho các chỉ số
-                    colors = ['#ff6b9d', '#4a90e2', '#50c878']
-
-                    # Vẽ các cột
-                    for i, col in enumerate(available_optional):
-                        offset = (i - n_indicators/2 + 0.5) * width
-                        ax3.bar(x + offset, filtered_data[col], width,
-                               label=col.replace(' (tỷ VNĐ)', ''),
-                               color=colors[i % len(colors)], alpha=0.8,
-                               edgecolor='white', linewidth=1.5)
-
-                    # Styling
-                    ax3.set_xlabel('Quý', fontsize=13, fontweight='600', color='#4a5568')
-                    ax3.set_ylabel('Giá trị (tỷ VNĐ)', fontsize=13, fontweight='600', color='#4a5568')
-                    ax3.set_title('So sánh các Chỉ số Tài chính theo Quý',
-                                 fontsize=16, fontweight='bold', color='#c2185b', pad=20)
-                    ax3.set_xticks(x)
-                    ax3.set_xticklabels(selected_quarters, rotation=45, ha='right')
-                    ax3.legend(fontsize=11, frameon=True, shadow=True)
-                    ax3.grid(True, alpha=0.2, linestyle='--', linewidth=0.8, color='#ff6b9d', axis='y')
-
-                    ax3.spines['top'].set_visible(False)
-                    ax3.spines['right'].set_visible(False)
-                    ax3.spines['left'].set_color('#d0d0d0')
-                    ax3.spines['bottom'].set_color('#d0d0d0')
-
-                    plt.tight_layout()
-                    st.pyplot(fig3)
-                    plt.close(fig3)
+                    with perf_span("charts_dashboard"):
+                        st.plotly_chart(
+                            build_indicator_bar_figure(gso_columns, available_optional, selected_quarters),
+                            use_container_width=True
+                        )
 
             st.divider()
 
@@ -2261,7 +5422,7 @@ with tab_dashboard:
 # ========================================
 # TAB: TIN TỨC TÀI CHÍNH
 # ========================================
-with tab_news:
+if active_view == VIEW_NEWS:
     st.header("📰 Tin tức Tài chính")
     st.markdown("""
     Tin tức tài chính mới nhất từ các nguồn uy tín tại Việt Nam.
@@ -2273,163 +5434,92 @@ with tab_news:
     if not _FEEDPARSER_OK:
         st.error("⚠️ **Thiếu thư viện feedparser**. Vui lòng cài đặt: `pip install feedparser python-dateutil`")
     else:
-        # Định nghĩa các nguồn RSS
-        rss_sources = {
-            "📊 CafeF": "https://cafef.vn/thi-truong-chung-khoan.rss",
-            "💼 Vietstock": "https://vietstock.vn/rss/tai-chinh.rss",
-            "💰 Báo Đầu tư": "https://baodautu.vn/rss/kinh-doanh.rss",
-            "🏢 VNExpress Kinh doanh": "https://vnexpress.net/rss/kinh-doanh.rss"
-        }
+        # Các nguồn RSS (cũng được bộ làm ấm cache làm mới nền)
+        rss_sources = RSS_SOURCES
 
         # Hiển thị thời gian cập nhật
         col_update, col_cache = st.columns([3, 1])
         with col_update:
             st.caption(f"🕐 Cập nhật: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
         with col_cache:
-            st.caption("♻️ Cache: 120 phút")
+            st.caption(f"♻️ Cache: 120 phút · làm mới nền ~{CACHE_WARM_INTERVAL_S / 60:.0f} phút" if CACHE_WARMER_ENABLED else "♻️ Cache: 120 phút")
 
         st.divider()
 
-        # Tạo layout 2 cột
+        # Tạo layout 2 cột: nguồn 1 & 3 bên trái, nguồn 2 & 4 bên phải
         col1, col2 = st.columns(2)
 
         sources_list = list(rss_sources.items())
+        news_slots = {}
+        for col, indices in ((col1, (0, 2)), (col2, (1, 3))):
+            with col:
+                for pos, idx in enumerate(indices):
+                    if pos > 0:
+                        st.markdown("<br>", unsafe_allow_html=True)
+                    source_name, source_url = sources_list[idx]
+                    with st.container(border=True):
+                        st.markdown(f"### {source_name}")
+                        news_slots[source_name] = st.empty()
+                        news_slots[source_name].caption("⏳ Đang tải tin...")
+
+        # Tải song song, nguồn nào về trước hiển thị trước
+        for source_name, articles in iter_rss_feeds(rss_sources):
+            news_slots[source_name].markdown(_render_news_articles(articles), unsafe_allow_html=True)
 
-        # Hiển thị nguồn tin 1 và 2 ở cột trái
-        with col1:
-            # Nguồn 1: CafeF
-            source_name, source_url = sources_list[0]
-            with st.container(border=True):
-                st.markdown(f"### {source_name}")
-                articles = fetch_rss_feed(source_url, source_name)
-
-                for i, article in enumerate(articles):
-                    st.markdown(f"""
-                    <div style='
-                        padding: 10px;
-                        margin: 8px 0;
-                        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-                        border-radius: 8px;
-                        border-left: 4px solid #667eea;
-                    '>
-                        <div style='font-size: 14px; font-weight: 600; color: #2c3e50; margin-bottom: 5px;'>
-                            📌 {article['title']}
-                        </div>
-                        <div style='font-size: 12px; color: #7f8c8d; margin-bottom: 8px;'>
-                            🕐 {article['published']}
-                        </div>
-                        <a href='{article['link']}' target='_blank' style='
-                            color: #667eea;
-                            text-decoration: none;
-                            font-size: 12px;
-                            font-weight: 600;
-                        '>
-                            🔗 Đọc chi tiết →
-                        </a>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-            st.markdown("<br>", unsafe_allow_html=True)
-
-            # Nguồn 3: Báo Đầu tư
-            source_name, source_url = sources_list[2]
-            with st.container(border=True):
-                st.markdown(f"### {source_name}")
-                articles = fetch_rss_feed(source_url, source_name)
-
-                for i, article in enumerate(articles):
-                    st.markdown(f"""
-                    <div style='
-                        padding: 10px;
-                        margin: 8px 0;
-                        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-                        border-radius: 8px;
-                        border-left: 4px solid #667eea;
-                    '>
-                        <div style='font-size: 14px; font-weight: 600; color: #2c3e50; margin-bottom: 5px;'>
-                            📌 {article['title']}
-                        </div>
-                        <div style='font-size: 12px; color: #7f8c8d; margin-bottom: 8px;'>
-                            🕐 {article['published']}
-                        </div>
-                        <a href='{article['link']}' target='_blank' style='
-                            color: #667eea;
-                            text-decoration: none;
-                            font-size: 12px;
-                            font-weight: 600;
-                        '>
-                            🔗 Đọc chi tiết →
-                        </a>
-                    </div>
-                    """, unsafe_allow_html=True)
-
-        # Hiển thị nguồn tin 2 và 4 ở cột phải
-        with col2:
-            # Nguồn 2: Vietstock
-            source_name, source_url = sources_list[1]
-            with st.container(border=True):
-                st.markdown(f"### {source_name}")
-                articles = fetch_rss_feed(source_url, source_name)
-
-                for i, article in enumerate(articles):
-                    st.markdown(f"""
-                    <div style='
-                        padding: 10px;
-                        margin: 8px 0;
-                        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-                        border-radius: 8px;
-                        border-left: 4px solid #667eea;
-                    '>
-                        <div style='font-size: 14px; font-weight: 600; color: #2c3e50; margin-bottom: 5px;'>
-                            📌 {article['title']}
-                        </div>
-                        <div style='font-size: 12px; color: #7f8c8d; margin-bottom: 8px;'>
-                            🕐 {article['published']}
-                        </div>
-                        <a href='{article['link']}' target='_blank' style='
-                            color: #667eea;
-                            text-decoration: none;
-                            font-size: 12px;
-                            font-weight: 600;
-                        '>
-                            🔗 Đọc chi tiết →
-                        </a>
-                    </div>
-                    """, unsafe_allow_html=True)
+        st.divider()
 
-            st.markdown("<br>", unsafe_allow_html=True)
+        # Cảnh báo sớm: khách hàng trong watchlist xuất hiện trên tin tức
+        st.markdown("### 🚨 Cảnh báo sớm - Khách hàng xuất hiện trên Tin tức")
+        with st.container(border=True):
+            try:
+                early_warnings = borrower_news_mentions(limit=100)
+                if early_warnings.empty:
+                    st.info("💡 Chưa có khách hàng nào trong danh sách theo dõi xuất hiện trên tin tức. Khách hàng được thêm vào danh sách khi xuất báo cáo Word.")
+                else:
+                    st.dataframe(
+                        early_warnings.style.format({"PD": "{:.2%}"}, na_rep="N/A"),
+                        use_container_width=True,
+                        hide_index=True,
+                        column_config={"Link": st.column_config.LinkColumn("Link", display_text="🔗 Mở")}
+                    )
+            except Exception as e:
+                st.error(f"❌ Lỗi khi đọc cảnh báo sớm: {e}")
 
-            # Nguồn 4: VNExpress
-            source_name, source_url = sources_list[3]
-            with st.container(border=True):
-                st.markdown(f"### {source_name}")
-                articles = fetch_rss_feed(source_url, source_name)
+        st.divider()
 
-                for i, article in enumerate(articles):
-                    st.markdown(f"""
-                    <div style='
-                        padding: 10px;
-                        margin: 8px 0;
-                        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-                        border-radius: 8px;
-                        border-left: 4px solid #667eea;
-                    '>
-                        <div style='font-size: 14px; font-weight: 600; color: #2c3e50; margin-bottom: 5px;'>
-                            📌 {article['title']}
-                        </div>
-                        <div style='font-size: 12px; color: #7f8c8d; margin-bottom: 8px;'>
-                            🕐 {article['published']}
-                        </div>
-                        <a href='{article['link']}' target='_blank' style='
-                            color: #667eea;
-                            text-decoration: none;
-                            font-size: 12px;
-                            font-weight: 600;
-                        '>
-                            🔗 Đọc chi tiết →
-                        </a>
-                    </div>
-                    """, unsafe_allow_html=True)
+        # Kho tin tức cục bộ: tra cứu các bài cũ mà không cần tải lại RSS
+        st.markdown("### 🗄️ Kho Tin tức & Tra cứu")
+        with st.container(border=True):
+            try:
+                st.caption(f"📚 Kho hiện có **{news_archive_count():,}** bài viết (khử trùng theo đường dẫn bài).")
+                col_kw, col_dates = st.columns([2, 1])
+                with col_kw:
+                    news_keywords = st.text_input(
+                        "🔍 Từ khóa (tiêu đề & tóm tắt, không phân biệt dấu):",
+                        placeholder="VD: Hoà Phát, trái phiếu, tăng vốn...",
+                        key="news_search_keywords"
+                    )
+                with col_dates:
+                    today = pd.Timestamp.now(tz=NEWS_TZ).date()
+                    news_dates = st.date_input(
+                        "📅 Khoảng ngày:",
+                        value=(today - pd.Timedelta(days=30), today),
+                        key="news_search_dates"
+                    )
+                # Khi mới chọn ngày bắt đầu, date_input trả về tuple 1 phần tử
+                news_dates = tuple(news_dates) if isinstance(news_dates, (list, tuple)) else (news_dates, news_dates)
+                date_from = news_dates[0] if len(news_dates) > 0 else None
+                date_to = news_dates[1] if len(news_dates) > 1 else None
+                news_results = search_news_archive(news_keywords, date_from, date_to)
+                st.caption(f"Tìm thấy **{len(news_results)}** bài.")
+                st.dataframe(
+                    news_results,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config={"Link": st.column_config.LinkColumn("Link", display_text="🔗 Mở")}
+                )
+            except Exception as e:
+                st.error(f"❌ Lỗi khi tra cứu kho tin tức: {e}")
 
     # Nút lên đầu trang
     st.markdown("""
@@ -2456,7 +5546,7 @@ with tab_news:
 # ========================================
 # TAB: NHÓM TÁC GIẢ
 # ========================================
-with tab_authors:
+if active_view == VIEW_AUTHORS:
     # Header với hiệu ứng gradient
     st.markdown("""
         <div style='text-align: center; padding: 30px; background: linear-gradient(135deg, #fbc2eb 0%, #a6c1ee 100%); border-radius: 15px; margin-bottom: 30px; box-shadow: 0 10px 30px rgba(102, 126, 234, 0.3);'>
@@ -2625,6 +5715,143 @@ with tab_authors:
         </div>
     """, unsafe_allow_html=True)
 
+# ========================================
+# TAB: CÔNG VIỆC NỀN (HUẤN LUYỆN, CHẤM ĐIỂM, WORD HÀNG LOẠT, MONTE CARLO)
+# ========================================
+if active_view == VIEW_JOBS:
+    st.header("⚙️ Công việc nền")
+    st.caption("Tác vụ nặng chạy ở tiến trình worker riêng nên trang không bị treo: gửi job, theo dõi tiến độ "
+               "và tải kết quả khi xong. Job gắn với đường dẫn trang hiện tại (tham số **?jobs=**): tải lại "
+               "trang hay mở lại đường dẫn này vẫn thấy job đã gửi.")
+    owner = job_owner()
+
+    with st.expander("➕ Gửi công việc mới", expanded=True):
+        job_kind = st.selectbox("Loại công việc", options=list(JOB_KIND_LABELS), format_func=JOB_KIND_LABELS.get,
+                                key="job_kind")
+        if job_kind in ("score", "word_bulk"):
+            st.caption("Dùng mô hình huấn luyện trên dữ liệu mặc định của máy chủ, theo chế độ "
+                       f"**{'dạng luồng' if streaming_train else 'batch'}** đang chọn ở sidebar.")
+        score_jobs = list_jobs(owner, kind="score", status="done") if job_kind == "monte_carlo" else []
+        with st.form("job_submit_form", clear_on_submit=True):
+            job_files, job_params, job_title = [], {"streaming": streaming_train}, None
+            if job_kind == "train":
+                up_job = st.file_uploader("CSV huấn luyện (bỏ trống: dữ liệu mặc định của máy chủ)", type=["csv"])
+                job_params["streaming"] = st.toggle("🌊 Huấn luyện dạng luồng", value=streaming_train)
+            elif job_kind == "score":
+                up_job = st.file_uploader("Báo cáo dạng dài (firm_id, year, sheet, line_item, value)", type=["csv", "parquet"])
+            elif job_kind == "word_bulk":
+                up_job = st.file_uploader("Các hồ sơ **ho_so_dn.xlsx** (đủ 3 sheet)", type=["xlsx"], accept_multiple_files=True)
+            else:
+                source_options = [job["id"] for job in score_jobs] + ["upload"]
+                mc_source = st.selectbox(
+                    "Danh mục", options=source_options,
+                    format_func=lambda v: ("📤 Tải CSV danh mục (cột PD, tùy chọn LGD/EAD)" if v == "upload"
+                                           else f"Kết quả chấm điểm {v}")
+                )
+                up_job = st.file_uploader("CSV danh mục (khi chọn tải lên)", type=["csv"])
+                col_mc1, col_mc2, col_mc3 = st.columns(3)
+                job_params["scenarios"] = col_mc1.number_input("Số kịch bản", min_value=1000, max_value=MC_MAX_SCENARIOS,
+                                                               value=MC_DEFAULT_SCENARIOS, step=1000)
+                job_params["rho"] = col_mc2.slider("Tương quan tài sản ρ", 0.01, 0.5, MC_DEFAULT_RHO, 0.01)
+                job_params["lgd"] = col_mc3.slider("LGD mặc định", 0.05, 1.0, MC_DEFAULT_LGD, 0.05,
+                                                   help="Dùng khi danh mục không có cột LGD; thiếu cột EAD thì mỗi khoản vay EAD = 1.")
+            submitted_job = st.form_submit_button("🚀 Gửi vào hàng đợi", type="primary")
+
+        if submitted_job:
+            try:
+                if job_kind == "train":
+                    # Cùng khóa với trang dự báo: mô hình xong được trang đó dùng luôn
+                    job_params["model_key"] = training_model_key(up_job, job_params["streaming"])
+                    if up_job is not None:
+                        job_files = [("train.csv", up_job.getvalue())]
+                        job_title = f"Huấn luyện trên {up_job.name}"
+                elif job_kind == "score":
+                    if up_job is None:
+                        raise ValueError("Hãy tải file báo cáo dạng dài.")
+                    job_files = [(up_job.name, up_job.getvalue())]
+                    job_title = f"Chấm điểm {up_job.name}"
+                elif job_kind == "word_bulk":
+                    if not up_job:
+                        raise ValueError("Hãy tải ít nhất một hồ sơ Excel.")
+                    job_files = [(f"{i:04d}_{f.name}", f.getvalue()) for i, f in enumerate(up_job)]
+                    job_title = f"Word hàng loạt ({len(up_job)} hồ sơ)"
+                elif job_kind == "monte_carlo":
+                    if mc_source == "upload":
+                        if up_job is None:
+                            raise ValueError("Hãy tải CSV danh mục hoặc chọn một kết quả chấm điểm.")
+                        job_files = [(up_job.name, up_job.getvalue())]
+                        job_title = f"Monte Carlo {up_job.name}"
+                    else:
+                        job_params["source_job"] = mc_source
+                        job_title = f"Monte Carlo kết quả {mc_source}"
+                    job_params["scenarios"] = int(job_params["scenarios"])
+                new_job = submit_job(job_kind, job_params, owner, files=job_files, title=job_title)
+            except Exception as e:
+                st.error(f"❌ Không gửi được công việc: {e}")
+            else:
+                st.success(f"✅ Đã đưa vào hàng đợi: `{new_job}`")
+
+    # Phiên mở lại sau khi máy chủ khởi động lại: còn job chờ thì bật worker
+    own_jobs = list_jobs(owner)
+    jobs_active = any(job["status"] in JOB_ACTIVE_STATUSES for job in own_jobs)
+    if any(job["status"] == "queued" for job in own_jobs):
+        ensure_job_worker()
+
+    # Chỉ tự làm mới (fragment run_every) khi còn job chưa xong; hết thì chạy lại cả trang để tắt polling
+    @st.fragment(run_every=JOB_POLL_S if jobs_active else None)
+    def job_list_panel():
+        jobs = list_jobs(owner)
+        if jobs_active and not any(job["status"] in JOB_ACTIVE_STATUSES for job in jobs):
+            st.rerun()
+        if not jobs:
+            st.info("Chưa có công việc nào. Gửi công việc mới ở trên.")
+            return
+        for job in jobs:
+            with st.container(border=True):
+                col_job, col_cancel = st.columns([5, 1])
+                with col_job:
+                    st.markdown(f"**{job['title']}** · {JOB_STATUS_LABELS[job['status']]}")
+                    timing = f"gửi lúc {datetime.fromtimestamp(job['created_ts']):%d/%m %H:%M:%S}"
+                    if job["started_ts"]:
+                        end_ts = job["finished_ts"] or time.time()
+                        timing += f" · chạy {end_ts - job['started_ts']:.0f} giây"
+                    st.caption(f"{JOB_KIND_LABELS[job['kind']]} · mã `{job['id']}` · {timing}")
+                with col_cancel:
+                    if job["status"] in JOB_ACTIVE_STATUSES and not job["cancel_requested"]:
+                        if st.button("🛑 Hủy", key=f"cancel_job_{job['id']}", use_container_width=True):
+                            cancel_job(job["id"], owner)
+                            st.rerun(scope="fragment")
+
+                if job["status"] in JOB_ACTIVE_STATUSES:
+                    st.progress(job["progress"], text=job["message"] or JOB_STATUS_LABELS[job["status"]])
+                elif job["status"] == "failed":
+                    st.error(f"❌ {job['message'] or 'Công việc bị lỗi'}")
+                    if job["error"]:
+                        with st.expander("Chi tiết lỗi"):
+                            st.code(job["error"])
+                elif job["status"] == "done" and job["result"]:
+                    st.markdown(" · ".join(f"{key}: **{value}**" for key, value in job["result"].items()))
+
+    job_list_panel()
+
+    # Tải kết quả ngoài fragment tự làm mới: file chỉ được đọc khi chạy lại cả trang, cho một job được chọn
+    done_jobs = {job["id"]: job for job in own_jobs if job["status"] == "done"}
+    if done_jobs:
+        st.subheader("📥 Tải kết quả")
+        download_id = st.selectbox("Công việc", options=list(done_jobs), key="download_job",
+                                   format_func=lambda job_id: f"{done_jobs[job_id]['title']} · {job_id}")
+        download_job = done_jobs[download_id]
+        outputs = job_output_files(download_job["id"])
+        for col_download, path in zip(st.columns(max(len(outputs), 1)), outputs):
+            with col_download, open(path, "rb") as f:
+                st.download_button(
+                    f"💾 {os.path.basename(path)}", data=f.read(), file_name=os.path.basename(path),
+                    key=f"download_job_{download_job['id']}_{os.path.basename(path)}", use_container_width=True
+                )
+        if download_job["kind"] == "train":
+            st.caption("Trang **Sử dụng mô hình dự báo** và **Xây dựng mô hình** tự dùng mô hình này khi chọn "
+                       "cùng dữ liệu huấn luyện và cùng chế độ batch/luồng.")
+
 # ========================================
 # PREMIUM BANKING FOOTER
 # ========================================
@@ -2682,3 +5909,11 @@ st.markdown(f"""
     </p>
 </div>
 """, unsafe_allow_html=True)
+
+# ========================================
+# ĐO HIỆU NĂNG: THỜI GIAN TOÀN TRANG, TRANG QUẢN TRỊ, LOG JSON
+# ========================================
+perf_record(f"rerun:{active_view}", time.perf_counter() - rerun_t0)
+if is_admin_request():
+    render_perf_panel()
+get_perf_registry().maybe_flush()
@@ -0,0 +1,328 @@
+"""
+Benchmark các đường nóng của ED.py trên tải sinh ngẫu nhiên từ 1 đến 100k doanh nghiệp.
+
+    python benchmarks/bench_hot_paths.py                                  # mọi case, kích thước mặc định
+    python benchmarks/bench_hot_paths.py --cases model_fit,model_predict --sizes 1000,100000
+    python benchmarks/bench_hot_paths.py --save-baseline truoc-thay-doi   # lưu benchmarks/results/<tên>.json
+    python benchmarks/bench_hot_paths.py --compare truoc-thay-doi         # so với baseline, exit 1 nếu chậm đi
+
+Hai loại case:
+- theo doanh nghiệp (ratios_workbook, word_report, charts): mỗi lượt gọi xử lý một doanh nghiệp; kích thước n
+  là n lượt gọi, giới hạn bởi --max-calls (thông lượng vẫn tính theo số lượt thực chạy).
+- theo lô (ratios_long, model_fit, calibrate, model_predict, score_portfolio): một lượt gọi xử lý cả n
+  doanh nghiệp, lặp lại --repeat lần.
+
+Mỗi case báo: thông lượng (doanh nghiệp/giây), độ trễ p50/p95/p99 mỗi lượt gọi, bộ nhớ đỉnh Python
+(tracemalloc, đo trong một lượt riêng để không làm sai số thời gian) và RSS đỉnh của tiến trình.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import synth
+import workloads
+from workloads import MODEL_COLS, load_ed
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_SIZES = (1, 10, 100, 1_000, 10_000, 100_000)
+DEFAULT_MAX_CALLS = 100     # Số lượt gọi tối đa cho case theo doanh nghiệp
+DEFAULT_REPEAT = 5          # Số lần lặp cho case theo lô
+DISTINCT_WORKBOOKS = 20     # Số workbook khác nhau sinh sẵn, dùng xoay vòng
+MIN_FIT_ROWS = 50           # Fit/hiệu chỉnh cần đủ dòng cho 5-fold phân tầng
+REGRESSION_TOLERANCE = 0.20  # Chậm hơn baseline quá 20% (p50) thì báo
+
+
+# =========================
+# CHUẨN BỊ DỮ LIỆU (KHÔNG TÍNH VÀO THỜI GIAN ĐO)
+# =========================
+
+class Fixtures:
+    """Dữ liệu và mô hình dùng chung giữa các case, sinh lười theo kích thước."""
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.ed = load_ed()
+        self._cache = {}
+
+    def _memo(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    def workbooks(self) -> list:
+        def build():
+            items = workloads.statement_items(DISTINCT_WORKBOOKS, self.seed)
+            return [workloads.workbook_bytes(items, i) for i in range(DISTINCT_WORKBOOKS)]
+        return self._memo("workbooks", build)
+
+    def long_statements(self, n: int) -> pd.DataFrame:
+        return self._memo(("long", n), lambda: workloads.long_statements(n, self.seed))
+
+    def long_ratios(self, n: int) -> pd.DataFrame:
+        return self._memo(("long_ratios", n), lambda: self.ed.long_statements_to_ratios(self.long_statements(n)))
+
+    def ratios(self, n: int) -> pd.DataFrame:
+        """n dòng X_1..X_14 + default sinh từ copula của DATASET (luôn đủ hai lớp khi n >= 2)."""
+        def build():
+            frame = synth.synthetic_rows(n, self.seed)
+            if n >= 2 and frame["default"].nunique() < 2:
+                frame.loc[0, "default"] = 1 - frame.loc[0, "default"]
+            return frame
+        return self._memo(("ratios", n), build)
+
+    def model(self):
+        """Mô hình + bộ hiệu chỉnh fit trên DATASET.csv (như mô hình batch của ứng dụng)."""
+        def build():
+            frame = pd.read_csv(workloads.DATASET_PATH, encoding="latin-1")
+            X, y = frame[MODEL_COLS].astype(np.float64), frame["default"].astype(int)
+            return self.ed.make_pd_model().fit(X, y), self.ed.fit_pd_calibrator(X, y), frame
+        return self._memo("model", build)
+
+    def similar_index(self):
+        def build():
+            model, _, frame = self.model()
+            return self.ed.SimilarBorrowerIndex(frame, model[:-1], MODEL_COLS)
+        return self._memo("similar", build)
+
+    def report_inputs(self) -> dict:
+        """Đầu vào generate_word_report cho một doanh nghiệp (như nút xuất Word trên trang dự báo)."""
+        def build():
+            ratios = self.ed.compute_ratios_from_three_sheets(BytesIO(self.workbooks()[0]))
+            display = ratios[self.ed.COMPUTED_COLS].T.rename(columns={0: "Giá trị"})
+            return {"ratios_display": display, "ai_analysis": "Phân tích mẫu. " * 200}
+        return self._memo("report", build)
+
+
+# =========================
+# CÁC CASE: TRẢ VỀ HÀM GỌI MỘT LƯỢT (ĐÃ CHUẨN BỊ DỮ LIỆU)
+# =========================
+
+def case_ratios_workbook(fx: Fixtures, n: int):
+    workbooks = fx.workbooks()
+    counter = iter(range(10**12))
+    return lambda: fx.ed.compute_ratios_from_three_sheets(BytesIO(workbooks[next(counter) % len(workbooks)]))
+
+
+def case_ratios_long(fx: Fixtures, n: int):
+    long_df = fx.long_statements(n)
+    return lambda: fx.ed.long_statements_to_ratios(long_df)
+
+
+def case_model_fit(fx: Fixtures, n: int):
+    if n < MIN_FIT_ROWS:
+        return None
+    frame = fx.ratios(n)
+    X, y = frame[MODEL_COLS].astype(np.float64), frame["default"].astype(int)
+    return lambda: fx.ed.make_pd_model().fit(X, y)
+
+
+def case_calibrate(fx: Fixtures, n: int):
+    if n < MIN_FIT_ROWS:
+        return None
+    frame = fx.ratios(n)
+    X, y = frame[MODEL_COLS].astype(np.float64), frame["default"].astype(int)
+    return lambda: fx.ed.fit_pd_calibrator(X, y)
+
+
+def case_model_predict(fx: Fixtures, n: int):
+    model, calibrator, _ = fx.model()
+    frame = fx.ratios(n)
+    return lambda: fx.ed.rate_pd(model, calibrator, frame, MODEL_COLS)
+
+
+def case_score_portfolio(fx: Fixtures, n: int):
+    model, calibrator, _ = fx.model()
+    ratios = fx.long_ratios(n)
+    similar = fx.similar_index()
+    return lambda: fx.ed.score_portfolio(ratios, model, calibrator, MODEL_COLS, similar_index=similar)
+
+
+def _chart_args(fx: Fixtures) -> dict:
+    """Đầu vào biểu đồ cột/radar của trang dự báo (giá trị chỉ số + phân vị so với tổng thể huấn luyện)."""
+    def build():
+        display = fx.report_inputs()["ratios_display"]
+        _, _, frame = fx.model()
+        ratios = pd.DataFrame([display["Giá trị"].to_numpy()], columns=MODEL_COLS)
+        pct = fx.ed.PeerBenchmark(frame, MODEL_COLS).percentiles(ratios).iloc[0].to_numpy(dtype=float)
+        return {"ratio_bar": (display.index.tolist(), display["Giá trị"].to_numpy(dtype=float), pct),
+                "ratio_radar": (display.index.tolist(), pct)}
+    return fx._memo("chart_args", build)
+
+
+def case_charts(fx: Fixtures, n: int):
+    """Dựng và render PNG biểu đồ cột + radar (không qua cache render_chart_png, đo đúng chi phí vẽ)."""
+    args = _chart_args(fx)
+    return lambda: [fx.ed.chart_png(kind, *a) for kind, a in args.items()]
+
+
+def case_word_report(fx: Fixtures, n: int):
+    inputs = fx.report_inputs()
+    args = _chart_args(fx)
+    png_bar, png_radar = (fx.ed.chart_png(kind, *a) for kind, a in args.items())
+    return lambda: fx.ed.generate_word_report(
+        inputs["ratios_display"], 0.0123, "Non-Default", inputs["ai_analysis"], png_bar, png_radar,
+        company_name="CÔNG TY BENCHMARK", pd_calibrated=0.0081, rating_grade="BB",
+        peer_percentiles=pd.Series(args["ratio_radar"][1], index=inputs["ratios_display"].index),
+    )
+
+
+# tên -> (hàm tạo case, theo doanh nghiệp?)
+CASES = {
+    "ratios_workbook": (case_ratios_workbook, True),
+    "ratios_long": (case_ratios_long, False),
+    "model_fit": (case_model_fit, False),
+    "calibrate": (case_calibrate, False),
+    "model_predict": (case_model_predict, False),
+    "score_portfolio": (case_score_portfolio, False),
+    "charts": (case_charts, True),
+    "word_report": (case_word_report, True),
+}
+
+
+# =========================
+# ĐO
+# =========================
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(fx: Fixtures, name: str, n: int, max_calls: int, repeat: int):
+    build, per_firm = CASES[name]
+    call = build(fx, n)
+    if call is None:
+        return None
+    calls = min(n, max_calls) if per_firm else repeat
+    call()  # Khởi động: import lười, JIT của thư viện, cache hệ thống file
+
+    gc.collect()
+    latencies = np.empty(calls)
+    start = time.perf_counter()
+    for i in range(calls):
+        t0 = time.perf_counter()
+        call()
+        latencies[i] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    getattr(call, "cleanup", lambda: None)()
+
+    firms = calls if per_firm else calls * n
+    ms = latencies * 1000.0
+    return {
+        "case": name,
+        "n": n,
+        "calls": calls,
+        "throughput_per_s": firms / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "peak_py_mb": peak / (1024 * 1024),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run(cases, sizes, max_calls, repeat, seed) -> dict:
+    fx = Fixtures(seed)
+    results = []
+    for name in cases:
+        for n in sizes:
+            row = measure(fx, name, n, max_calls, repeat)
+            if row is None:
+                print(f"  {name:<16} n={n:<7} bỏ qua (cần ít nhất {MIN_FIT_ROWS} dòng)", flush=True)
+                continue
+            results.append(row)
+            print(f"  {name:<16} n={n:<7} {row['throughput_per_s']:>12,.1f} DN/s  "
+                  f"p50 {row['p50_ms']:>10.2f} ms  p95 {row['p95_ms']:>10.2f} ms  "
+                  f"đỉnh {row['peak_py_mb']:>8.1f} MB", flush=True)
+    import sklearn
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": workloads.git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+            "seed": seed,
+            "max_calls": max_calls,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> pd.DataFrame:
+    """Bảng so sánh p50 và thông lượng với baseline theo (case, n); cột regression = chậm hơn quá tolerance."""
+    key = ["case", "n"]
+    cur = pd.DataFrame(current["results"]).set_index(key)
+    base = pd.DataFrame(baseline["results"]).set_index(key)
+    joined = cur[["p50_ms", "throughput_per_s", "peak_py_mb"]].join(
+        base[["p50_ms", "throughput_per_s", "peak_py_mb"]], rsuffix="_baseline", how="inner")
+    joined["p50_ratio"] = joined["p50_ms"] / joined["p50_ms_baseline"]
+    joined["regression"] = joined["p50_ratio"] > 1.0 + tolerance
+    return joined
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--cases", default=",".join(CASES), help="danh sách case, phân tách bằng dấu phẩy")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="số doanh nghiệp, vd. 1,100,10000")
+    parser.add_argument("--max-calls", type=int, default=DEFAULT_MAX_CALLS)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ghi kết quả JSON ra file này")
+    parser.add_argument("--save-baseline", metavar="TÊN", help=f"lưu kết quả thành baseline trong {RESULTS_DIR}")
+    parser.add_argument("--compare", metavar="TÊN", help="so sánh với baseline đã lưu")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error(f"case không tồn tại: {unknown}; có: {list(CASES)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    report = run(cases, sizes, args.max_calls, args.repeat, args.seed)
+    paths = [args.output] if args.output else []
+    if args.save_baseline:
+        paths.append(os.path.join(RESULTS_DIR, f"{args.save_baseline}.json"))
+    for path in paths:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi {path}")
+
+    if args.compare:
+        with open(os.path.join(RESULTS_DIR, f"{args.compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        table = compare(report, baseline, args.tolerance)
+        with pd.option_context("display.width", 160, "display.max_columns", 20):
+            print(table.round(3).to_string())
+        regressions = table[table["regression"]]
+        if not regressions.empty:
+            print(f"CHẬM HƠN baseline '{args.compare}' quá {args.tolerance:.0%}: "
+                  + ", ".join(f"{c} n={n}" for c, n in regressions.index))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
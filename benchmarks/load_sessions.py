@@ -0,0 +1,464 @@
+"""
+Kiểm thử tải nhiều phiên đồng thời cho ED.py, không cần trình duyệt.
+
+    python benchmarks/load_sessions.py                                   # 1, 2, 4, 8 phiên, mỗi phiên 2 lượt
+    python benchmarks/load_sessions.py --levels 1,8,16,32 --iterations 3 --llm-latency 3
+    python benchmarks/load_sessions.py --levels 4 --output benchmarks/results/tai_4_phien.json
+
+Mỗi phiên giả lập một cán bộ tín dụng đi hết luồng của trang Dự báo trên chính ED.py:
+  open          mở trang (chạy script lần đầu: đọc dữ liệu huấn luyện, lấy mô hình từ cache)
+  upload_score  tải ho_so_dn.xlsx (sinh bởi synth.py) -> tính X_1..X_14, chấm PD, vẽ biểu đồ
+  ai            bấm "Yêu cầu AI Phân tích" -> gọi LLM giả lập tương thích OpenAI chạy cục bộ
+  export        bấm "Xuất file Word" -> dựng lại biểu đồ và tạo báo cáo .docx
+
+Phiên chạy bằng streamlit.testing (AppTest): mỗi lần chạy lại script là một luồng riêng trong cùng tiến
+trình, giống `streamlit run` (cache_resource/cache_data, router AI, kho SQLite dùng chung giữa các phiên).
+Không đo phần WebSocket/protobuf gửi về trình duyệt. AppTest vốn viết cho kiểm thử tuần tự (gán
+Runtime/secrets/config toàn cục ở mỗi lần chạy); shared_apptest_runtime() giữ các trạng thái đó cố định
+trong suốt bài đo để các phiên chạy song song không giẫm lên nhau.
+
+Mỗi mức đồng thời báo: độ trễ p50/p95/p99/max từng bước, tỷ lệ lỗi, số luồng hoàn tất mỗi phút,
+RSS tiến trình (đầu / đỉnh / cuối) và số yêu cầu LLM đã phục vụ.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import streamlit.config
+import streamlit.logger
+
+import synth
+import workloads
+
+ED_SCRIPT = os.path.join(workloads.REPO_DIR, "ED.py")
+DEFAULT_LEVELS = (1, 2, 4, 8)
+DEFAULT_ITERATIONS = 2       # Số lượt đi hết luồng của mỗi phiên ở mỗi mức
+DEFAULT_LLM_LATENCY_S = 1.5  # Độ trễ trung bình của LLM giả lập
+DEFAULT_TIMEOUT_S = 300.0    # Giới hạn cho một lần chạy lại script
+DISTINCT_WORKBOOKS = 20      # Số hồ sơ khác nhau sinh sẵn, các phiên dùng xoay vòng
+RSS_SAMPLE_INTERVAL_S = 0.2
+STEPS = ("open", "upload_score", "ai", "export")
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# shared_apptest_runtime() vá thuộc tính nội bộ của streamlit.testing: đã kiểm tra trên bản này
+APPTEST_TESTED_STREAMLIT = "1.66"
+
+STUB_MARKER = "[LLM giả lập]"
+STUB_REPLY = (
+    f"{STUB_MARKER} (1) Khả năng sinh lời: biên lợi nhuận ổn định. (2) Thanh khoản: đủ chi trả nợ ngắn hạn. "
+    "(3) Cơ cấu nợ: đòn bẩy ở mức trung bình ngành. (4) Hiệu quả hoạt động: vòng quay tài sản cải thiện.\n\n"
+    "KHUYẾN NGHỊ: CHO VAY, kèm điều kiện duy trì hệ số thanh toán hiện hành trên 1,2."
+)
+
+
+# =========================
+# LLM GIẢ LẬP (TƯƠNG THÍCH OPENAI CHAT COMPLETIONS)
+# =========================
+
+class StubLLMServer:
+    """
+    Máy chủ HTTP cục bộ trả lời /v1/chat/completions sau độ trễ ngẫu nhiên (log-normal quanh latency_s),
+    trả lỗi 503 với xác suất error_rate. ED.py trỏ tới đây qua secret OPENAI_BASE_URL.
+    """
+
+    def __init__(self, latency_s: float = DEFAULT_LLM_LATENCY_S, error_rate: float = 0.0, seed: int = 0):
+        self.latency_s = latency_s
+        self.error_rate = error_rate
+        self.requests = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-llm", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _draw(self):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency_s * self._rng.lognormvariate(0.0, 0.25) if self.latency_s > 0 else 0.0
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.failures += 1
+        return delay, fail
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                delay, fail = stub._draw()
+                time.sleep(delay)
+                if fail:
+                    self._send(503, {"error": {"message": "LLM giả lập: lỗi được tiêm", "type": "server_error"}})
+                    return
+                self._send(200, {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "stub",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": STUB_REPLY}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                })
+
+            def _send(self, status: int, payload: dict):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# =========================
+# APPTEST CHẠY SONG SONG
+# =========================
+
+@contextlib.contextmanager
+def shared_apptest_runtime(secrets: dict):
+    """
+    Cố định các trạng thái toàn cục mà AppTest gán lại ở mỗi lần chạy, để nhiều phiên chạy song song:
+    - Runtime._instance: AppTest đặt về None khi một lần chạy kết thúc, làm hỏng các phiên đang chạy dở;
+    - st.secrets: AppTest tráo secrets toàn cục theo từng lần chạy; ở đây đặt một lần cho mọi phiên;
+    - config "global.appTest": AppTest vá config.get_option lồng nhau, không an toàn giữa các luồng;
+    - bytecode của ED.py: dùng chung một ScriptCache như máy chủ thật thay vì biên dịch lại mỗi lần chạy
+      (ast.parse song song giữa các luồng còn có thể lỗi "AST constructor recursion depth mismatch" trên 3.11).
+    """
+    import streamlit as st
+    try:
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+        from streamlit.runtime.secrets import Secrets
+        from streamlit.testing.v1 import app_test, local_script_runner
+        from streamlit.testing.v1.util import patch_config_options
+    except ImportError as e:
+        raise RuntimeError(_apptest_mismatch(st.__version__, str(e))) from e
+    missing = [f"{module.__name__}.{attr}" for module, attr in (
+        (app_test, "Runtime"), (app_test, "ScriptCache"), (app_test, "patch_config_options"),
+        (local_script_runner, "ScriptCache"), (Runtime, "_instance"),
+    ) if not hasattr(module, attr)]
+    if not hasattr(Secrets(), "_secrets"):
+        missing.append("Secrets._secrets")
+    if missing:
+        raise RuntimeError(_apptest_mismatch(st.__version__, "thiếu " + ", ".join(missing)))
+    if not st.__version__.startswith(APPTEST_TESTED_STREAMLIT + "."):
+        print(f"Cảnh báo: Streamlit {st.__version__} khác bản đã kiểm tra {APPTEST_TESTED_STREAMLIT}.x; "
+              "kết quả đo có thể sai nếu AppTest đổi cách gán trạng thái toàn cục.", file=sys.stderr, flush=True)
+
+    class KeepRuntime(type(Runtime)):
+        def __setattr__(cls, name, value):
+            if name == "_instance":
+                if value is not None:
+                    Runtime._instance = value
+                return
+            super().__setattr__(name, value)
+
+    class SharedRuntime(Runtime, metaclass=KeepRuntime):
+        pass
+
+    shared_scripts = ScriptCache()
+    saved = (app_test.Runtime, app_test.ScriptCache, local_script_runner.ScriptCache,
+             app_test.patch_config_options, st.secrets)
+    session_secrets = Secrets()
+    session_secrets._secrets = dict(secrets)
+    app_test.Runtime = SharedRuntime
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: shared_scripts
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+    st.secrets = session_secrets
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        (app_test.Runtime, app_test.ScriptCache, local_script_runner.ScriptCache,
+         app_test.patch_config_options, st.secrets) = saved
+        Runtime._instance = None
+
+
+def _apptest_mismatch(version: str, detail: str) -> str:
+    return (f"Streamlit {version} không còn các thuộc tính nội bộ mà kiểm thử tải cần ({detail}). "
+            f"Cài streamlit=={APPTEST_TESTED_STREAMLIT}.* hoặc cập nhật shared_apptest_runtime().")
+
+
+def _failure(at) -> str:
+    """Thông báo lỗi đầu tiên trên trang (exception hoặc st.error), rỗng nếu trang sạch."""
+    if len(at.exception):
+        return f"exception: {at.exception[0].value}"[:300]
+    if len(at.error):
+        return f"error: {at.error[0].value}"[:300]
+    return ""
+
+
+def _check_open(at) -> str:
+    ready = any(u.key == "ho_so_dn_main" for u in at.file_uploader)
+    return _failure(at) or ("" if ready else "không thấy ô tải hồ sơ (thiếu dữ liệu huấn luyện?)")
+
+
+def _check_upload(at) -> str:
+    problem = _failure(at)
+    if problem:
+        return problem
+    scored = any("(PD)" in m.label and m.value != "N/A" for m in at.metric)
+    return "" if scored else "không có kết quả PD"
+
+
+def _check_ai(at) -> str:
+    problem = _failure(at)
+    if problem:
+        return problem
+    text = at.session_state["ai_analysis"] if "ai_analysis" in at.session_state else ""
+    return "" if STUB_MARKER in (text or "") else f"phân tích AI không hợp lệ: {str(text)[:200]}"
+
+
+def _check_export(at) -> str:
+    problem = _failure(at)
+    if problem:
+        return problem
+    return "" if len(at.get("download_button")) else "không có nút tải báo cáo Word"
+
+
+def run_flow(workbook: tuple, timeout_s: float) -> list:
+    """Một lượt mở trang -> tải hồ sơ & chấm điểm -> AI -> xuất Word; trả danh sách (bước, giây, lỗi)."""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(ED_SCRIPT, default_timeout=timeout_s)
+    name, data = workbook
+    actions = (
+        ("open", lambda: at.run(), _check_open),
+        ("upload_score", lambda: at.file_uploader(key="ho_so_dn_main").set_value((name, data, XLSX_MIME)).run(),
+         _check_upload),
+        ("ai", lambda: at.button(key="analyze_ai_btn").click().run(), _check_ai),
+        ("export", lambda: at.button(key="export_word_btn").click().run(), _check_export),
+    )
+    records = []
+    for step, action, check in actions:
+        t0 = time.perf_counter()
+        try:
+            action()
+            error = check(at)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+        records.append((step, time.perf_counter() - t0, error))
+        if error:
+            break  # Các bước sau phụ thuộc bước trước: dừng lượt này
+    return records
+
+
+# =========================
+# ĐO
+# =========================
+
+def _rss_mb() -> float:
+    """RSS hiện tại (Linux: /proc/self/statm); nơi khác dùng RSS đỉnh."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class RSSSampler:
+    """Lấy mẫu RSS định kỳ trong một mức đồng thời để biết đỉnh bộ nhớ."""
+
+    def __init__(self, interval_s: float = RSS_SAMPLE_INTERVAL_S):
+        self.interval_s = interval_s
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(_rss_mb())
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append(_rss_mb())
+
+
+def make_workbooks(count: int, seed: int) -> list:
+    """count hồ sơ (tên file, bytes) sinh từ copula của synth.py."""
+    rows = synth.synthetic_rows(count, seed)
+    items = synth.statements_from_ratios(rows, seed)
+    return [(f"ho_so_dn_{i:03d}.xlsx", workloads.workbook_bytes(items, i, synth.WORKBOOK_YEARS)) for i in range(count)]
+
+
+def step_table(records: list) -> pd.DataFrame:
+    """Tổng hợp theo bước: số lượt, số lỗi, tỷ lệ lỗi, p50/p95/p99/max (ms, chỉ tính lượt thành công)."""
+    frame = pd.DataFrame(records, columns=["step", "seconds", "error"])
+    rows = []
+    for step in STEPS:
+        sub = frame[frame["step"] == step]
+        ok_ms = sub.loc[sub["error"] == "", "seconds"].to_numpy() * 1000.0
+        errors = int((sub["error"] != "").sum())
+
+        def pct(q):
+            return float(np.percentile(ok_ms, q)) if ok_ms.size else None
+
+        rows.append({
+            "step": step,
+            "count": int(len(sub)),
+            "errors": errors,
+            "error_rate": errors / len(sub) if len(sub) else None,
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "max_ms": float(ok_ms.max()) if ok_ms.size else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def run_level(sessions: int, iterations: int, workbooks: list, timeout_s: float, llm: StubLLMServer) -> dict:
+    llm_before = llm.requests
+    rss_start = _rss_mb()
+
+    def session(i: int) -> list:
+        records = []
+        for it in range(iterations):
+            records.extend(run_flow(workbooks[(i * iterations + it) % len(workbooks)], timeout_s))
+        return records
+
+    with RSSSampler() as sampler, ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="phien") as pool:
+        start = time.perf_counter()
+        per_session = list(pool.map(session, range(sessions)))
+        wall_s = time.perf_counter() - start
+
+    records = [r for recs in per_session for r in recs]
+    table = step_table(records)
+    flows_ok = sum(1 for step, _, error in records if step == STEPS[-1] and not error)
+    errors = sorted({error for _, _, error in records if error})
+    return {
+        "sessions": sessions,
+        "iterations": iterations,
+        "wall_s": wall_s,
+        "flows": sessions * iterations,
+        "flows_ok": flows_ok,
+        "flows_per_min": flows_ok / wall_s * 60.0,
+        "rss_start_mb": rss_start,
+        "rss_peak_mb": max(sampler.samples),
+        "rss_end_mb": sampler.samples[-1],
+        "llm_requests": llm.requests - llm_before,
+        "steps": table.to_dict(orient="records"),
+        "error_samples": errors[:10],
+    }
+
+
+def _print_level(result: dict):
+    print(f"\n== {result['sessions']} phiên x {result['iterations']} lượt: {result['wall_s']:.1f} s, "
+          f"{result['flows_ok']}/{result['flows']} luồng hoàn tất ({result['flows_per_min']:.1f}/phút), "
+          f"RSS {result['rss_start_mb']:.0f} -> đỉnh {result['rss_peak_mb']:.0f} -> {result['rss_end_mb']:.0f} MB, "
+          f"LLM {result['llm_requests']} yêu cầu", flush=True)
+    table = pd.DataFrame(result["steps"]).set_index("step")
+    with pd.option_context("display.width", 160, "display.max_columns", 20):
+        print(table.round(3).to_string(), flush=True)
+    for error in result["error_samples"]:
+        print(f"   lỗi: {error}", flush=True)
+
+
+def run(levels, iterations, timeout_s, llm_latency_s, llm_error_rate, seed, warmup: bool = True) -> dict:
+    workbooks = make_workbooks(DISTINCT_WORKBOOKS, seed)
+    results = []
+    with StubLLMServer(llm_latency_s, llm_error_rate, seed) as llm, \
+            shared_apptest_runtime({"OPENAI_API_KEY": "load-test", "OPENAI_BASE_URL": llm.base_url}):
+        if warmup:
+            # Một lượt khởi động: huấn luyện mô hình, nạp thư viện lười, làm ấm cache (không tính vào kết quả)
+            t0 = time.perf_counter()
+            warm = run_flow(workbooks[0], timeout_s)
+            print(f"Khởi động {time.perf_counter() - t0:.1f} s: "
+                  + ", ".join(f"{step} {secs:.2f}s" + (f" LỖI {error}" if error else "") for step, secs, error in warm),
+                  flush=True)
+        for sessions in levels:
+            result = run_level(sessions, iterations, workbooks, timeout_s, llm)
+            results.append(result)
+            _print_level(result)
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": workloads.git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "streamlit": streamlit.__version__,
+            "iterations": iterations,
+            "llm_latency_s": llm_latency_s,
+            "llm_error_rate": llm_error_rate,
+            "seed": seed,
+        },
+        "levels": results,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--levels", default=",".join(map(str, DEFAULT_LEVELS)), help="số phiên đồng thời, vd. 1,4,16")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="số lượt mỗi phiên ở mỗi mức")
+    parser.add_argument("--llm-latency", type=float, default=DEFAULT_LLM_LATENCY_S, help="độ trễ LLM giả lập (giây)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="tỷ lệ lỗi 503 của LLM giả lập")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT_S, help="giới hạn mỗi lần chạy lại script")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="thư mục ED_DATA_DIR (mặc định: thư mục tạm, không đụng kho thật)")
+    parser.add_argument("--no-warmup", action="store_true", help="đo cả lượt đầu (huấn luyện mô hình, cache lạnh)")
+    parser.add_argument("--output", help="ghi kết quả JSON ra file này")
+    args = parser.parse_args(argv)
+
+    levels = [int(s) for s in args.levels.split(",") if s.strip()]
+    # ED.py đọc các biến này khi script chạy: kho dữ liệu riêng, tắt luồng làm ấm RSS chạy nền;
+    # DATASET.csv mặc định đọc theo thư mục hiện tại như khi `streamlit run ED.py` tại thư mục repo
+    os.chdir(workloads.REPO_DIR)
+    os.environ["ED_DATA_DIR"] = args.data_dir or tempfile.mkdtemp(prefix="ed_load_")
+    os.environ.setdefault("ED_CACHE_WARMER", "0")
+    os.environ.setdefault("ED_JOB_AUTOSTART", "0")  # Không có worker: trang huấn luyện mô hình ngay trong tiến trình
+    # Ẩn cảnh báo của Streamlit khi chạy ngoài `streamlit run`: đọc config trước (lúc đọc config sẽ đặt lại
+    # mức log theo logger.level) rồi mới hạ mức log
+    streamlit.config.get_option("logger.level")
+    streamlit.logger.set_log_level(logging.ERROR)
+
+    report = run(levels, args.iterations, args.timeout, args.llm_latency, args.llm_error_rate, args.seed,
+                 warmup=not args.no_warmup)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Đã ghi {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
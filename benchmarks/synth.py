@@ -0,0 +1,240 @@
+"""
+Sinh dữ liệu khách hàng doanh nghiệp tổng hợp theo phân phối của DATASET.csv/DATASET1.csv.
+
+Mô hình: Gaussian copula trên phân phối thực nghiệm. Mỗi cột (X_1..X_14, default, LGD, EAD) giữ nguyên
+phân phối biên quan sát được (nội suy giữa các thống kê thứ tự; cột rời rạc như default lấy đúng tỷ lệ),
+còn phụ thuộc giữa các cột lấy từ ma trận tương quan của điểm chuẩn hóa theo hạng.
+
+    python benchmarks/synth.py csv --rows 5000000 --out /tmp/train_5m.csv        # CSV huấn luyện, ghi theo khối
+    python benchmarks/synth.py workbooks --count 200 --out-dir /tmp/ho_so          # ho_so_dn.xlsx + manifest.csv
+    python benchmarks/synth.py long --firms 100000 --out /tmp/bao_cao_dai.csv       # báo cáo dạng dài (chấm hàng loạt)
+    python benchmarks/synth.py check --rows 200000                                  # so phân phối mẫu với dữ liệu gốc
+
+Workbook sinh từ một dòng chỉ số: khớp X_1, X_2, X_5, X_7, X_8, X_9, X_10, X_11, X_13, X_14 (khi giá trị
+khả thi về kế toán); X_3, X_4, X_6, X_12 suy ra từ ràng buộc VCSH = TTS - NPT, GVHB = DTT - LNG nên chỉ
+xấp xỉ - 14 chỉ số của bộ dữ liệu không độc lập với nhau (vd. X_3 = X_2 · X_14 trên cùng một kỳ).
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+import workloads
+from workloads import MODEL_COLS, REPO_DIR
+
+SOURCE_PATHS = (os.path.join(REPO_DIR, "DATASET.csv"), os.path.join(REPO_DIR, "DATASET1.csv"))
+SYNTH_COLS = MODEL_COLS + ["default", "LGD", "EAD"]
+DISCRETE_COLS = ("default",)
+DEFAULT_CHUNK_ROWS = 100_000
+WORKBOOK_YEARS = (2023, 2024)
+
+
+# =========================
+# GAUSSIAN COPULA TRÊN PHÂN PHỐI THỰC NGHIỆM
+# =========================
+
+class GaussianCopula:
+    """Copula Gauss với biên thực nghiệm: fit trên bảng số, sinh bao nhiêu dòng cũng được."""
+
+    def fit(self, frame: pd.DataFrame, columns=SYNTH_COLS, discrete=DISCRETE_COLS):
+        data = frame[list(columns)].apply(pd.to_numeric, errors="coerce").dropna()
+        n = len(data)
+        if n < 2:
+            raise ValueError("Cần ít nhất 2 dòng đầy đủ để fit copula")
+        self.columns_ = list(columns)
+        self.discrete_ = [c in discrete for c in self.columns_]
+        self.sorted_ = [np.sort(data[c].to_numpy(dtype=np.float64)) for c in self.columns_]
+        # Điểm chuẩn hóa theo hạng (hạng trung bình cho giá trị trùng) -> tương quan của copula
+        ranks = data.rank(method="average").to_numpy()
+        scores = ndtri(ranks / (n + 1))
+        corr = np.corrcoef(scores, rowvar=False)
+        # Đảm bảo xác định dương (cột hằng hoặc sai số số học)
+        eigval, eigvec = np.linalg.eigh(np.nan_to_num(corr))
+        corr = eigvec @ np.diag(np.clip(eigval, 1e-8, None)) @ eigvec.T
+        d = np.sqrt(np.diag(corr))
+        self.corr_ = corr / np.outer(d, d)
+        self.chol_ = np.linalg.cholesky(self.corr_)
+        return self
+
+    def _inverse_marginal(self, j: int, u: np.ndarray) -> np.ndarray:
+        values = self.sorted_[j]
+        n = len(values)
+        if self.discrete_[j]:
+            return values[np.minimum((u * n).astype(np.int64), n - 1)]
+        pos = u * (n - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, n - 1)
+        return values[lo] + (pos - lo) * (values[hi] - values[lo])
+
+    def sample(self, n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+        z = rng.standard_normal((n_rows, len(self.columns_))) @ self.chol_.T
+        u = ndtr(z)
+        out = {c: self._inverse_marginal(j, u[:, j]) for j, c in enumerate(self.columns_)}
+        frame = pd.DataFrame(out)
+        for c, is_discrete in zip(self.columns_, self.discrete_):
+            if is_discrete:
+                frame[c] = frame[c].astype(np.int64)
+        return frame
+
+
+def fit_dataset_copula(paths=SOURCE_PATHS) -> GaussianCopula:
+    """Copula fit trên các file dữ liệu gốc (gộp, bỏ dòng trùng)."""
+    frames = [pd.read_csv(p, encoding="latin-1") for p in paths if os.path.exists(p)]
+    if not frames:
+        raise FileNotFoundError(f"Không tìm thấy dữ liệu gốc: {paths}")
+    return GaussianCopula().fit(pd.concat(frames, ignore_index=True).drop_duplicates())
+
+
+def iter_synthetic_rows(n_rows: int, chunk_rows: int = DEFAULT_CHUNK_ROWS, seed: int = 0, copula=None):
+    """Sinh n_rows dòng theo từng khối DataFrame (bộ nhớ chỉ phụ thuộc chunk_rows)."""
+    copula = copula or fit_dataset_copula()
+    n_chunks = -(-n_rows // chunk_rows)
+    for i, child in enumerate(np.random.SeedSequence(seed).spawn(n_chunks)):
+        size = min(chunk_rows, n_rows - i * chunk_rows)
+        yield copula.sample(size, np.random.default_rng(child))
+
+
+def synthetic_rows(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """n_rows dòng tổng hợp trong một DataFrame."""
+    return pd.concat(list(iter_synthetic_rows(n_rows, seed=seed)), ignore_index=True)
+
+
+# =========================
+# TỪ CHỈ SỐ VỀ BÁO CÁO TÀI CHÍNH 3 SHEET
+# =========================
+
+def statements_from_ratios(ratios: pd.DataFrame, seed: int = 0, years=WORKBOOK_YEARS) -> dict:
+    """
+    Khoản mục (dạng workloads.statement_items: mảng (n, số năm)) sao cho công thức X1..X14 của ED.py
+    cho lại các chỉ số của `ratios` ở năm cuối. Năm trước = năm cuối / hệ số tăng trưởng của từng doanh nghiệp;
+    các chỉ số dùng bình quân đầu-cuối kỳ (X_13, X_14) được quy đổi theo hệ số đó.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(ratios)
+    x = {c: ratios[c].to_numpy(dtype=np.float64) for c in MODEL_COLS}
+
+    tts = rng.lognormal(np.log(1000.0), 1.0, size=n)
+    growth = np.exp(rng.normal(0.08, 0.10, size=n))
+    avg = (1.0 + 1.0 / growth) / 2.0   # bình quân đầu-cuối kỳ = avg × cuối kỳ
+
+    dtt = np.maximum(x["X_14"], 1e-3) * tts * avg
+    lng = x["X_1"] * dtt
+    lntt = x["X_2"] * dtt
+    npt = x["X_5"] * tts
+    vcsh = tts - npt
+    nnh = npt * rng.uniform(0.4, 0.9, size=n)
+    tsnh = x["X_7"] * nnh
+    htk = np.maximum(tsnh - x["X_8"] * nnh, 0.0)
+    tien = x["X_11"] * vcsh
+    kpt = np.maximum(x["X_13"], 0.0) * dtt / 365.0 / avg
+
+    # X_9 = (LNTT + LV) / LV -> LV = LNTT / (X_9 - 1); không khả thi thì lấy 2-8% nợ phải trả
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lv = lntt / (x["X_9"] - 1.0)
+    fallback_lv = npt * rng.uniform(0.02, 0.08, size=n)
+    lv = np.where(np.isfinite(lv) & (lv > 0), lv, fallback_lv)
+    # X_10 = (EBIT + KH) / (LV + NDH): khấu hao 2-6% tổng tài sản, giải NDH; không khả thi thì giữ NDH
+    # 0-10% nợ phải trả và giải KH; vẫn không khả thi thì để cả hai theo tỷ lệ mặc định
+    ebit = lntt + lv
+    kh = tts * rng.uniform(0.02, 0.06, size=n)
+    fallback_ndh = npt * rng.uniform(0.0, 0.1, size=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndh = (ebit + kh) / x["X_10"] - lv
+    solved_ndh = np.isfinite(ndh) & (ndh >= 0)
+    kh_alt = x["X_10"] * (lv + fallback_ndh) - ebit
+    kh = np.where(solved_ndh | (kh_alt <= 0), kh, kh_alt)
+    ndh = np.where(solved_ndh, ndh, fallback_ndh)
+
+    cur = {
+        "DTT": dtt, "GVHB": -(dtt - lng), "LNG": lng, "LV": lv, "LNTT": lntt,
+        "TTS": tts, "NPT": npt, "VCSH": vcsh, "TSNH": tsnh, "NNH": nnh, "HTK": htk,
+        "Tien": tien, "KPT": kpt, "NDH": ndh, "KH": -kh,
+    }
+    # Cột theo năm: năm trước = năm cuối / tăng trưởng^(khoảng cách năm)
+    steps = np.arange(len(years) - 1, -1, -1)
+    scale = growth[:, None] ** -steps[None, :]
+    return {name: values[:, None] * scale for name, values in cur.items()}
+
+
+def write_workbooks(out_dir: str, count: int, seed: int = 0, copula=None) -> pd.DataFrame:
+    """count file ho_so_dn_XXXXXX.xlsx + manifest.csv (tên file, chỉ số đã lấy mẫu, default, LGD, EAD)."""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = synthetic_rows(count, seed) if copula is None else copula.sample(count, np.random.default_rng(seed))
+    items = statements_from_ratios(rows, seed)
+    files = []
+    for i in range(count):
+        name = f"ho_so_dn_{i:06d}.xlsx"
+        with open(os.path.join(out_dir, name), "wb") as f:
+            f.write(workloads.workbook_bytes(items, i, WORKBOOK_YEARS))
+        files.append(name)
+    manifest = rows.assign(file=files)[["file"] + SYNTH_COLS]
+    manifest.to_csv(os.path.join(out_dir, "manifest.csv"), index=False)
+    return manifest
+
+
+def write_csv(path: str, n_rows: int, chunk_rows: int = DEFAULT_CHUNK_ROWS, seed: int = 0) -> int:
+    """Ghi CSV huấn luyện (cùng cột với DATASET.csv) theo khối; trả về số dòng đã ghi."""
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for chunk in iter_synthetic_rows(n_rows, chunk_rows, seed):
+            chunk.to_csv(f, index=False, header=written == 0, float_format="%.9g")
+            written += len(chunk)
+    return written
+
+
+def compare_with_source(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Phân vị 5/50/95% và tương quan hạng: dữ liệu gốc so với mẫu tổng hợp."""
+    copula = fit_dataset_copula()
+    source = pd.concat([pd.read_csv(p, encoding="latin-1") for p in SOURCE_PATHS if os.path.exists(p)]).drop_duplicates()
+    sample = copula.sample(n_rows, np.random.default_rng(seed))
+    q = [0.05, 0.5, 0.95]
+    table = pd.concat({"gốc": source[SYNTH_COLS].quantile(q).T, "tổng hợp": sample[SYNTH_COLS].quantile(q).T}, axis=1)
+    table[("gốc", "mean")] = source[SYNTH_COLS].mean()
+    table[("tổng hợp", "mean")] = sample[SYNTH_COLS].mean()
+    corr_gap = (source[SYNTH_COLS].corr("spearman") - sample[SYNTH_COLS].corr("spearman")).abs()
+    table[("|Δ spearman|", "max")] = corr_gap.max()
+    return table.sort_index(axis=1)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_csv = sub.add_parser("csv", help="CSV huấn luyện X_1..X_14, default, LGD, EAD")
+    p_csv.add_argument("--rows", type=int, required=True)
+    p_csv.add_argument("--out", required=True)
+    p_csv.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    p_wb = sub.add_parser("workbooks", help="hồ sơ ho_so_dn.xlsx 3 sheet + manifest.csv")
+    p_wb.add_argument("--count", type=int, required=True)
+    p_wb.add_argument("--out-dir", required=True)
+    p_long = sub.add_parser("long", help="báo cáo dạng dài firm_id, year, sheet, line_item, value")
+    p_long.add_argument("--firms", type=int, required=True)
+    p_long.add_argument("--out", required=True)
+    p_check = sub.add_parser("check", help="so phân phối mẫu tổng hợp với dữ liệu gốc")
+    p_check.add_argument("--rows", type=int, default=100_000)
+    for p in (p_csv, p_wb, p_long, p_check):
+        p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "csv":
+        n = write_csv(args.out, args.rows, args.chunk_rows, args.seed)
+        print(f"Đã ghi {n:,} dòng vào {args.out}")
+    elif args.command == "workbooks":
+        manifest = write_workbooks(args.out_dir, args.count, args.seed)
+        print(f"Đã ghi {len(manifest):,} hồ sơ vào {args.out_dir} (manifest.csv)")
+    elif args.command == "long":
+        rows = synthetic_rows(args.firms, args.seed)
+        items = statements_from_ratios(rows, args.seed)
+        frame = workloads.long_statements(args.firms, years=WORKBOOK_YEARS, items=items)
+        frame.to_csv(args.out, index=False, float_format="%.2f")
+        print(f"Đã ghi {args.firms:,} doanh nghiệp ({len(frame):,} dòng) vào {args.out}")
+    else:
+        with pd.option_context("display.width", 200, "display.max_columns", 20):
+            print(compare_with_source(args.rows, args.seed).round(4).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
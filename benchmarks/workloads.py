@@ -0,0 +1,112 @@
+"""
+Tải công việc sinh ngẫu nhiên (tái lập theo seed) cho benchmark các đường nóng của ED.py:
+báo cáo tài chính 3 sheet theo từng doanh nghiệp và báo cáo dạng dài cho cả danh mục
+(bảng X_1..X_14 tổng hợp: xem synth.py).
+"""
+import os
+import subprocess
+import sys
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ed_headless import load_ed  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_PATH = os.path.join(REPO_DIR, "DATASET.csv")
+YEARS = (2022, 2023, 2024)
+MODEL_COLS = [f"X_{i}" for i in range(1, 15)]
+
+
+def git_commit() -> str:
+    """Commit đang đo (ghi vào file kết quả), rỗng nếu không có git."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def statement_labels() -> dict:
+    """Khoản mục (DTT, TTS, ...) -> (sheet, nhãn dòng) theo alias đầu tiên mà ED.py nhận diện."""
+    ed = load_ed()
+    return {name: (sheet, ed._SHEET_ALIASES[sheet][key][0]) for name, (sheet, key) in ed.RATIO_ITEMS.items()}
+
+
+def statement_items(n_firms: int, seed: int = 0, years=YEARS) -> dict:
+    """
+    Khoản mục báo cáo tài chính hợp lý về kế toán cho n_firms doanh nghiệp.
+
+    Returns:
+        dict khoản mục -> mảng (n_firms, len(years)), đơn vị triệu đồng; giá vốn và khấu hao mang dấu âm
+        như trên báo cáo gốc.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_firms, len(years))
+    growth = np.cumprod(1.0 + rng.normal(0.08, 0.10, size=shape), axis=1)
+    dtt = rng.lognormal(np.log(1000.0), 1.0, size=(n_firms, 1)) * growth
+
+    def frac(low, high):
+        return rng.uniform(low, high, size=shape)
+
+    tts = dtt * frac(0.5, 1.5)
+    npt = tts * frac(0.2, 0.8)
+    tsnh = tts * frac(0.3, 0.7)
+    lng = dtt * frac(0.05, 0.35)
+    lv = npt * frac(0.02, 0.08)
+    return {
+        "DTT": dtt,
+        "GVHB": -(dtt - lng),
+        "LNG": lng,
+        "LV": lv,
+        "LNTT": lng - dtt * frac(0.02, 0.15) - lv,
+        "TTS": tts,
+        "NPT": npt,
+        "VCSH": tts - npt,
+        "TSNH": tsnh,
+        "NNH": npt * frac(0.4, 0.9),
+        "HTK": tsnh * frac(0.1, 0.4),
+        "Tien": tsnh * frac(0.05, 0.3),
+        "KPT": tsnh * frac(0.1, 0.4),
+        "NDH": npt * frac(0.0, 0.1),
+        "KH": -tts * frac(0.02, 0.06),
+    }
+
+
+def workbook_bytes(items: dict, firm: int, years=YEARS) -> bytes:
+    """File ho_so_dn.xlsx (3 sheet CDKT/BCTN/LCTT, cột nhãn + một cột mỗi năm) của một doanh nghiệp."""
+    rows = {"CDKT": [], "BCTN": [], "LCTT": []}
+    for name, (sheet, label) in statement_labels().items():
+        rows[sheet].append([label, *np.round(items[name][firm], 2)])
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for sheet, sheet_rows in rows.items():
+            pd.DataFrame(sheet_rows, columns=["Chỉ tiêu", *years]).to_excel(writer, sheet_name=sheet, index=False)
+    return buffer.getvalue()
+
+
+def long_statements(n_firms: int, seed: int = 0, years=YEARS, items: dict = None) -> pd.DataFrame:
+    """
+    Báo cáo dạng dài (firm_id, firm_name, year, sheet, line_item, value) cho n_firms doanh nghiệp.
+    `items` (dạng statement_items) cho sẵn khoản mục, ví dụ sinh từ chỉ số tổng hợp (synth.py).
+    """
+    if items is None:
+        items = statement_items(n_firms, seed, years)
+    labels = statement_labels()
+    n_years = len(years)
+    firm_ids = np.array([f"DN{i:06d}" for i in range(n_firms)], dtype=object)
+    frames = []
+    for name, (sheet, label) in labels.items():
+        frames.append(pd.DataFrame({
+            "firm_id": np.repeat(firm_ids, n_years),
+            "year": np.tile(np.asarray(years), n_firms),
+            "sheet": sheet,
+            "line_item": label,
+            "value": items[name].ravel().round(2),
+        }))
+    frame = pd.concat(frames, ignore_index=True)
+    frame.insert(1, "firm_name", "Công ty " + frame["firm_id"])
+    return frame
+
@@ -0,0 +1,83 @@
+# =========================
+# NẠP ED.py KHÔNG CHẠY GIAO DIỆN (BENCHMARK, KIỂM THỬ TẢI, WORKER NỀN)
+# =========================
+"""
+ED.py vừa là script Streamlit vừa chứa toàn bộ hàm nghiệp vụ (tính chỉ số, mô hình PD, báo cáo Word...).
+Module này nạp phần nghiệp vụ mà không thực thi giao diện: chỉ giữ các câu lệnh import, định nghĩa
+hàm/lớp, hằng số và các phép gán đứng trước mục "UI & TRAIN MODEL".
+
+    from ed_headless import load_ed
+    ed = load_ed()
+    ratios = ed.compute_ratios_from_three_sheets("ho_so_dn.xlsx")
+
+Các hàm @st.cache_* vẫn hoạt động (bộ nhớ đệm trong tiến trình, không cần Streamlit runtime).
+"""
+import ast
+import logging
+import os
+import sys
+import threading
+import types
+
+ED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ED.py")
+ED_MODULE_NAME = "ed_app"        # Tên module của các lớp/hàm đã nạp (để pickle giữa các tiến trình)
+_UI_SECTION = "# UI & TRAIN MODEL"
+
+_LOAD_LOCK = threading.Lock()
+
+
+def _keep(node: ast.stmt, ui_line: int) -> bool:
+    if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+        return True
+    if isinstance(node, ast.Try):
+        # Khối try/except bao quanh import tùy chọn
+        return any(isinstance(stmt, (ast.Import, ast.ImportFrom)) for stmt in node.body)
+    if isinstance(node, (ast.Assign, ast.AnnAssign)):
+        if node.lineno < ui_line:
+            return True
+        targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+        names = [elt for t in targets for elt in (t.elts if isinstance(t, ast.Tuple) else [t])]
+        # Hằng số viết hoa khai báo trong phần giao diện (vd. VIEW_*, MODEL_COLS)
+        return all(isinstance(n, ast.Name) and n.id.lstrip("_").isupper() for n in names)
+    return False
+
+
+def load_ed(path: str = ED_PATH, quiet: bool = True) -> types.ModuleType:
+    """
+    Nạp phần nghiệp vụ của ED.py thành module `ed_app` (nạp một lần mỗi tiến trình).
+
+    Parameters:
+    - path: đường dẫn ED.py
+    - quiet: ẩn cảnh báo "No runtime found" của Streamlit khi chạy ngoài `streamlit run`
+
+    Raises:
+    - ValueError: ED.py không còn dòng mốc "# UI & TRAIN MODEL"
+    """
+    with _LOAD_LOCK:
+        module = sys.modules.get(ED_MODULE_NAME)
+        if module is not None:
+            return module
+        if quiet:
+            import streamlit.config
+            import streamlit.logger
+            # Đọc config trước: lần đọc config đầu tiên đặt lại mức log theo logger.level
+            streamlit.config.get_option("logger.level")
+            streamlit.logger.set_log_level(logging.ERROR)
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        tree = ast.parse(source, filename=path)
+        ui_line = next((i for i, line in enumerate(source.splitlines(), start=1) if line.startswith(_UI_SECTION)), None)
+        if ui_line is None:
+            # Không có mốc thì không tách được giao diện: thà báo lỗi còn hơn thực thi cả trang Streamlit
+            raise ValueError(f"{path}: không tìm thấy dòng mốc {_UI_SECTION!r} ngăn phần nghiệp vụ và giao diện")
+        body = [node for node in tree.body if _keep(node, ui_line)]
+
+        module = types.ModuleType(ED_MODULE_NAME)
+        module.__file__ = path
+        sys.modules[ED_MODULE_NAME] = module
+        try:
+            exec(compile(ast.Module(body=body, type_ignores=[]), path, "exec"), module.__dict__)
+        except BaseException:
+            del sys.modules[ED_MODULE_NAME]
+            raise
+        return module
@@ -0,0 +1,64 @@
+# =========================
+# THƯ VIỆN NẶNG: NẠP KHI DÙNG LẦN ĐẦU (DÙNG CHUNG CẢ TIẾN TRÌNH)
+# =========================
+"""
+Streamlit thực thi lại ED.py ở mỗi lần rerun nên mọi biến cấp module trong đó được tạo lại.
+Bảng thời gian nạp và các module nạp lười nằm ở module này: Python chỉ import nó một lần
+mỗi tiến trình, nên số liệu được ghi đúng một lần và không bị các lần rerun ghi đè.
+
+    from ed_imports import IMPORT_TIMINGS, has_module, lazy_module, record_startup
+    mpl = lazy_module("matplotlib")
+"""
+import importlib
+import importlib.util
+import threading
+import time
+
+STARTUP_KEY = "(khởi động)"
+
+IMPORT_TIMINGS = {}  # Tên module -> số giây nạp (báo cáo thời gian import)
+_IMPORT_LOCK = threading.Lock()
+_LAZY_MODULES = {}
+
+
+def has_module(name: str) -> bool:
+    """
+    Thư viện có cài đặt hay không, không thực thi module. Chỉ kiểm tra find_spec: thư viện cài
+    nhưng hỏng (thiếu phụ thuộc, lỗi khi import) vẫn trả về True và chỉ lộ lỗi ở lần dùng đầu tiên.
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class _LazyModule:
+    """Đại diện cho một module, import thật ở lần truy cập thuộc tính đầu tiên và ghi thời gian nạp."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with _IMPORT_LOCK:
+                if self._module is None:
+                    t0 = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    IMPORT_TIMINGS.setdefault(self._name, time.perf_counter() - t0)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+def lazy_module(name: str) -> _LazyModule:
+    """Một đại diện duy nhất cho mỗi module trong tiến trình (các lần rerun dùng lại)."""
+    with _IMPORT_LOCK:
+        return _LAZY_MODULES.setdefault(name, _LazyModule(name))
+
+
+def record_startup(seconds: float):
+    """Thời gian nạp phần khởi động: chỉ lần chạy đầu của tiến trình mới thực sự import thư viện."""
+    IMPORT_TIMINGS.setdefault(STARTUP_KEY, seconds)
@@ -0,0 +1,142 @@
+# =========================
+# WORKER CÔNG VIỆC NỀN CỦA ED.py (HÀNG ĐỢI SQLITE -> PROCESS POOL)
+# =========================
+"""
+Lấy job từ hàng đợi DATA_STORE_DIR/jobs.sqlite3 (do phiên Streamlit gửi qua submit_job) và chạy trong
+process pool, tối đa --workers job song song; tiến độ, trạng thái và file kết quả được ghi ngược lại để
+giao diện theo dõi. Mỗi thư mục dữ liệu chỉ có một worker (flock); worker thứ hai tự thoát.
+
+    python ed_jobs.py                     # chạy liên tục (dịch vụ riêng, đặt ED_JOB_AUTOSTART=0 cho Streamlit)
+    python ed_jobs.py --idle-exit 600     # thoát sau 10 phút rảnh (cách Streamlit tự khởi động worker)
+    python ed_jobs.py --once              # xử lý hết hàng đợi rồi thoát
+
+Worker phải chạy cùng thư mục làm việc và ED_DATA_DIR với Streamlit (dữ liệu huấn luyện mặc định
+TRAIN_CSV_PATH là đường dẫn tương đối).
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from ed_headless import load_ed
+
+LOCK_RETRIES = 5               # Phiên vừa kiểm tra worker cũng giữ khóa trong chốc lát: thử lại trước khi thoát
+LOCK_RETRY_DELAY_S = 0.2
+DEFAULT_POLL_S = 1.0
+
+
+def _run_job(job: dict) -> str:
+    # Tiến trình con (spawn) nạp ED một lần; mô hình cache_resource được dùng lại cho các job sau
+    return load_ed().run_job(job)
+
+
+def _make_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=load_ed)
+
+
+def _stop_pool(pool: ProcessPoolExecutor):
+    """
+    Dừng pool ngay, kể cả job đang chạy dở (job được trả lại hàng đợi bởi release_jobs). Tiến trình con
+    lấy qua multiprocessing.active_children(): worker không tạo tiến trình multiprocessing nào khác
+    ngoài pool nên không cần đọc thuộc tính riêng của ProcessPoolExecutor.
+    """
+    processes = multiprocessing.active_children()
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _log(message: str):
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+def serve(ed, workers: int, poll_s: float = DEFAULT_POLL_S, idle_exit_s: float = 0, once: bool = False) -> int:
+    """
+    Vòng lặp điều phối: nhận job khi pool còn chỗ, gia hạn lease cho job đang chạy, xếp lại job của
+    worker đã chết. Tiến trình con chết đột ngột (hết bộ nhớ...) thì pool được tạo lại và các job
+    của pool cũ được chạy lại cho tới JOB_MAX_ATTEMPTS lượt.
+    """
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    ed.prune_jobs()
+    pool = _make_pool(workers)
+    running = {}
+    idle_since = time.monotonic()
+    _log(f"Worker {worker_id} sẵn sàng ({workers} tiến trình, dữ liệu: {ed.DATA_STORE_DIR})")
+    try:
+        while True:
+            ed.requeue_stale_jobs()
+            while len(running) < workers:
+                job = ed.claim_job(worker_id)
+                if job is None:
+                    break
+                _log(f"Bắt đầu {job['kind']} {job['id']} (lượt {job['attempts']})")
+                running[pool.submit(_run_job, job)] = job
+
+            if running:
+                ed.heartbeat_jobs(job["id"] for job in running.values())
+                idle_since = time.monotonic()
+            elif once or (idle_exit_s and time.monotonic() - idle_since >= idle_exit_s):
+                return 0
+            else:
+                time.sleep(poll_s)
+                continue
+
+            done, _ = wait(running, timeout=poll_s, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                job = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    _log(f"Kết thúc {job['id']}: {future.result()}")
+                    continue
+                broken.append(job)
+                _log(f"Tiến trình con dừng bất thường khi chạy {job['id']}: {error!r}")
+            if broken:
+                # Pool hỏng làm mọi job đang chạy cùng lỗi, không biết job nào gây ra: job đã hết lượt thử
+                # thì đánh dấu lỗi, còn lại xếp lại hàng đợi (tính lượt vừa chạy) trên pool mới
+                broken += running.values()
+                running.clear()
+                exhausted = [job for job in broken if job["attempts"] >= ed.JOB_MAX_ATTEMPTS]
+                for job in exhausted:
+                    ed.finish_job(job["id"], "failed", error="Tiến trình worker dừng bất thường, đã hết lượt chạy lại",
+                                  message="Tiến trình worker dừng bất thường")
+                ed.release_jobs([job["id"] for job in broken if job not in exhausted], count_attempt=True)
+                _stop_pool(pool)
+                pool = _make_pool(workers)
+    finally:
+        if running:
+            ed.release_jobs([job["id"] for job in running.values()])
+        _stop_pool(pool)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Worker công việc nền của ED.py")
+    parser.add_argument("--workers", type=int, default=None, help="Số job chạy song song (mặc định ED_JOB_WORKERS)")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_S, help="Chu kỳ kiểm tra hàng đợi (giây)")
+    parser.add_argument("--idle-exit", type=float, default=0, help="Thoát sau số giây không có job (0 = chạy mãi)")
+    parser.add_argument("--once", action="store_true", help="Xử lý hết hàng đợi rồi thoát")
+    args = parser.parse_args(argv)
+
+    ed = load_ed()
+    # SIGTERM (dừng dịch vụ) đi qua cùng đường với Ctrl+C: job đang chạy được trả lại hàng đợi
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    flights = ed.get_single_flight()
+    for attempt in range(LOCK_RETRIES):
+        with flights.hold(ed._JOB_WORKER_LOCK, blocking=False) as acquired:
+            if acquired:
+                try:
+                    return serve(ed, args.workers or ed.JOB_WORKERS, args.poll, args.idle_exit, args.once)
+                except KeyboardInterrupt:
+                    return 0
+        time.sleep(LOCK_RETRY_DELAY_S)
+    _log("Đã có worker khác đang chạy cho thư mục dữ liệu này, thoát.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
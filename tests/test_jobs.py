@@ -0,0 +1,156 @@
+"""
+Hàng đợi công việc nền (jobs.sqlite3) và mô phỏng Monte Carlo của ED.py, nạp qua ed_headless
+trên một ED_DATA_DIR tạm (không đụng kho thật, không tự khởi động ed_jobs.py).
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import time
+from contextlib import closing
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ed_headless import load_ed  # noqa: E402
+
+OWNER = "0123456789abcdef"
+WORKER = "test-worker"
+
+
+@pytest.fixture(scope="module")
+def ed(tmp_path_factory):
+    if "ed_app" not in sys.modules:
+        os.environ["ED_DATA_DIR"] = str(tmp_path_factory.mktemp("ed_store"))
+        os.environ["ED_JOB_AUTOSTART"] = "0"
+        os.environ["ED_CACHE_WARMER"] = "0"
+    module = load_ed()
+    if module.JOB_AUTOSTART:
+        pytest.skip("ED đã được nạp với ED_JOB_AUTOSTART bật trong tiến trình này")
+    return module
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(ed, monkeypatch):
+    with closing(ed._store_connect(ed.JOBS_DB_PATH)) as conn, conn:
+        ed._ensure_jobs_schema(conn)
+        conn.execute("DELETE FROM jobs")
+    # Job thử: báo tiến độ (điểm kiểm tra hủy) rồi trả kết quả
+    monkeypatch.setitem(ed.JOB_HANDLERS, "noop", lambda ctx: ctx.progress(0.5, force=True) or {"ok": "1"})
+
+
+def _submit(ed, **params) -> str:
+    return ed.submit_job("noop", params, OWNER, title="Job thử")
+
+
+def _expire_lease(ed, job_id: str):
+    with closing(ed._store_connect(ed.JOBS_DB_PATH)) as conn, conn:
+        conn.execute("UPDATE jobs SET heartbeat_ts = ? WHERE id = ?", (time.time() - ed.JOB_LEASE_S - 1, job_id))
+
+
+def test_claim_takes_oldest_queued_job_once(ed):
+    first, second = _submit(ed), _submit(ed)
+
+    claimed = ed.claim_job(WORKER)
+    assert claimed["id"] == first
+    assert claimed["status"] == "running" and claimed["attempts"] == 1 and claimed["worker"] == WORKER
+    assert ed.claim_job(WORKER)["id"] == second
+    assert ed.claim_job(WORKER) is None
+
+
+def test_expired_lease_requeues_until_attempts_run_out(ed):
+    job_id = _submit(ed)
+    ed.claim_job(WORKER)
+    _expire_lease(ed, job_id)
+
+    assert ed.requeue_stale_jobs() == 1
+    assert ed.get_job(job_id)["status"] == "queued"
+
+    assert ed.claim_job(WORKER)["attempts"] == ed.JOB_MAX_ATTEMPTS
+    _expire_lease(ed, job_id)
+    ed.requeue_stale_jobs()
+    job = ed.get_job(job_id)
+    assert job["status"] == "failed" and job["finished_ts"] is not None
+
+
+def test_release_gives_back_the_attempt(ed):
+    job_id = _submit(ed)
+    ed.claim_job(WORKER)
+
+    ed.release_jobs([job_id])
+    job = ed.get_job(job_id)
+    assert job["status"] == "queued" and job["attempts"] == 0 and job["worker"] is None
+
+    ed.claim_job(WORKER)
+    ed.release_jobs([job_id], count_attempt=True)
+    assert ed.get_job(job_id)["attempts"] == 1
+
+
+def test_cancel_queued_job(ed):
+    job_id = _submit(ed)
+
+    assert ed.cancel_job(job_id, OWNER)
+    assert ed.get_job(job_id)["status"] == "cancelled"
+    assert ed.claim_job(WORKER) is None
+
+
+def test_cancel_checks_owner(ed):
+    job_id = _submit(ed)
+
+    assert not ed.cancel_job(job_id, "fedcba9876543210")
+    assert ed.get_job(job_id)["status"] == "queued"
+
+
+def test_cancel_running_job_stops_at_next_progress_report(ed):
+    job_id = _submit(ed)
+    job = ed.claim_job(WORKER)
+
+    assert ed.cancel_job(job_id, OWNER)
+    assert ed.get_job(job_id)["cancel_requested"] == 1
+    assert ed.run_job(job) == "cancelled"
+    assert ed.get_job(job_id)["status"] == "cancelled"
+
+
+def test_release_finishes_cancelled_running_job(ed):
+    job_id = _submit(ed)
+    ed.claim_job(WORKER)
+    ed.cancel_job(job_id, OWNER)
+
+    ed.release_jobs([job_id])
+    assert ed.get_job(job_id)["status"] == "cancelled"
+
+
+def test_run_job_records_result(ed):
+    job_id = _submit(ed)
+
+    assert ed.run_job(ed.claim_job(WORKER)) == "done"
+    job = ed.get_job(job_id)
+    assert job["status"] == "done" and job["progress"] == 1 and job["result"] == {"ok": "1"}
+
+
+def test_prune_removes_only_old_finished_jobs(ed):
+    old, recent, queued = _submit(ed), _submit(ed), _submit(ed)
+    for job_id in (old, recent):
+        ed.claim_job(WORKER)
+        ed.finish_job(job_id, "done", result={})
+    with closing(ed._store_connect(ed.JOBS_DB_PATH)) as conn, conn:
+        conn.execute("UPDATE jobs SET finished_ts = ? WHERE id = ?",
+                     (time.time() - (ed.JOB_RETENTION_DAYS + 1) * 86400, old))
+
+    assert ed.prune_jobs() == 1
+    assert ed.get_job(old) is None and not os.path.exists(ed.job_dir(old))
+    assert ed.get_job(recent)["status"] == "done" and os.path.isdir(ed.job_dir(recent))
+    assert ed.get_job(queued)["status"] == "queued"
+
+
+def test_simulated_expected_loss_matches_sum_of_pd_times_exposure(ed):
+    rng = np.random.default_rng(1)
+    pd_values = rng.uniform(0.005, 0.2, size=200)
+    exposure = rng.uniform(0.1, 2.0, size=200)
+
+    losses = ed.simulate_portfolio_losses(pd_values, exposure, rho=0.12, n_scenarios=50_000, seed=3)
+
+    expected = float(pd_values @ exposure)
+    assert losses.shape == (50_000,)
+    assert abs(losses.mean() - expected) < 4 * losses.std() / np.sqrt(len(losses))